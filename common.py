@@ -1,6 +1,9 @@
 import functools
 import time as timeimport
 import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
 from datetime import datetime, timedelta, date, time
 from typing import Callable, List, Optional, Tuple
 
@@ -119,6 +122,49 @@ yesterday = today - timedelta(days=1)
 day_before_yesterday = today - timedelta(days=2)
 
 
+@dataclass(frozen=True)
+class RunDate:
+    """Immutable reference date of a run - the 'today' that date offsets are counted from"""
+    today: date
+
+    @classmethod
+    def for_target(cls, target_date: date) -> 'RunDate':
+        """The run date for which target_date is yesterday"""
+        return cls(target_date + timedelta(days=1))
+
+    @property
+    def yesterday(self) -> date:
+        return self.today - timedelta(days=1)
+
+    @property
+    def day_before_yesterday(self) -> date:
+        return self.today - timedelta(days=2)
+
+    def date_for_offset(self, offset: int) -> date:
+        return self.today - timedelta(days=offset)
+
+    def offset_of(self, target_date: date) -> int:
+        return (self.today - target_date).days
+
+
+_run_date: ContextVar[Optional[RunDate]] = ContextVar('run_date', default=None)
+
+
+def get_run_date() -> RunDate:
+    """The run date of the current context, the actual date when none was set"""
+    return _run_date.get() or RunDate(date.today())
+
+
+@contextmanager
+def run_date_context(run_date: RunDate):
+    """Sets the run date for the current thread or task, new threads start without one"""
+    token = _run_date.set(run_date)
+    try:
+        yield run_date
+    finally:
+        _run_date.reset(token)
+
+
 def replace_none_with_list_or_string(d, replacements):
     # Check if replacements is not iterable (e.g., int, float), then treat it directly
     if isinstance(replacements, (int, float)):
@@ -188,12 +234,13 @@ def find_state_items(items_list, full_text, str_to_split):
     return ""
 
 
-def get_date_offset(date_str: str):
+def get_date_offset(date_str: str, run_date: Optional[RunDate] = None):
     # Parse the input string to a date object
     input_date = datetime.strptime(date_str, "%Y-%m-%d").date()
 
     # Calculate the difference in days
-    delta_days = (today - input_date).days
+    run_date = run_date or _run_date.get()
+    delta_days = run_date.offset_of(input_date) if run_date else (today - input_date).days
 
     return delta_days
 
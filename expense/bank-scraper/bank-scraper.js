@@ -16,6 +16,9 @@ const EXIT_CODES = {
 
 const TRANSACTION_STATUS_COMPLETED = 'completed';
 
+// When set, every completed transaction is also appended as a JSON line to this file (NDJSON)
+const STREAM_PATH = process.env.BANK_SCRAPER_STREAM_PATH;
+
 // Track successful and failed account scraping attempts
 const successfulAccounts = [];
 const failedAccounts = [];
@@ -148,6 +151,8 @@ async function postProcessTransactions(accountToScrape, scrapeResult) {
             // Sort transactions
             transactions.sort(transactionsDateComparator);
 
+            await streamTransactions(transactions);
+
             // Write transactions to file before returning
             try {
                 await fs.writeFile(process.argv[2], JSON.stringify(transactions, null, 2));
@@ -167,6 +172,21 @@ async function postProcessTransactions(accountToScrape, scrapeResult) {
     return [];
 }
 
+async function streamTransactions(transactions) {
+    if (!STREAM_PATH || transactions.length === 0) {
+        return;
+    }
+
+    try {
+        // A single append per account keeps every line whole for readers tailing the file
+        const lines = transactions.map(transaction => JSON.stringify(transaction)).join('\n') + '\n';
+        await fs.appendFile(STREAM_PATH, lines);
+        logger.debug(`Streamed ${transactions.length} transactions to ${STREAM_PATH}`);
+    } catch (error) {
+        logger.error('Failed to stream transactions', error);
+    }
+}
+
 function enrichTransaction(transaction, companyId, accountNumber) {
     try {
         const hash = calculateTransactionHash(transaction, companyId, accountNumber);
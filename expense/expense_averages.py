@@ -0,0 +1,127 @@
+"""
+Batched N-month averages for the monthly category expense database.
+All monthly category pages of the needed date range are fetched with a single query, grouped in memory by
+category and month, and every rolling average is computed from that one snapshot.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from dateutil.relativedelta import relativedelta
+
+from common import remove_emojis
+from expense.expense_helpers import get_amount_from_page
+from expense.expense_ledger import ExpenseLedger
+from logger import logger
+from notion_py.helpers.notion_common import get_db_pages, generate_payload
+
+AVERAGE_PROPERTY = "4 Months Average"
+
+
+def get_average_date_range(target_date: datetime, months_back: int) -> Tuple[datetime, datetime]:
+    """Range of the months averaged for target_date - the months_back months before its month"""
+    month_start = datetime(target_date.year, target_date.month, 1)
+    end_date = month_start - timedelta(days=1)  # Last day of previous month
+    start_date = (end_date - relativedelta(months=months_back - 1)).replace(day=1)
+    return start_date, end_date
+
+
+def _clean_category(category: str) -> str:
+    return remove_emojis(category).strip().lower()
+
+
+def get_page_category(page: Dict) -> Optional[str]:
+    try:
+        return page['properties']['Category']['title'][0]['plain_text']
+    except (KeyError, IndexError):
+        return None
+
+
+def get_page_month_start(page: Dict) -> Optional[datetime]:
+    try:
+        return datetime.strptime(page['properties']['Date']['date']['start'][:10], '%Y-%m-%d')
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class MonthlyAverages:
+    """In-memory snapshot of the monthly category pages, used to compute rolling averages"""
+
+    def __init__(self, pages: List[Dict], months_back: int = 4,
+                 local_totals: Optional[Dict[str, Dict[datetime, float]]] = None):
+        """
+        Args:
+            pages: Monthly category pages
+            months_back: Number of months averaged
+            local_totals: Category totals per month from the local ledger, used instead of the page totals
+        """
+        self.months_back = months_back
+        self.pages_by_month: Dict[str, List[Dict]] = defaultdict(list)
+        amounts_by_category: Dict[str, Dict[datetime, float]] = defaultdict(dict)
+
+        for page in pages:
+            category, month_start = get_page_category(page), get_page_month_start(page)
+            if not category or not month_start:
+                continue
+
+            self.pages_by_month[month_start.strftime("%m/%y")].append(page)
+            amounts_by_category[category][month_start] = get_amount_from_page(category, page)
+
+        clean_local_totals = {_clean_category(category): totals for category, totals in (local_totals or {}).items()}
+        self.totals_by_category: Dict[str, List[Tuple[datetime, float]]] = {}
+        for category, amounts in amounts_by_category.items():
+            amounts.update(clean_local_totals.get(_clean_category(category), {}))
+            self.totals_by_category[category] = sorted(
+                (month_start, amount) for month_start, amount in amounts.items() if amount)
+
+    @classmethod
+    def fetch(cls, db_id: str, target_dates: List[datetime], months_back: int = 4,
+              ledger: Optional[ExpenseLedger] = None) -> 'MonthlyAverages':
+        """Fetch every page needed to average and update the target months with one query"""
+        start_date = min(get_average_date_range(target_date, months_back)[0] for target_date in target_dates)
+        end_date = max(target_date.replace(day=1) + relativedelta(months=1) - timedelta(days=1)
+                       for target_date in target_dates)
+        local_totals = ledger.get_monthly_totals(start_date, end_date) if ledger else None
+
+        filter_payload = {
+            "property": "Date",
+            "date": {
+                "on_or_after": start_date.isoformat(),
+                "on_or_before": end_date.isoformat()
+            }
+        }
+        pages = get_db_pages(db_id, generate_payload(filter_payload))
+        logger.debug(f"Fetched {len(pages)} monthly category pages between {start_date.date()} and {end_date.date()}")
+        return cls(pages, months_back, local_totals)
+
+    def get_month_pages(self, target_date: datetime) -> List[Dict]:
+        return self.pages_by_month.get(target_date.strftime("%m/%y"), [])
+
+    def get_average(self, category: str, target_date: datetime) -> Optional[float]:
+        """The average of the most recent months_back monthly totals before target_date's month"""
+        start_date, end_date = get_average_date_range(target_date, self.months_back)
+        monthly_totals = [amount for month_start, amount in self.totals_by_category.get(category, [])
+                          if start_date <= month_start <= end_date][-self.months_back:]
+
+        if not monthly_totals:
+            return None
+
+        return round(sum(monthly_totals) / len(monthly_totals), 2)
+
+    def get_changed_averages(self, target_date: datetime,
+                             categories: Optional[List[str]] = None) -> List[Tuple[Dict, str, float]]:
+        """(page, category, average) for every page of target_date's month whose stored average is outdated"""
+        clean_categories = {_clean_category(category) for category in categories or []}
+        changed = []
+        for page in self.get_month_pages(target_date):
+            category = get_page_category(page)
+            if clean_categories and _clean_category(category) not in clean_categories:
+                continue
+
+            average = self.get_average(category, target_date)
+            existing_average = page['properties'].get(AVERAGE_PROPERTY, {}).get('number')
+            if average is None or average == existing_average:
+                continue
+
+            changed.append((page, category, average))
+        return changed
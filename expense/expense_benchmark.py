@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the expense pipeline on synthetic bank transactions.
+Generates realistic scraper output (Hebrew merchant names from the category keywords and modified names,
+installments, foreign currencies), runs every pipeline stage against an in-memory Notion stand-in and writes a
+JSON report that can be compared across commits.
+
+Usage:
+    python -m expense.expense_benchmark --sizes 1000 10000 100000 --output benchmark.json
+"""
+import argparse
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from unittest import mock
+
+from expense.expense_constants import ENGLISH_CATEGORY, MODIFIED_NAMES
+from expense.expense_helpers import get_name, get_category_name, get_category_definitions
+from expense.expense_ledger import ExpenseLedger
+from expense.expense_models import ExpenseField
+from expense.expense_relation_sync import RelationSync
+from expense.notion_expense_service import NotionExpenseService
+from logger import logger
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+BENCHMARK_MONTHS = 12
+EXPENSE_TRACKER_DB_ID = 'benchmark-expense-tracker'
+MONTHLY_CATEGORY_DB_ID = 'benchmark-monthly-category'
+REVERSE_RELATION = 'Monthly Category'
+
+MERCHANT_SUFFIXES = ["", " בע\"מ", " סניף מרכז", " תל אביב", " חיפה", " אונליין"]
+CURRENCIES = [('ILS', 0.85), ('USD', 0.1), ('EUR', 0.05)]
+EXCHANGE_RATES = {'ILS': 1.0, 'USD': 3.7, 'EUR': 4.0}
+ACCOUNT_NUMBERS = ['1234', '5678', '9012', '3456']
+
+
+class LocalNotion:
+    """In-memory stand-in for the Notion API calls used by the expense pipeline"""
+
+    def __init__(self):
+        self.pages: Dict[str, Dict] = {}
+        self.pages_by_db: Dict[str, List[str]] = defaultdict(list)
+        self.calls: Dict[str, int] = defaultdict(int)
+
+    def add_page(self, db_id: str, properties: Dict) -> Dict:
+        page = {'id': str(uuid.uuid4()), 'properties': properties}
+        self.pages[page['id']] = page
+        self.pages_by_db[db_id].append(page['id'])
+        return page
+
+    def create_page_with_db_dict(self, db_id, db_dict, property_overrides=None):
+        self.calls['create_page'] += 1
+        return self.add_page(db_id, {key: {'value': value} for key, value in db_dict.items()})
+
+    def update_page(self, page_id, update_payload, print_response=False):
+        self.calls['update_page'] += 1
+        page = self.pages.get(page_id)
+        if page is not None:
+            page['properties'].update(update_payload.get('properties', {}))
+        return page or {'id': page_id}
+
+    def get_page(self, page_id, get_children=False, print_response=False):
+        self.calls['get_page'] += 1
+        return self.pages[page_id]
+
+    def get_db_pages(self, db_id, get_db_payload=None, print_response=False, print_response_type=''):
+        self.calls['query_db'] += 1
+        return [self.pages[page_id] for page_id in self.pages_by_db[db_id]]
+
+    @contextmanager
+    def patched(self):
+        """Route the Notion helpers imported by the expense modules to this stand-in"""
+        targets = {
+            'expense.notion_expense_service.update_page': self.update_page,
+            'expense.notion_expense_service.get_db_pages': self.get_db_pages,
+            'expense.notion_expense_service.create_page_with_db_dict': self.create_page_with_db_dict,
+            'expense.expense_relation_sync.update_page': self.update_page,
+            'expense.expense_relation_sync.get_page': self.get_page,
+            'expense.expense_averages.get_db_pages': self.get_db_pages,
+        }
+        with ExitStack() as stack:
+            for target, replacement in targets.items():
+                stack.enter_context(mock.patch(target, replacement))
+            yield self
+
+
+def _merchant_names() -> List[str]:
+    names = [keyword for keywords in ENGLISH_CATEGORY.values() for keyword in keywords]
+    names += [name_dict[ExpenseField.NAME] for name_dicts in MODIFIED_NAMES.values() for name_dict in name_dicts]
+    return sorted(set(names))
+
+
+def generate_transactions(count: int, months: int = BENCHMARK_MONTHS, seed: int = 42) -> List[Dict]:
+    """Generate scraper-like transactions spread over the last months"""
+    rng = random.Random(seed)
+    merchants = _merchant_names()
+    currencies, weights = zip(*CURRENCIES)
+    now = datetime.now()
+
+    transactions = []
+    for i in range(count):
+        date = now - timedelta(days=rng.randint(0, months * 30 - 1), hours=rng.randint(0, 23))
+        currency = rng.choices(currencies, weights)[0]
+        original_amount = round(rng.uniform(5, 2500), 2)
+        charged_amount = round(original_amount * EXCHANGE_RATES[currency], 2)
+        is_income = rng.random() < 0.03
+        is_installment = not is_income and rng.random() < 0.1
+
+        memo = ''
+        if is_installment:
+            total_payments = rng.choice([3, 6, 10, 12, 24])
+            memo = f"תשלום {rng.randint(1, total_payments)} מתוך {total_payments}"
+
+        transactions.append({
+            'type': 'installments' if is_installment else 'normal',
+            'identifier': i,
+            'date': date.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'processedDate': (date + timedelta(days=rng.randint(0, 30))).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'originalAmount': original_amount if is_income else -original_amount,
+            'originalCurrency': currency,
+            'chargedAmount': charged_amount if is_income else -charged_amount,
+            'chargedCurrency': 'ILS',
+            'description': rng.choice(merchants) + rng.choice(MERCHANT_SUFFIXES),
+            'memo': memo,
+            'category': rng.choice(['', 'מזון וצריכה', 'שונות', 'רפואה וטיפוח']),
+            'status': 'completed',
+            'accountNumber': rng.choice(ACCOUNT_NUMBERS),
+        })
+    return transactions
+
+
+def seed_monthly_pages(notion: LocalNotion, month_dates: List[datetime]):
+    """Create the monthly category pages the aggregation stage writes to"""
+    categories = [list(category_dict.keys())[0] for category_dict in get_category_definitions()]
+    for month_date in month_dates:
+        for category in categories:
+            notion.add_page(MONTHLY_CATEGORY_DB_ID, {
+                'Category': {'title': [{'plain_text': category}]},
+                'Month': {'rich_text': [{'plain_text': month_date.strftime('%m/%y')}]},
+                'Date': {'date': {'start': month_date.strftime('%Y-%m-01')}},
+                'Expenses': {'id': 'expenses', 'relation': [], 'has_more': False},
+                'Total': {'formula': {'number': None}},
+                'Monthly Expenses': {'number': None},
+                '4 Months Average': {'number': None},
+            })
+
+
+class StageTimer:
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        yield
+        self.timings[name] = round(time.perf_counter() - start, 4)
+
+
+def run_benchmark(size: int) -> Dict:
+    """Run every pipeline stage for a synthetic data set of the given size"""
+    timer = StageTimer()
+    notion = LocalNotion()
+
+    with timer.stage('generate_transactions'):
+        transactions = generate_transactions(size)
+
+    service = NotionExpenseService(EXPENSE_TRACKER_DB_ID, MONTHLY_CATEGORY_DB_ID)
+    service._ledger = ExpenseLedger(':memory:')
+    # Large synthetic months go over the relation limit, so sync them from the expense side
+    service.relation_sync = RelationSync(reverse_property_name=REVERSE_RELATION)
+
+    with notion.patched():
+        with timer.stage('categorize'):
+            for transaction in transactions:
+                name = get_name(transaction['description'], abs(transaction['chargedAmount']))
+                get_category_name(name, transaction['category'], transaction['chargedAmount'])
+
+        with timer.stage('create_expense_objects'):
+            service.expense_json = transactions
+            expenses = service.create_expense_objects_from_json()
+
+        # Half of the expenses are already in Notion
+        existing_expenses = expenses[::2]
+        for expense in existing_expenses:
+            expense.page_id = str(uuid.uuid4())
+
+        with timer.stage('dedup'):
+            service.existing_expenses_objects = existing_expenses
+            service.expenses_objects_to_create = expenses
+            expenses_to_add = service.get_notion_that_can_be_added_not_present_in_notion()
+
+        with timer.stage('add_to_notion'):
+            service.add_expenses_to_notion(expenses_to_add)
+
+        with timer.stage('ledger_upsert'):
+            service.ledger.upsert_expenses(expenses)
+
+        month_dates = sorted({datetime.strptime(expense.date[:7], '%Y-%m') for expense in expenses})
+        seed_monthly_pages(notion, month_dates)
+        expenses_by_month = defaultdict(list)
+        for expense in expenses:
+            expenses_by_month[expense.date[:7]].append(expense)
+
+        with timer.stage('monthly_aggregation'):
+            for month_date in month_dates:
+                monthly_pages = service._get_monthly_pages(month_date.strftime('%m/%y'))
+                monthly_pages = [page for page in monthly_pages
+                                 if page['properties']['Month']['rich_text'][0]['plain_text'] ==
+                                 month_date.strftime('%m/%y')]
+                service._write_month_expenses(month_date, monthly_pages,
+                                              expenses_by_month[month_date.strftime('%Y-%m')])
+
+        with timer.stage('averages'):
+            service.update_averages_for_months(month_dates)
+
+    return {
+        'rows': size,
+        'expenses_created': len(expenses),
+        'expenses_added': len(expenses_to_add),
+        'months': len(month_dates),
+        'timings': timer.timings,
+        'rows_per_second': {stage: round(size / seconds) if seconds else None
+                            for stage, seconds in timer.timings.items()},
+        'notion_calls': dict(notion.calls),
+    }
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> Dict:
+    parser = argparse.ArgumentParser(description="Benchmark the expense pipeline on synthetic transactions")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Number of transactions")
+    parser.add_argument('--output', default='expense_benchmark.json', help="Path of the JSON report")
+    args = parser.parse_args(argv)
+
+    # Per expense info logs would dominate the timings
+    previous_level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        results = []
+        for size in args.sizes:
+            print(f"Benchmarking {size} transactions...", file=sys.stderr)
+            results.append(run_benchmark(size))
+    finally:
+        logger.setLevel(previous_level)
+
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'commit': get_git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for result in results:
+        timings = ', '.join(f"{stage}={seconds}s" for stage, seconds in result['timings'].items())
+        print(f"{result['rows']} rows: {timings}", file=sys.stderr)
+    print(f"Report written to {args.output}", file=sys.stderr)
+    return report
+
+
+if __name__ == "__main__":
+    main()
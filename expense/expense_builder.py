@@ -0,0 +1,175 @@
+"""
+Batch construction of Expense objects from scraped transactions.
+Descriptions, categories and date strings repeat heavily across a transaction history, so each distinct value is
+normalized once per batch and shared by every transaction that has it. Installment transactions recorded in an
+earlier run reuse their stored payments instead of parsing the memo again. Very large histories are split into chunks
+built in a process pool. Failed transactions are collected in a report instead of being logged one by one.
+"""
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from common import parse_expense_date, adjust_month_end_dates
+from expense.expense_constants import EXPENSE_TYPES, CURRENCY_SYMBOLS, EXPENSES_TO_ADJUST_DATE, \
+    EXPENSE_BUILD_PROCESS_THRESHOLD, EXPENSE_BUILD_MAX_PROCESSES
+from expense.expense_helpers import get_name, get_category_name, get_remaining_credit, parse_payment_string
+from expense.expense_models import Expense
+
+DATE_ADJUSTED_NAMES = frozenset(EXPENSES_TO_ADJUST_DATE)
+
+
+@dataclass
+class BuildError:
+    """A transaction that could not be converted to an Expense"""
+    index: int
+    description: str
+    error: str
+
+
+@dataclass
+class BuildReport:
+    """Result of building a batch of transactions"""
+    expenses: List[Expense] = field(default_factory=list)
+    errors: List[BuildError] = field(default_factory=list)
+    # Installment expenses with their get_remaining_credit result
+    installments: List[Tuple[Expense, Dict]] = field(default_factory=list)
+
+    def extend(self, other: 'BuildReport'):
+        self.expenses.extend(other.expenses)
+        self.errors.extend(other.errors)
+        self.installments.extend(other.installments)
+
+    def error_summary(self) -> Dict[str, int]:
+        """Number of failed transactions per error"""
+        return dict(Counter(build_error.error for build_error in self.errors))
+
+
+class ExpenseBuilder:
+    """Converts scraped transactions to Expense objects, caching the normalization of repeated values"""
+
+    def __init__(self, known_installments: Optional[Dict[str, Tuple[int, int]]] = None):
+        # Transaction hash to the (payment number, total payments) of installments recorded in an earlier run
+        self.known_installments = known_installments or {}
+        self._names: Dict[Tuple[str, float], str] = {}
+        self._categories: Dict[Tuple[str, str, bool], str] = {}
+        self._dates: Dict[Tuple[str, bool], str] = {}
+
+    def get_name(self, original_name: str, price: float) -> str:
+        key = (original_name, price)
+        if key not in self._names:
+            self._names[key] = get_name(original_name, price)
+        return self._names[key]
+
+    def get_category(self, expense_name: str, he_category: str, price: float) -> str:
+        # get_category_name only uses the price to tell income apart
+        key = (expense_name, he_category, price > 0)
+        if key not in self._categories:
+            self._categories[key] = get_category_name(expense_name, he_category, price)
+        return self._categories[key]
+
+    def get_date(self, date_str: str, adjust_month_end: bool) -> str:
+        key = (date_str, adjust_month_end)
+        if key not in self._dates:
+            date = parse_expense_date(date_str)
+            self._dates[key] = adjust_month_end_dates(date) if adjust_month_end else date
+        return self._dates[key]
+
+    def build_one(self, expense_data: Dict) -> Tuple[Expense, Dict]:
+        """
+        Convert a single scraped transaction.
+
+        Returns:
+            Tuple[Expense, Dict]: The expense and its get_remaining_credit result, empty unless it is an installment
+
+        Raises:
+            KeyError: When a required field is missing
+            ValueError: When a date cannot be parsed
+        """
+        original_name = expense_data['description']
+        if "מאסטרקרד" in original_name:
+            original_name = str(expense_data.get('identifier', '')) + " - " + original_name
+
+        expense_name = self.get_name(original_name, abs(expense_data['chargedAmount']))
+        category = self.get_category(expense_name, expense_data.get('category', ''), expense_data['chargedAmount'])
+
+        expense_type = EXPENSE_TYPES.get(expense_data['type'], expense_data['type'])
+        charged_currency = CURRENCY_SYMBOLS.get(expense_data.get('chargedCurrency', 'ILS'))
+        original_memo = expense_data.get('memo', '')
+
+        adjust_month_end = expense_name in DATE_ADJUSTED_NAMES
+        expense = Expense(
+            expense_type=expense_type,
+            date=self.get_date(expense_data['date'], adjust_month_end),
+            processed_date=self.get_date(expense_data['processedDate'], adjust_month_end),
+            original_amount=abs(expense_data['originalAmount']),
+            original_currency=expense_data['originalCurrency'],
+            charged_amount=abs(expense_data['chargedAmount']),
+            charged_currency=charged_currency,
+            description=expense_name,
+            category=category,
+            memo=original_memo,
+            status=expense_data['status'],
+            account_number=expense_data['accountNumber'],
+            original_name=original_name,
+            sub_category="",
+            page_id=None  # Will be set when added to Notion
+        )
+
+        # Process credit/installment information, then update the memo with the payment information
+        known_installment = self.known_installments.get(expense.hash_code()) if expense_type == 'Credit' else None
+        remaining_credit_dict = get_remaining_credit(original_memo, expense.original_amount, expense_type,
+                                                     known_installment)
+        expense.memo = parse_payment_string(remaining_credit_dict, original_memo, charged_currency)
+        expense.remaining_amount = max(remaining_credit_dict.get('remaining_amount', 0), 0)
+        return expense, remaining_credit_dict
+
+    def build(self, transactions: List[Dict], start_index: int = 0) -> BuildReport:
+        """Convert a batch of transactions in this process"""
+        report = BuildReport()
+        for index, expense_data in enumerate(transactions, start_index):
+            try:
+                expense, remaining_credit_dict = self.build_one(expense_data)
+            except KeyError as ke:
+                report.errors.append(BuildError(index, _describe(expense_data), f"Missing required field {ke}"))
+                continue
+            except Exception as e:
+                report.errors.append(BuildError(index, _describe(expense_data), str(e)))
+                continue
+
+            report.expenses.append(expense)
+            if remaining_credit_dict:
+                report.installments.append((expense, remaining_credit_dict))
+        return report
+
+
+def _describe(expense_data) -> str:
+    return expense_data.get('description', 'Unknown') if isinstance(expense_data, dict) else repr(expense_data)
+
+
+def _build_chunk(chunk: Tuple[List[Dict], int, Dict[str, Tuple[int, int]]]) -> BuildReport:
+    transactions, start_index, known_installments = chunk
+    return ExpenseBuilder(known_installments).build(transactions, start_index)
+
+
+def build_expenses(transactions: List[Dict], max_processes: Optional[int] = EXPENSE_BUILD_MAX_PROCESSES,
+                   process_threshold: int = EXPENSE_BUILD_PROCESS_THRESHOLD,
+                   known_installments: Optional[Dict[str, Tuple[int, int]]] = None) -> BuildReport:
+    """
+    Convert scraped transactions to Expense objects, in a process pool when there are more than process_threshold.
+    Expenses are returned in the order of the transactions.
+    """
+    processes = max_processes or os.cpu_count() or 1
+    if len(transactions) <= process_threshold or processes == 1:
+        return ExpenseBuilder(known_installments).build(transactions)
+
+    chunk_size = -(-len(transactions) // processes)
+    chunks = [(transactions[i:i + chunk_size], i, known_installments or {})
+              for i in range(0, len(transactions), chunk_size)]
+
+    report = BuildReport()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for chunk_report in executor.map(_build_chunk, chunks):
+            report.extend(chunk_report)
+    return report
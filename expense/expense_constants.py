@@ -22,6 +22,56 @@ BANK_SCRAPER_NODE_SCRIPT_PATH = os.path.join(BANK_SCRAPER_DIRECTORY, "bank-scrap
 CREATE_EXPENSE_FILE_IF_ALREADY_MODIFIED_TODAY = True
 BANK_SCRAPER_RETRIES = 2
 
+# Parallel scraping - each credential source writes its own shard which is merged into the output file
+BANK_SCRAPER_PARALLEL = True
+BANK_SCRAPER_MAX_WORKERS = 3
+BANK_SCRAPER_SOURCE_TIMEOUT = 300  # Seconds per credential source
+BANK_SCRAPER_SHARDS_DIR = os.path.join(BANK_SCRAPER_OUTPUT_DIR, "shards")
+
+# Per account scrape cache - accounts scraped successfully within the TTL are merged from the cache, not re-scraped
+BANK_SCRAPER_CACHE_ENABLED = True
+BANK_SCRAPER_CACHE_DIR = os.path.join(BANK_SCRAPER_OUTPUT_DIR, "cache")
+BANK_SCRAPER_CACHE_TTL_HOURS = 12
+
+# Scraper supervision - kill the scraper when it stops producing output, and optionally when a credential is rejected
+BANK_SCRAPER_STALL_TIMEOUT = 180  # Seconds without any output before the scraper is considered stalled
+# Off by default - killing the scraper stops every other source too, a rejected credential is retried on its own
+BANK_SCRAPER_FAIL_FAST_ON_CREDENTIAL_ERROR = False
+BANK_SCRAPER_CREDENTIAL_ERROR_TYPES = ["INVALID_PASSWORD", "CHANGE_PASSWORD", "ACCOUNT_BLOCKED", "VALIDATION_ERROR"]
+
+# NDJSON streaming - the node scraper appends one JSON line per transaction to this file while it runs,
+# so expenses are processed while scraping continues
+BANK_SCRAPER_STREAM_NDJSON = True
+BANK_SCRAPER_NDJSON_FILE_PATH = os.path.join(BANK_SCRAPER_OUTPUT_DIR, "transactions.ndjson")
+BANK_SCRAPER_STREAM_PATH_ENV = "BANK_SCRAPER_STREAM_PATH"
+BANK_SCRAPER_LOOKBACK_DAYS = 30  # Must match the startDate used by bank-scraper.js
+
+# Incremental sync - the last synced processed date per account limits the Notion dedup query to the overlap window
+SYNC_WATERMARK_FILE_PATH = os.path.join(BANK_SCRAPER_OUTPUT_DIR, "sync_watermark.json")
+SYNC_WATERMARK_MARGIN_DAYS = 7  # Month end date adjustments can move processed dates by a few days
+EXPENSE_DEDUP_WINDOW_DAYS = 145
+
+# Local ledger - SQLite mirror of the Notion expenses used for dedup, aggregation and averages
+EXPENSE_LEDGER_ENABLED = True
+EXPENSE_LEDGER_DB_PATH = os.path.join(BANK_SCRAPER_OUTPUT_DIR, "expense_ledger.db")
+# Pages edited in Notion are re-pulled on every run, pages deleted in Notion are only dropped by a full re-pull
+EXPENSE_LEDGER_SYNC_TTL_HOURS = 24
+
+# Relation sync - Notion accepts up to 100 related pages per relation value in a single request
+NOTION_RELATION_LIMIT = 100
+RELATION_SYNC_MAX_WORKERS = 4
+# Reverse (dual) relation property on expense pages that points to the monthly category page, used to add and
+# remove single expenses when a category relation exceeds NOTION_RELATION_LIMIT. None when the relation is one way,
+# then such a category keeps its total but its relation is left as is.
+EXPENSE_MONTHLY_CATEGORY_RELATION = None
+
+# Backfill - number of months written to Notion concurrently
+BACKFILL_MAX_WORKERS = 4
+
+# Batch expense construction - histories larger than the threshold are split across a process pool
+EXPENSE_BUILD_PROCESS_THRESHOLD = 50000
+EXPENSE_BUILD_MAX_PROCESSES = None  # Defaults to the number of CPUs
+
 # Category constants
 DEFAULT_CATEGORY = 'Other 🗂️'
 
@@ -211,9 +261,38 @@ def last_4_months_expense_filter() -> Dict:
     }
 
 
+def expense_date_range_filter(start: str, end: str) -> Dict:
+    return {
+        "property": "Date",
+        "date": {
+            "on_or_after": start,
+            "on_or_before": end
+        }
+    }
+
+
+def processed_date_range_filter(start: str, end: str) -> Dict:
+    return {
+        "property": "Processed Date",
+        "date": {
+            "on_or_after": start,
+            "on_or_before": end
+        }
+    }
+
+
+def last_edited_since_filter(edited_since: str) -> Dict:
+    return {
+        "timestamp": "last_edited_time",
+        "last_edited_time": {
+            "on_or_after": edited_since
+        }
+    }
+
+
 last_4_months_months_expense_filter = {
     "property": "Processed Date",
     "date": {
-        "on_or_after": (today - timedelta(days=145)).isoformat()
+        "on_or_after": (today - timedelta(days=EXPENSE_DEDUP_WINDOW_DAYS)).isoformat()
     }
 }
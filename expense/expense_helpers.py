@@ -4,9 +4,10 @@ Helper functions for expense processing.
 import json
 import os
 import re
+import time
 from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Dict, Optional, List, Tuple, DefaultDict
+from typing import Dict, Optional, List, Tuple, DefaultDict, Callable, Iterator
 
 from dateutil.relativedelta import relativedelta
 
@@ -14,42 +15,41 @@ from common import calculate_month_boundaries
 from logger import logger
 from expense.expense_constants import MODIFIED_NAMES, ENGLISH_CATEGORY, DEFAULT_CATEGORY, ENGLISH_SUB_CATEGORIES, \
     BANK_SCRAPER_OUTPUT_FILE_PATH
+from expense.expense_installments import parse_installment_memo
 from expense.expense_models import ExpenseField
 from notion_py.helpers.notion_common import generate_icon_url
 from notion_py.notion_globals import IconType, IconColor, NotionPropertyType
 from variables import CHEN_CAL, ARIEL_MAX, CHEN_MAX, ACCOUNT_NUMBER_TO_PERSON_CARD
 
 
-def get_remaining_credit(memo: str, price: float, credit: str) -> Dict:
-    """Calculate remaining credit for installment payments"""
+def get_remaining_credit(memo: str, price: float, credit: str,
+                         installment: Optional[Tuple[int, int]] = None) -> Dict:
+    """
+    Calculate remaining credit for installment payments.
+    installment is the (payment number, total payments) of a transaction parsed in an earlier run, the memo is
+    parsed when it is not given.
+    """
     if credit != 'Credit':
         return {}
 
-    patterns = [
-        r"תשלום (\d+) מתוך (\d+)",
-        r"(\d+) מתוך (\d+) - סכום העסקה"
-    ]
-
-    for pattern in patterns:
-        match = re.search(pattern, memo)
-        if match:
-            payment_number = int(match.group(1))
-            total_payments = int(match.group(2))
+    installment = installment or parse_installment_memo(memo)
+    if installment:
+        payment_number, total_payments = installment
 
-            if payment_number == total_payments:
-                return {
-                    "remaining_amount": 0,
-                    "payment_number": payment_number,
-                    "total_payments": total_payments
-                }
-
-            remaining_amount = price * (total_payments - payment_number) / total_payments
+        if payment_number == total_payments:
             return {
-                "remaining_amount": remaining_amount,
+                "remaining_amount": 0,
                 "payment_number": payment_number,
                 "total_payments": total_payments
             }
 
+        remaining_amount = price * (total_payments - payment_number) / total_payments
+        return {
+            "remaining_amount": remaining_amount,
+            "payment_number": payment_number,
+            "total_payments": total_payments
+        }
+
     return {}
 
 
@@ -377,6 +377,52 @@ def load_data_from_json() -> Dict:
     return {}
 
 
+def iter_ndjson_transactions(file_path: str, is_writer_running: Optional[Callable[[], bool]] = None,
+                             poll_interval: float = 0.5) -> Iterator[Dict]:
+    """
+    Yield transactions from an NDJSON file one line at a time.
+    While is_writer_running() returns True the file is followed like `tail -f`, so transactions are
+    yielded as the scraper appends them. Only the current line is held in memory.
+    """
+    is_writer_running = is_writer_running or (lambda: False)
+
+    while not os.path.exists(file_path):
+        if not is_writer_running():
+            logger.info(f"NDJSON file {file_path} was not created")
+            return
+        time.sleep(poll_interval)
+
+    with open(file_path, 'r') as f:
+        partial_line = ''
+        while True:
+            line = f.readline()
+            if line:
+                partial_line += line
+                if not partial_line.endswith('\n'):
+                    continue  # The writer is in the middle of this line
+                line, partial_line = partial_line.strip(), ''
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.error(f"Skipping invalid NDJSON line: {line[:200]}")
+                continue
+
+            if is_writer_running():
+                time.sleep(poll_interval)
+                continue
+
+            # Writer finished - drain whatever was appended since the last read
+            remaining = (partial_line + f.read()).splitlines()
+            for line in filter(None, (line.strip() for line in remaining)):
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.error(f"Skipping invalid NDJSON line: {line[:200]}")
+            return
+
+
 def group_expenses_by_category(expenses):
     """Groups expenses by their target category"""
     expenses_by_category = defaultdict(list)
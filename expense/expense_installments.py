@@ -0,0 +1,163 @@
+"""
+Installment schedules of credit purchases.
+Each installment transaction is parsed once into the schedule of its purchase - the first charge month, the number
+of payments and the payment amount - and stored in the ledger, together with the hash and parsed payments of the
+transaction, so a later run neither parses its memo nor records it again. Committed spend is indexed by month when
+a schedule is added, so "how much is already committed for month X" is a single dict lookup.
+"""
+import hashlib
+import re
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+
+from expense.expense_models import Expense
+from logger import logger
+
+if TYPE_CHECKING:
+    from expense.expense_ledger import ExpenseLedger
+
+INSTALLMENT_PATTERNS = [
+    re.compile(r"תשלום (\d+) מתוך (\d+)"),
+    re.compile(r"(\d+) מתוך (\d+) - סכום העסקה")
+]
+
+
+@lru_cache(maxsize=4096)
+def parse_installment_memo(memo: str) -> Optional[Tuple[int, int]]:
+    """(payment number, total payments) of an installment memo, None if it is not one"""
+    for pattern in INSTALLMENT_PATTERNS:
+        match = pattern.search(memo)
+        if match:
+            return int(match.group(1)), int(match.group(2))
+    return None
+
+
+def add_months(month: str, months: int) -> str:
+    """Add months to a 'YYYY-MM' month"""
+    year, month_number = divmod(int(month[:4]) * 12 + int(month[5:7]) - 1 + months, 12)
+    return f"{year:04d}-{month_number + 1:02d}"
+
+
+def to_month(month: Union[str, datetime]) -> str:
+    return month.strftime('%Y-%m') if isinstance(month, datetime) else str(month)[:7]
+
+
+@dataclass(frozen=True)
+class InstallmentSchedule:
+    """Payment schedule of a single credit purchase"""
+    purchase_key: str
+    name: str
+    person_card: str
+    first_month: str  # YYYY-MM of the first payment
+    total_payments: int
+    payment_amount: float
+    last_payment_number: int  # Latest payment seen in a transaction
+
+    @classmethod
+    def from_expense(cls, expense: Expense, payment_number: int, total_payments: int) -> 'InstallmentSchedule':
+        charge_month = str(expense.processed_date or expense.date)[:7]
+        first_month = add_months(charge_month, 1 - payment_number)
+        purchase_identity = f"{expense.person_card}{expense.name}{first_month}{total_payments}{expense.original_amount}"
+        return cls(
+            purchase_key=hashlib.md5(purchase_identity.encode()).hexdigest(),
+            name=expense.name,
+            person_card=expense.person_card,
+            first_month=first_month,
+            total_payments=total_payments,
+            payment_amount=expense.charged_amount,
+            last_payment_number=payment_number
+        )
+
+    @property
+    def last_month(self) -> str:
+        return add_months(self.first_month, self.total_payments - 1)
+
+    @property
+    def months(self) -> List[str]:
+        return [add_months(self.first_month, i) for i in range(self.total_payments)]
+
+    @property
+    def remaining_amount(self) -> float:
+        return self.payment_amount * (self.total_payments - self.last_payment_number)
+
+
+class InstallmentEngine:
+    """Installment schedules of all known credit purchases, indexed by charge month"""
+
+    def __init__(self, ledger: Optional['ExpenseLedger'] = None):
+        self.ledger = ledger
+        self.schedules: Dict[str, InstallmentSchedule] = {}
+        # Transaction hash to the (payment number, total payments) of every recorded installment transaction
+        self.recorded_installments: Dict[str, Tuple[int, int]] = {}
+        self._committed_by_month: Dict[str, float] = defaultdict(float)
+        self._unsaved: Dict[str, InstallmentSchedule] = {}
+        self._unsaved_transactions: Dict[str, Tuple[str, int, int]] = {}
+        self._lock = threading.Lock()
+
+        if ledger:
+            for schedule in ledger.get_installment_schedules():
+                self._index(schedule)
+            self.recorded_installments = ledger.get_installment_transactions()
+
+    def record(self, expense: Expense, payment_number: int, total_payments: int) -> Optional[InstallmentSchedule]:
+        """Add the schedule of an installment transaction, transactions that were already recorded are skipped"""
+        expense_hash = expense.hash_code()
+        with self._lock:
+            if expense_hash in self.recorded_installments:
+                return None
+            self.recorded_installments[expense_hash] = (payment_number, total_payments)
+
+            schedule = InstallmentSchedule.from_expense(expense, payment_number, total_payments)
+            self._unsaved_transactions[expense_hash] = (schedule.purchase_key, payment_number, total_payments)
+            existing = self.schedules.get(schedule.purchase_key)
+            if existing and existing.last_payment_number >= payment_number:
+                return existing
+
+            self._index(schedule)
+            self._unsaved[schedule.purchase_key] = schedule
+            return schedule
+
+    def record_credit(self, expense: Expense, remaining_credit_dict: Dict) -> Optional[InstallmentSchedule]:
+        """Add the schedule from the result of get_remaining_credit"""
+        if not remaining_credit_dict:
+            return None
+        return self.record(expense, remaining_credit_dict['payment_number'], remaining_credit_dict['total_payments'])
+
+    def save(self):
+        """Store the new and advanced schedules, and the transactions recorded into them, in the ledger"""
+        with self._lock:
+            schedules, self._unsaved = list(self._unsaved.values()), {}
+            transactions, self._unsaved_transactions = self._unsaved_transactions, {}
+        if self.ledger and schedules:
+            self.ledger.save_installment_schedules(schedules)
+            logger.debug(f"Saved {len(schedules)} installment schedules")
+        if self.ledger and transactions:
+            self.ledger.save_installment_transactions(transactions)
+
+    def get_committed_spend(self, month: Union[str, datetime]) -> float:
+        """Total installment payments scheduled for the month"""
+        return round(self._committed_by_month.get(to_month(month), 0.0), 2)
+
+    def get_committed_spend_by_month(self, start_month: Union[str, datetime], months: int) -> Dict[str, float]:
+        """Committed spend of each of the months from start_month"""
+        start_month = to_month(start_month)
+        return {add_months(start_month, i): self.get_committed_spend(add_months(start_month, i))
+                for i in range(months)}
+
+    def get_active_schedules(self, month: Union[str, datetime]) -> List[InstallmentSchedule]:
+        month = to_month(month)
+        return [schedule for schedule in self.schedules.values()
+                if schedule.first_month <= month <= schedule.last_month]
+
+    def _index(self, schedule: InstallmentSchedule):
+        existing = self.schedules.get(schedule.purchase_key)
+        if existing:
+            for month in existing.months:
+                self._committed_by_month[month] -= existing.payment_amount
+        for month in schedule.months:
+            self._committed_by_month[month] += schedule.payment_amount
+        self.schedules[schedule.purchase_key] = schedule
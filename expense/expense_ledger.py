@@ -0,0 +1,301 @@
+"""
+Local SQLite ledger of the expenses synced to Notion.
+Every expense page created in or read from Notion is stored with its page id, so dedup, monthly aggregation
+and averages are computed locally and Notion is only written to.
+"""
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from expense.expense_constants import EXPENSE_LEDGER_DB_PATH, EXPENSE_LEDGER_SYNC_TTL_HOURS
+from expense.expense_installments import InstallmentSchedule
+from expense.expense_models import Expense
+from expense.expense_month_snapshot import MonthSnapshot
+from logger import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS expenses (
+    page_id TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    name TEXT NOT NULL,
+    original_name TEXT,
+    expense_type TEXT,
+    date TEXT NOT NULL,
+    processed_date TEXT,
+    original_amount REAL,
+    original_currency TEXT,
+    charged_amount REAL,
+    charged_currency TEXT,
+    memo TEXT,
+    category TEXT,
+    sub_category TEXT,
+    status TEXT,
+    account_number TEXT,
+    person_card TEXT,
+    remaining_amount REAL
+);
+CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses (date);
+CREATE INDEX IF NOT EXISTS idx_expenses_processed_date ON expenses (processed_date);
+CREATE INDEX IF NOT EXISTS idx_expenses_category ON expenses (category);
+CREATE INDEX IF NOT EXISTS idx_expenses_person_card ON expenses (person_card);
+CREATE INDEX IF NOT EXISTS idx_expenses_hash ON expenses (hash);
+
+CREATE TABLE IF NOT EXISTS monthly_category_totals (
+    month TEXT NOT NULL,
+    category TEXT NOT NULL,
+    total REAL NOT NULL,
+    PRIMARY KEY (month, category)
+);
+
+CREATE TABLE IF NOT EXISTS installment_schedules (
+    purchase_key TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    person_card TEXT,
+    first_month TEXT NOT NULL,
+    total_payments INTEGER NOT NULL,
+    payment_amount REAL NOT NULL,
+    last_payment_number INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS installment_transactions (
+    hash TEXT PRIMARY KEY,
+    purchase_key TEXT NOT NULL,
+    payment_number INTEGER NOT NULL,
+    total_payments INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS month_snapshots (
+    month TEXT PRIMARY KEY,
+    snapshot TEXT NOT NULL,
+    closed INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+EXPENSE_COLUMNS = ['page_id', 'hash', 'name', 'original_name', 'expense_type', 'date', 'processed_date',
+                   'original_amount', 'original_currency', 'charged_amount', 'charged_currency', 'memo', 'category',
+                   'sub_category', 'status', 'account_number', 'person_card', 'remaining_amount']
+
+INSTALLMENT_COLUMNS = ['purchase_key', 'name', 'person_card', 'first_month', 'total_payments', 'payment_amount',
+                       'last_payment_number']
+
+SYNCED_FROM_KEY = 'synced_from'
+SYNCED_AT_KEY = 'synced_at'  # When the synced window was last pulled from Notion in full
+REFRESHED_AT_KEY = 'refreshed_at'  # When the pages edited in Notion were last pulled
+
+
+class ExpenseLedger:
+    """SQLite mirror of the Notion expense tracker database"""
+
+    def __init__(self, db_path: str = EXPENSE_LEDGER_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        if db_path != ':memory:':
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    # Sync state
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else None
+
+    def _set_meta(self, values: Dict[str, str]):
+        with self._lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", values.items())
+
+    def get_synced_from(self) -> Optional[str]:
+        return self._get_meta(SYNCED_FROM_KEY)
+
+    def get_refreshed_at(self) -> Optional[str]:
+        return self._get_meta(REFRESHED_AT_KEY)
+
+    def is_sync_expired(self, ttl_hours: float = EXPENSE_LEDGER_SYNC_TTL_HOURS) -> bool:
+        """Whether the synced window was pulled in full longer than the TTL ago, so deleted pages may remain"""
+        synced_at = self._get_meta(SYNCED_AT_KEY)
+        if synced_at is None:
+            return True
+        return datetime.now(timezone.utc) - datetime.fromisoformat(synced_at) > timedelta(hours=ttl_hours)
+
+    def is_synced_since(self, start_date: str) -> bool:
+        """Whether the ledger mirrors every Notion expense processed on or after start_date"""
+        synced_from = self.get_synced_from()
+        return synced_from is not None and synced_from <= start_date[:10] and not self.is_sync_expired()
+
+    # Writes
+    def upsert_expenses(self, expenses: Iterable[Expense]) -> int:
+        """Store expenses that have a Notion page id, replacing previous versions of the same pages"""
+        rows = [_expense_to_row(expense) for expense in expenses if expense.page_id]
+        if not rows:
+            return 0
+
+        placeholders = ', '.join('?' for _ in EXPENSE_COLUMNS)
+        with self._lock, self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO expenses ({', '.join(EXPENSE_COLUMNS)}) VALUES ({placeholders})", rows)
+        return len(rows)
+
+    def replace_processed_range(self, expenses: List[Expense], start_date: str, end_date: Optional[str] = None):
+        """
+        Replace the ledger rows processed in the range with a fresh Notion snapshot of the same range,
+        so pages deleted from Notion are removed from the ledger too.
+        """
+        with self._lock, self.connection:
+            if end_date:
+                self.connection.execute("DELETE FROM expenses WHERE processed_date BETWEEN ? AND ?",
+                                        (start_date, end_date))
+            else:
+                self.connection.execute("DELETE FROM expenses WHERE processed_date >= ?", (start_date,))
+        stored_count = self.upsert_expenses(expenses)
+        logger.debug(f"Ledger synced {stored_count} expenses processed from {start_date} to {end_date or 'now'}")
+
+    def mark_synced_from(self, start_date: str, pulled_at: datetime):
+        """
+        Record that every expense processed from start_date was pulled from Notion at pulled_at (UTC).
+        An expired window is replaced, a valid one is only extended so its older part keeps its own TTL.
+        """
+        if self.is_sync_expired():
+            self._set_meta({SYNCED_FROM_KEY: start_date[:10], SYNCED_AT_KEY: pulled_at.isoformat(),
+                            REFRESHED_AT_KEY: pulled_at.isoformat()})
+            return
+        synced_from = self.get_synced_from()
+        if synced_from is None or start_date[:10] < synced_from:
+            self._set_meta({SYNCED_FROM_KEY: start_date[:10]})
+
+    def mark_refreshed(self, pulled_at: datetime):
+        """Record that the pages edited in Notion up to pulled_at (UTC) were pulled"""
+        self._set_meta({REFRESHED_AT_KEY: pulled_at.isoformat()})
+
+    def delete_expenses(self, page_ids: Iterable[str]) -> int:
+        """Remove the rows of pages deleted from Notion"""
+        with self._lock, self.connection:
+            cursor = self.connection.executemany("DELETE FROM expenses WHERE page_id = ?",
+                                                 [(page_id,) for page_id in page_ids])
+        return cursor.rowcount
+
+    def save_monthly_totals(self, month_start: datetime, category_totals: Dict[str, float]):
+        month = month_start.strftime('%Y-%m')
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM monthly_category_totals WHERE month = ?", (month,))
+            self.connection.executemany(
+                "INSERT INTO monthly_category_totals (month, category, total) VALUES (?, ?, ?)",
+                [(month, category, total) for category, total in category_totals.items()])
+
+    def save_installment_schedules(self, schedules: Iterable[InstallmentSchedule]):
+        rows = [tuple(getattr(schedule, column) for column in INSTALLMENT_COLUMNS) for schedule in schedules]
+        placeholders = ', '.join('?' for _ in INSTALLMENT_COLUMNS)
+        with self._lock, self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO installment_schedules ({', '.join(INSTALLMENT_COLUMNS)}) "
+                f"VALUES ({placeholders})", rows)
+
+    def save_installment_transactions(self, transactions: Dict[str, Tuple[str, int, int]]):
+        """
+        Store the installment transactions recorded into schedules, keyed by their hash, with their purchase key,
+        payment number and total payments
+        """
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO installment_transactions (hash, purchase_key, payment_number, total_payments) "
+                "VALUES (?, ?, ?, ?)",
+                [(expense_hash, *values) for expense_hash, values in transactions.items()])
+
+    def save_month_snapshot(self, snapshot: MonthSnapshot):
+        snapshot.touch()
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO month_snapshots (month, snapshot, closed, updated_at) VALUES (?, ?, ?, ?)",
+                (snapshot.month, snapshot.to_json(), int(snapshot.closed), snapshot.updated_at))
+
+    # Reads
+    def get_existing_hashes(self, hashes: Iterable[str]) -> Set[str]:
+        hashes = list(hashes)
+        existing = set()
+        for i in range(0, len(hashes), 500):  # Stay below the SQLite host parameter limit
+            chunk = hashes[i:i + 500]
+            query = f"SELECT DISTINCT hash FROM expenses WHERE hash IN ({', '.join('?' for _ in chunk)})"
+            existing.update(row['hash'] for row in self.connection.execute(query, chunk))
+        return existing
+
+    def get_expenses_by_processed_date(self, start_date: str, end_date: Optional[str] = None) -> List[Expense]:
+        if end_date:
+            rows = self.connection.execute(
+                "SELECT * FROM expenses WHERE processed_date BETWEEN ? AND ? ORDER BY date DESC",
+                (start_date, end_date))
+        else:
+            rows = self.connection.execute(
+                "SELECT * FROM expenses WHERE processed_date >= ? ORDER BY date DESC", (start_date,))
+        return [_row_to_expense(row) for row in rows]
+
+    def get_expenses_by_date(self, start_date: str, end_date: str) -> List[Expense]:
+        rows = self.connection.execute(
+            "SELECT * FROM expenses WHERE date BETWEEN ? AND ? ORDER BY date DESC", (start_date, end_date))
+        return [_row_to_expense(row) for row in rows]
+
+    def get_monthly_totals(self, start_month: datetime, end_month: datetime) -> Dict[str, Dict[datetime, float]]:
+        """Category totals per month, keyed by category and the first day of the month"""
+        rows = self.connection.execute(
+            "SELECT month, category, total FROM monthly_category_totals WHERE month BETWEEN ? AND ?",
+            (start_month.strftime('%Y-%m'), end_month.strftime('%Y-%m')))
+
+        totals = defaultdict(dict)
+        for row in rows:
+            totals[row['category']][datetime.strptime(row['month'], '%Y-%m')] = row['total']
+        return dict(totals)
+
+    def get_installment_schedules(self) -> List[InstallmentSchedule]:
+        rows = self.connection.execute(f"SELECT {', '.join(INSTALLMENT_COLUMNS)} FROM installment_schedules")
+        return [InstallmentSchedule(**dict(row)) for row in rows]
+
+    def get_installment_transactions(self) -> Dict[str, Tuple[int, int]]:
+        """(payment number, total payments) of every recorded installment transaction, keyed by its hash"""
+        rows = self.connection.execute("SELECT hash, payment_number, total_payments FROM installment_transactions")
+        return {row['hash']: (row['payment_number'], row['total_payments']) for row in rows}
+
+    def get_month_snapshot(self, month: str) -> Optional[MonthSnapshot]:
+        row = self.connection.execute("SELECT snapshot FROM month_snapshots WHERE month = ?", (month,)).fetchone()
+        return MonthSnapshot.from_json(row['snapshot']) if row else None
+
+
+def _expense_to_row(expense: Expense) -> tuple:
+    return (expense.page_id, expense.hash_code(), expense.name, expense.original_name, expense.expense_type,
+            str(expense.date)[:10], str(expense.processed_date)[:10] if expense.processed_date else None,
+            expense.original_amount, expense.original_currency, expense.charged_amount, expense.charged_currency,
+            expense.memo, expense.category, expense.sub_category, expense.status,
+            str(expense.account_number) if expense.account_number is not None else None, expense.person_card,
+            expense.remaining_amount)
+
+
+def _row_to_expense(row: sqlite3.Row) -> Expense:
+    expense = Expense(
+        expense_type=row['expense_type'],
+        date=row['date'],
+        processed_date=row['processed_date'],
+        original_amount=row['original_amount'],
+        original_currency=row['original_currency'],
+        charged_amount=row['charged_amount'],
+        charged_currency=row['charged_currency'],
+        description=row['name'],
+        memo=row['memo'],
+        category=row['category'],
+        status=row['status'],
+        account_number=row['account_number'],
+        remaining_amount=row['remaining_amount'] or 0,
+        page_id=row['page_id'],
+        sub_category=row['sub_category'] or "",
+        original_name=row['original_name'] or ""
+    )
+    expense.person_card = row['person_card']  # Keep the identity the expense was stored with
+    return expense
@@ -5,13 +5,14 @@ import copy
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 import hashlib
+from functools import lru_cache
 from typing import Optional, List, Dict
 
 from expense.expense_constants import ENGLISH_CATEGORY, ENGLISH_SUB_CATEGORIES
 from logger import logger
 from notion_py.helpers.notion_common import _invoke_notion_api, create_page_with_db_dict, create_db, generate_icon_url
 from notion_py.notion_globals import Method, NotionPropertyType, IconType, IconColor
-from variables import ACCOUNT_NUMBER_TO_PERSON_CARD, Keys
+from variables import ACCOUNT_NUMBER_TO_PERSON_CARD, EXPENSE_IDS_TO_EXCLUDE_FROM_AVERAGE, Keys
 
 
 class ExpenseField:
@@ -237,9 +238,56 @@ class MonthlyExpense:
         )
 
 
+@lru_cache(maxsize=None)
+def _resolve_person_card(name: str, account_number) -> str:
+    """Person card of an expense - a card name mentioned in the expense name wins over the account mapping"""
+    for card in _PERSON_CARDS:
+        if card in name:
+            return card
+    return ACCOUNT_NUMBER_TO_PERSON_CARD.get(account_number, account_number)
+
+
+_PERSON_CARDS = tuple(dict.fromkeys(ACCOUNT_NUMBER_TO_PERSON_CARD.values()))
+
+
+def normalize_page_id(page_id) -> str:
+    return str(page_id).replace('-', '')
+
+
+# Normalized once, expenses flag themselves when their page id is set
+EXCLUDED_FROM_AVERAGE_IDS = frozenset(normalize_page_id(page_id) for page_id in EXPENSE_IDS_TO_EXCLUDE_FROM_AVERAGE)
+
+
 class Expense:
     """Represents individual expense records"""
 
+    __slots__ = ('expense_type', 'date', 'processed_date', 'original_amount', 'original_currency', 'charged_amount',
+                 'charged_currency', 'name', 'memo', 'category', 'status', 'account_number', 'remaining_amount',
+                 'person_card', 'page_id', 'sub_category', 'original_name', 'excluded_from_average', '_hash_code')
+
+    # Notion field name to attribute name
+    FIELD_TO_ATTR = {
+        ExpenseField.NAME: 'name',
+        ExpenseField.ACCOUNT_NUMBER: 'account_number',
+        ExpenseField.PERSON_CARD: 'person_card',
+        ExpenseField.STATUS: 'status',
+        ExpenseField.PROCESSED_DATE: 'processed_date',
+        ExpenseField.CATEGORY: 'category',
+        ExpenseField.TYPE: 'expense_type',
+        ExpenseField.MEMO: 'memo',
+        ExpenseField.CHARGED_AMOUNT: 'charged_amount',
+        ExpenseField.ORIGINAL_AMOUNT: 'original_amount',
+        ExpenseField.DATE: 'date',
+        ExpenseField.CHARGED_CURRENCY: 'charged_currency',
+        ExpenseField.ORIGINAL_CURRENCY: 'original_currency',
+        ExpenseField.REMAINING_AMOUNT: 'remaining_amount',
+        ExpenseField.PAGE_ID: 'page_id',
+        ExpenseField.ORIGINAL_NAME: 'original_name'
+    }
+
+    # Attributes the identity hash is computed from
+    IDENTITY_ATTRS = frozenset({'date', 'original_amount', 'charged_amount', 'person_card'})
+
     def __init__(self,
                  expense_type: str,
                  date: str,
@@ -275,37 +323,31 @@ class Expense:
         self.sub_category = sub_category
         self.original_name = original_name
 
+    def __setattr__(self, name, value):
+        if name in Expense.IDENTITY_ATTRS:
+            object.__setattr__(self, '_hash_code', None)  # Identity changed, recompute lazily
+        elif name == 'page_id':
+            object.__setattr__(self, 'excluded_from_average',
+                               value is not None and normalize_page_id(value) in EXCLUDED_FROM_AVERAGE_IDS)
+        object.__setattr__(self, name, value)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Expense):
+            return NotImplemented
+        return self.hash_code() == other.hash_code()
+
+    def __hash__(self) -> int:
+        return hash(self.hash_code())
+
     def get_attr(self, field: str) -> any:
         """Get attribute value by field name"""
-        attr_map = {
-            ExpenseField.NAME: 'expense_name',
-            ExpenseField.ACCOUNT_NUMBER: 'account_number',
-            ExpenseField.PERSON_CARD: 'person_card',
-            ExpenseField.STATUS: 'status',
-            ExpenseField.PROCESSED_DATE: 'processed_date',
-            ExpenseField.CATEGORY: 'category',
-            ExpenseField.TYPE: 'expense_type',
-            ExpenseField.MEMO: 'memo',
-            ExpenseField.CHARGED_AMOUNT: 'charged_amount',
-            ExpenseField.ORIGINAL_AMOUNT: 'original_amount',
-            ExpenseField.DATE: 'date',
-            ExpenseField.CHARGED_CURRENCY: 'charged_currency',
-            ExpenseField.ORIGINAL_CURRENCY: 'original_currency',
-            ExpenseField.REMAINING_AMOUNT: 'remaining_amount',
-            ExpenseField.PAGE_ID: 'page_id',
-            ExpenseField.ORIGINAL_NAME: 'original_name'
-        }
-
-        attr_name = attr_map.get(field)
-        if attr_name and hasattr(self, attr_name):
+        attr_name = self.FIELD_TO_ATTR.get(field)
+        if attr_name:
             return getattr(self, attr_name)
         raise AttributeError(f"'{self.__class__.__name__}' has no attribute mapping for '{field}'")
 
     def get_person_card(self) -> str:
-        for key, value in ACCOUNT_NUMBER_TO_PERSON_CARD.items():
-            if value in self.name:
-                return value
-        return ACCOUNT_NUMBER_TO_PERSON_CARD.get(self.account_number, self.account_number)
+        return _resolve_person_card(self.name, self.account_number)
 
     def get_payload(self) -> dict:
         """Generate Notion API payload for the expense"""
@@ -331,14 +373,14 @@ class Expense:
         return payload_dict
 
     def hash_code(self) -> str:
-        """Generate unique hash for expense comparison"""
-        string_to_hash = f"{self.date}{self.original_amount}{self.charged_amount}{self.person_card}"
-        return hashlib.md5(string_to_hash.encode()).hexdigest()
+        """Generate unique hash for expense comparison, cached until an identity attribute changes"""
+        if self._hash_code is None:
+            string_to_hash = f"{self.date}{self.original_amount}{self.charged_amount}{self.person_card}"
+            object.__setattr__(self, '_hash_code', hashlib.md5(string_to_hash.encode()).hexdigest())
+        return self._hash_code
 
     def equals(self, other: 'Expense') -> bool:
-        if not isinstance(other, Expense):
-            return False
-        return self.hash_code() == other.hash_code()
+        return isinstance(other, Expense) and self == other
 
     def __str__(self) -> str:
         currency = self.charged_currency.split(' ')[-1]
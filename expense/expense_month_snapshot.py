@@ -0,0 +1,118 @@
+"""
+Materialized month-end snapshot of the monthly category expenses.
+A snapshot holds everything the finance summary shows for a month - the category totals, averages and percentages,
+income, savings and the largest expenses. It is created from the monthly category pages the first time a month is
+written and updated in place whenever late transactions or new averages change a category, so summaries read one
+row instead of rescanning Notion.
+"""
+import json
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from common import remove_emojis
+from expense.expense_models import Expense
+
+EXPENSES_CATEGORY = "Expenses"
+INCOME_CATEGORY = "Income"
+SAVING_CATEGORY = "Saving"
+NON_EXPENSE_CATEGORIES = {"income", "credit card", "saving"}
+TOP_EXPENSES_LIMIT = 5
+
+
+def clean_category_name(category: str) -> str:
+    return remove_emojis(category).strip().lower()
+
+
+def get_top_expenses(expenses: List[Expense], limit: int = TOP_EXPENSES_LIMIT) -> List[Dict]:
+    """The largest expenses of a month, income and transfers excluded"""
+    spending = [expense for expense in expenses
+                if clean_category_name(expense.category or "") not in NON_EXPENSE_CATEGORIES]
+    spending.sort(key=lambda expense: expense.charged_amount, reverse=True)
+    return [{'name': expense.name, 'amount': round(expense.charged_amount, 2)} for expense in spending[:limit]]
+
+
+def _get_page_category_summary(page: Dict) -> Dict:
+    properties = page['properties']
+    return {
+        'name': properties['Category']['title'][0]['plain_text'],
+        'amount': properties.get('Total', {}).get('formula', {}).get('number', 0),
+        'percentage': properties.get('Percentage', {}).get('formula', {}).get('number'),
+        'average': properties.get('4 Months Average', {}).get('number'),
+        'icon': properties.get('Icon', {}).get('formula', {}).get('string', '📌')
+    }
+
+
+@dataclass
+class MonthSnapshot:
+    """Finance summary data of a single month"""
+    month: str  # YYYY-MM
+    categories: List[Dict] = field(default_factory=list)  # name, amount, percentage, average and icon per category
+    top_expenses: List[Dict] = field(default_factory=list)
+    closed: bool = False
+    updated_at: Optional[str] = None
+
+    @classmethod
+    def from_pages(cls, month: str, month_pages: List[Dict], top_expenses: Optional[List[Dict]] = None,
+                   closed: bool = False) -> 'MonthSnapshot':
+        """Snapshot of the monthly category pages of a month as currently stored in Notion"""
+        return cls(month=month, categories=[_get_page_category_summary(page) for page in month_pages],
+                   top_expenses=top_expenses or [], closed=closed)
+
+    @classmethod
+    def from_json(cls, data: str) -> 'MonthSnapshot':
+        return cls(**json.loads(data))
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+    def get_category(self, category: str) -> Optional[Dict]:
+        clean_category = clean_category_name(category)
+        return next((summary for summary in self.categories
+                     if clean_category_name(summary['name']) == clean_category), None)
+
+    def get_amount(self, category: str) -> float:
+        summary = self.get_category(category)
+        return (summary or {}).get('amount') or 0
+
+    @property
+    def total_expenses(self) -> float:
+        return round(self.get_amount(EXPENSES_CATEGORY), 2)
+
+    @property
+    def income(self) -> float:
+        return round(self.get_amount(INCOME_CATEGORY), 2)
+
+    @property
+    def saving(self) -> float:
+        return round(self.get_amount(SAVING_CATEGORY), 2)
+
+    def apply_totals(self, category_totals: Dict[str, float]) -> bool:
+        """Update the categories whose total changed, returns whether anything changed"""
+        changed = False
+        for category, total in category_totals.items():
+            summary = self.get_category(category)
+            if summary is None or summary['amount'] == total:
+                continue
+            summary['amount'] = total
+            summary['percentage'] = _get_percentage(total, summary['average'])
+            changed = True
+        return changed
+
+    def apply_average(self, category: str, average: float) -> bool:
+        summary = self.get_category(category)
+        if summary is None or summary['average'] == average:
+            return False
+        summary['average'] = average
+        summary['percentage'] = _get_percentage(summary['amount'], average)
+        return True
+
+    def touch(self):
+        self.updated_at = datetime.now().isoformat()
+
+
+def _get_percentage(amount: Optional[float], average: Optional[float]) -> Optional[float]:
+    """Total as a percentage of the average, like the Percentage formula of the monthly category pages"""
+    if not average or amount is None:
+        return None
+    return round(amount / average * 100, 2)
@@ -0,0 +1,190 @@
+"""
+Relation sync for the monthly category pages.
+Diffs the current relation of a page against the desired expense ids and only writes when they differ.
+Relations that fit in a single Notion request are replaced in one PATCH, larger ones are synced from the expense
+side, one PATCH per added or removed expense. Different category pages are synced concurrently.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from expense.expense_constants import NOTION_RELATION_LIMIT, RELATION_SYNC_MAX_WORKERS, \
+    EXPENSE_MONTHLY_CATEGORY_RELATION
+from logger import logger
+from notion_py.helpers.notion_common import get_page, get_page_property_items, update_page
+
+EXPENSES_RELATION = "Expenses"
+
+
+def _normalize_id(page_id: str) -> str:
+    return page_id.replace('-', '')
+
+
+def get_relation_ids(page: Dict, property_name: str = EXPENSES_RELATION) -> List[str]:
+    """Get all related page ids of a relation property, also when the page object truncated it"""
+    relation_property = page['properties'].get(property_name, {})
+    if relation_property.get('has_more'):
+        items = get_page_property_items(page['id'], relation_property['id'])
+        return [item['relation']['id'] for item in items if item.get('type') == 'relation']
+    return [relation['id'] for relation in relation_property.get('relation', [])]
+
+
+class RelationLimitError(ValueError):
+    """Raised when a relation is over the Notion request limit and cannot be synced from the expense side"""
+    pass
+
+
+class RelationSyncError(Exception):
+    """Raised when the relations of some pages could not be synced"""
+
+    def __init__(self, errors: Dict[str, str], results: Dict[str, 'RelationDiff']):
+        self.errors = errors
+        self.results = results
+        super().__init__(f"Failed to sync the relations of {', '.join(sorted(errors))}")
+
+
+@dataclass
+class RelationDiff:
+    """Difference between the current and the desired relation of a page"""
+    page_id: str
+    label: str
+    desired_ids: List[str]
+    additions: List[str] = field(default_factory=list)
+    removals: List[str] = field(default_factory=list)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.additions or self.removals)
+
+
+def diff_relation(page_id: str, current_ids: List[str], desired_ids: List[str], label: str = "") -> RelationDiff:
+    current = {_normalize_id(page_id) for page_id in current_ids}
+    desired = {_normalize_id(page_id) for page_id in desired_ids}
+
+    return RelationDiff(
+        page_id=page_id,
+        label=label,
+        desired_ids=list(dict.fromkeys(desired_ids)),
+        additions=[page_id for page_id in dict.fromkeys(desired_ids) if _normalize_id(page_id) not in current],
+        removals=[page_id for page_id in current_ids if _normalize_id(page_id) not in desired]
+    )
+
+
+class RelationSync:
+    """Syncs relation properties of pages to desired sets of related page ids"""
+
+    def __init__(self, property_name: str = EXPENSES_RELATION,
+                 reverse_property_name: Optional[str] = EXPENSE_MONTHLY_CATEGORY_RELATION,
+                 max_workers: int = RELATION_SYNC_MAX_WORKERS):
+        self.property_name = property_name
+        self.reverse_property_name = reverse_property_name
+        self.max_workers = max_workers
+
+    def sync(self, page_id: str, desired_ids: List[str], current_ids: Optional[List[str]] = None,
+             label: str = "", claimed_by: Optional[Dict[str, str]] = None,
+             reverse_synced_pages: Optional[Set[str]] = None) -> RelationDiff:
+        """
+        Sync the relation of a single page, fetching its current relation when not given.
+        claimed_by maps expenses desired by pages synced at the same time to their page, and reverse_synced_pages
+        are the pages among them synced from the expense side, so that moving an expense between categories
+        neither races nor leaves the expense related to both.
+        """
+        if current_ids is None:
+            current_ids = get_relation_ids(get_page(page_id), self.property_name)
+
+        relation_diff = diff_relation(page_id, current_ids, desired_ids, label)
+        if not relation_diff.changed:
+            logger.debug(f"Relation of {label or page_id} is up to date ({len(desired_ids)} pages)")
+            return relation_diff
+
+        if len(relation_diff.desired_ids) <= NOTION_RELATION_LIMIT:
+            self._replace_relation(relation_diff)
+        else:
+            self._sync_from_related_pages(relation_diff, claimed_by or {}, reverse_synced_pages or set())
+
+        logger.debug(f"Synced relation of {label or page_id}: +{len(relation_diff.additions)} "
+                     f"-{len(relation_diff.removals)}")
+        return relation_diff
+
+    def sync_pages(self, updates: List[Tuple[Dict, List[str], str]]) -> Dict[str, RelationDiff]:
+        """
+        Sync several pages concurrently.
+
+        Args:
+            updates: (page, desired_ids, label) per page, the current relation is read from the page object
+
+        Returns:
+            Dict[str, RelationDiff]: The diff per label of every page
+
+        Raises:
+            RelationSyncError: When any page failed to sync, after all the other pages were synced. Pages over the
+                relation limit without a reverse relation are only logged and left out of the result.
+        """
+        results = {}
+        errors = {}
+        if not updates:
+            return results
+
+        claimed_by = {_normalize_id(page_id): page['id'] for page, desired_ids, _ in updates for page_id in desired_ids}
+        reverse_synced_pages = {_normalize_id(page['id']) for page, desired_ids, _ in updates
+                                if len(dict.fromkeys(desired_ids)) > NOTION_RELATION_LIMIT}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self.sync, page['id'], desired_ids, get_relation_ids(page, self.property_name),
+                                label, claimed_by, reverse_synced_pages): label
+                for page, desired_ids, label in updates
+            }
+            for future in as_completed(futures):
+                label = futures[future]
+                try:
+                    results[label] = future.result()
+                except RelationLimitError as e:
+                    logger.error(f"Skipping the relation of {label}: {str(e)}")
+                except Exception as e:
+                    logger.error(f"Error syncing relation of {label}: {str(e)}")
+                    errors[label] = str(e)
+
+        if errors:
+            raise RelationSyncError(errors, results)
+
+        changed_count = sum(1 for relation_diff in results.values() if relation_diff.changed)
+        logger.debug(f"Synced {len(results)} relations, {changed_count} changed")
+        return results
+
+    def _replace_relation(self, relation_diff: RelationDiff):
+        payload = {
+            "properties": {
+                self.property_name: {
+                    "relation": [{"id": page_id} for page_id in relation_diff.desired_ids]
+                }
+            }
+        }
+        update_page(relation_diff.page_id, payload)
+
+    def _sync_from_related_pages(self, relation_diff: RelationDiff, claimed_by: Dict[str, str],
+                                 reverse_synced_pages: Set[str]):
+        """
+        A relation value can hold only NOTION_RELATION_LIMIT pages per request, so larger relations are changed
+        through the reverse relation of each added or removed expense
+        """
+        if not self.reverse_property_name:
+            raise RelationLimitError(f"Relation of {relation_diff.label or relation_diff.page_id} has "
+                             f"{len(relation_diff.desired_ids)} pages, over the Notion limit of "
+                             f"{NOTION_RELATION_LIMIT}, and no reverse relation property is configured")
+
+        # Each expense belongs to a single monthly category page, so its reverse relation is set to that page alone
+        changes = []
+        for page_id in relation_diff.removals:
+            claiming_page_id = claimed_by.get(_normalize_id(page_id))
+            if claiming_page_id is None:
+                changes.append((page_id, []))
+            elif _normalize_id(claiming_page_id) not in reverse_synced_pages:
+                # A forward PATCH of the claiming page only adds itself to the reverse relation
+                changes.append((page_id, [{"id": claiming_page_id}]))
+            # A claiming page synced from the expense side overwrites the reverse relation itself
+        changes += [(page_id, [{"id": relation_diff.page_id}]) for page_id in relation_diff.additions]
+
+        for related_page_id, relation_value in changes:
+            update_page(related_page_id, {"properties": {self.reverse_property_name: {"relation": relation_value}}})
+        logger.debug(f"Synced {len(changes)} expenses of {relation_diff.label or relation_diff.page_id} "
+                     f"from the expense side")
@@ -7,6 +7,7 @@ import os
 import re
 import time
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 from datetime import datetime, date
 from typing import Dict, Any, List, Tuple, Optional, Union
@@ -14,7 +15,13 @@ from typing import Dict, Any, List, Tuple, Optional, Union
 from expense.expense_constants import BANK_SCRAPER_NODE_SCRIPT_PATH, BANK_SCRAPER_DIRECTORY, \
     BANK_SCRAPER_OUTPUT_DIR, \
     BANK_SCRAPER_OUTPUT_FILE_PATH, CREATE_EXPENSE_FILE_IF_ALREADY_MODIFIED_TODAY, \
-    BANK_SCRAPER_RETRIES
+    BANK_SCRAPER_RETRIES, BANK_SCRAPER_PARALLEL, BANK_SCRAPER_MAX_WORKERS, BANK_SCRAPER_SOURCE_TIMEOUT, \
+    BANK_SCRAPER_SHARDS_DIR, BANK_SCRAPER_CREDENTIAL_ERROR_TYPES, BANK_SCRAPER_CACHE_ENABLED, \
+    BANK_SCRAPER_STREAM_PATH_ENV
+from expense.expense_scrape_cache import load_cached_transactions, save_cached_transactions, \
+    invalidate_cached_transactions
+from expense.expense_scraper_supervisor import ScraperSupervisor, SupervisorResult, ScraperEvent, KillReason, \
+    parse_scraper_line
 from logger import logger
 
 
@@ -164,6 +171,109 @@ def find_credential_files(directory: str) -> List[Path]:
         raise ScraperError(f"Error searching for credentials: {e}")
 
 
+def find_keychain_accounts() -> List[str]:
+    """
+    List the keychain account names stored for the bank scraper.
+    Accounts are stored as companyId-username, which the node script accepts as a target account.
+    """
+    try:
+        dump = subprocess.run(['security', 'dump-keychain'], capture_output=True, text=True)
+    except Exception as e:
+        logger.error(f"Error listing keychain accounts: {e}")
+        return []
+
+    accounts = []
+    lines = dump.stdout.splitlines()
+    for i, line in enumerate(lines):
+        if '"bank-scraper"' not in line:
+            continue
+        # Same lookup as the node script: the account name is within the next 4 lines of the service name
+        for account_line in lines[i + 1:i + 5]:
+            if '"acct"<blob>=' in account_line:
+                account_name = account_line.split('"')[3]
+                if account_name != 'encryption-key' and account_name not in accounts:
+                    accounts.append(account_name)
+                break
+
+    logger.debug(f"Found {len(accounts)} keychain accounts: {accounts}")
+    return accounts
+
+
+def build_scrape_sources(env_files: List[Union[Path, str]]) -> List[Tuple[str, Union[Path, List[str]]]]:
+    """
+    Split credential sources into independent units of work.
+    Each keychain account becomes its own source so accounts can be scraped concurrently.
+
+    Returns:
+        List of (source_name, source) where source is an env file path or a list of keychain accounts
+    """
+    sources = []
+    for env_file in env_files:
+        if env_file != 'keychain':
+            sources.append((env_file.name, env_file))
+            continue
+
+        keychain_accounts = find_keychain_accounts()
+        if not keychain_accounts:
+            sources.append(('keychain', env_file))
+            continue
+        sources.extend((account, [account]) for account in keychain_accounts)
+
+    return sources
+
+
+def get_shard_path(source_name: str) -> str:
+    """Get the output shard path for a single credential source"""
+    safe_name = re.sub(r'[^\w.-]', '_', str(source_name))
+    return os.path.join(BANK_SCRAPER_SHARDS_DIR, f"transactions.{safe_name}.json")
+
+
+def load_transactions_file(file_path: str) -> List[Dict]:
+    """Load a list of transactions from a scraper output file, empty list if missing or invalid"""
+    try:
+        with open(file_path, 'r') as f:
+            data = json.load(f)
+        return data if isinstance(data, list) else []
+    except FileNotFoundError:
+        return []
+    except json.JSONDecodeError:
+        logger.error(f"Invalid JSON in transactions file: {file_path}")
+        return []
+
+
+def write_transactions_file(transactions: List[Dict], output_path: str):
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(transactions, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, output_path)
+
+
+def merge_transaction_shards(shard_paths: List[str], output_path: str) -> List[Dict]:
+    """
+    Merge transaction shards into a single output file, removing duplicate transactions.
+    Transactions are identified by the hash computed by the node scraper.
+
+    Returns:
+        The merged list of transactions
+    """
+    merged = {}
+    for shard_path in shard_paths:
+        for transaction in load_transactions_file(shard_path):
+            key = transaction.get('hash') or json.dumps(transaction, sort_keys=True)
+            merged.setdefault(key, transaction)
+
+    transactions = sorted(merged.values(), key=lambda t: t.get('date', ''))
+
+    # Written even when empty so transactions of a previous run are never read as the result of this one
+    write_transactions_file(transactions, output_path)
+    if not transactions:
+        logger.info(f"No transactions found in shards, wrote an empty {output_path}")
+        return transactions
+
+    logger.info(f"Merged {len(transactions)} unique transactions from {len(shard_paths)} shards into {output_path}")
+    return transactions
+
+
 def parse_scraper_output(line: str) -> Dict:
     """Parse and structure scraper output line"""
     try:
@@ -224,7 +334,8 @@ def get_failed_credentials(stdout: str, stderr: str) -> List[Dict[str, str]]:
                         'company_id': company_id,
                         'username': username,
                         'specific_id': account_id,
-                        'error': error_message
+                        'error': error_message,
+                        'error_type': json_data.get('errorType', '')
                     })
 
                     processed_accounts.add(account_key)
@@ -281,6 +392,25 @@ def get_failed_credentials(stdout: str, stderr: str) -> List[Dict[str, str]]:
     return failed_accounts
 
 
+def log_scraper_event(event: ScraperEvent):
+    """Log a scraper output line as it arrives, using the level of structured JSON lines"""
+    if event.data is None:
+        logger.info(event.message)
+        return
+    getattr(logger, event.level.lower(), logger.info)(event.message)
+
+
+def run_supervised_scraper(command: List[str], timeout: int = 0) -> SupervisorResult:
+    """
+    Run a node scraper command under the streaming supervisor.
+    Raises subprocess.TimeoutExpired when the scraper was killed for timing out or stalling.
+    """
+    result = ScraperSupervisor(command, timeout=timeout or None, on_event=log_scraper_event).run()
+    if result.killed_reason in (KillReason.TIMEOUT, KillReason.STALL):
+        raise subprocess.TimeoutExpired(command, timeout)
+    return result
+
+
 def run_scraper_for_specific_accounts(accounts: List[str], output_path: str, timeout: int = 0) -> \
 Tuple[bool, List[Dict[str, str]]]:
     """
@@ -316,13 +446,8 @@ Tuple[bool, List[Dict[str, str]]]:
     command.extend(accounts)
 
     try:
-        # Run with timeout
-        time.sleep(timeout)
-        completed_process = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-        )
+        # Run with timeout (0 means no timeout), output is logged while the scraper runs
+        completed_process = run_supervised_scraper(command, timeout)
 
         # Parse output for failed accounts - use the new simpler function
         failed_accounts = get_failed_credentials(
@@ -368,6 +493,43 @@ Tuple[bool, List[Dict[str, str]]]:
         return False, [{'company_id': 'retry_error', 'error': str(e)}]
 
 
+def _retry_accounts_in_parallel(account_ids: List[str], output_path: str, timeout: int,
+                                max_workers: int = BANK_SCRAPER_MAX_WORKERS) -> List[Dict[str, str]]:
+    """
+    Retry each account concurrently into its own shard and merge the results into the output file.
+    Threads are enough here since every worker only supervises a node subprocess.
+
+    Returns:
+        List of accounts that still failed
+    """
+    os.makedirs(BANK_SCRAPER_SHARDS_DIR, exist_ok=True)
+    shard_paths = {account_id: get_shard_path(f"retry-{account_id}") for account_id in account_ids}
+    for shard_path in shard_paths.values():
+        if os.path.exists(shard_path):
+            os.remove(shard_path)
+
+    still_failed = []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(account_ids)))) as executor:
+        futures = {
+            executor.submit(run_scraper_for_specific_accounts, [account_id], shard_path, timeout): account_id
+            for account_id, shard_path in shard_paths.items()
+        }
+        for future in as_completed(futures):
+            account_id = futures[future]
+            try:
+                _, failed = future.result()
+            except Exception as e:
+                logger.error(f"Error retrying account {account_id}: {e}", exc_info=True)
+                failed = [{'company_id': account_id.split('-', 1)[0], 'specific_id': account_id, 'error': str(e)}]
+            still_failed.extend(failed)
+
+            if not failed and BANK_SCRAPER_CACHE_ENABLED and os.path.exists(shard_paths[account_id]):
+                save_cached_transactions(account_id, load_transactions_file(shard_paths[account_id]))
+
+    merge_transaction_shards([output_path, *shard_paths.values()], output_path)
+    return still_failed
+
+
 def retry_failed_accounts(failed_accounts: List[Dict[str, str]], output_path: str) -> List[
     Dict[str, str]]:
     """
@@ -384,6 +546,16 @@ def retry_failed_accounts(failed_accounts: List[Dict[str, str]], output_path: st
     if not failed_accounts or BANK_SCRAPER_RETRIES <= 0:
         return failed_accounts
 
+    # Rejected credentials fail the same way on every retry, and retrying them can get the account blocked
+    credential_failures = [account for account in failed_accounts
+                           if account.get('error_type') in BANK_SCRAPER_CREDENTIAL_ERROR_TYPES]
+    for account in credential_failures:
+        logger.error(f"Not retrying {account.get('specific_id', account['company_id'])} - "
+                     f"credential error: {account['error_type']}")
+    failed_accounts = [account for account in failed_accounts if account not in credential_failures]
+    if not failed_accounts:
+        return credential_failures
+
     # Extract specific account identifiers for retry
     specific_ids = []
     for account in failed_accounts:
@@ -409,7 +581,7 @@ def retry_failed_accounts(failed_accounts: List[Dict[str, str]], output_path: st
 
     if not specific_ids:
         logger.info("No specific accounts to retry")
-        return failed_accounts
+        return credential_failures + failed_accounts
 
     logger.info(f"Will retry {len(specific_ids)} failed accounts: {', '.join(specific_ids)}")
 
@@ -426,12 +598,11 @@ def retry_failed_accounts(failed_accounts: List[Dict[str, str]], output_path: st
             f"Retry attempt {retry_num + 1}/{BANK_SCRAPER_RETRIES} for accounts: {', '.join(remaining_failed)}")
         timeout = 300 + (retry_num * 60)  # Increase timeout by 1 minute per retry
 
-        # Run scraper for just the failed accounts
-        success, retry_results = run_scraper_for_specific_accounts(remaining_failed, output_path,
-                                                                   timeout)
+        # Run scraper for each failed account concurrently, each into its own shard
+        retry_results = _retry_accounts_in_parallel(remaining_failed, output_path, timeout)
 
         # Update list of accounts to retry - just use specific_id directly
-        remaining_failed = [account['specific_id'] for account in retry_results]
+        remaining_failed = [account['specific_id'] for account in retry_results if account.get('specific_id')]
 
         # For the final retry, keep track of failing accounts
         if retry_num == BANK_SCRAPER_RETRIES - 1 or not remaining_failed:
@@ -441,10 +612,10 @@ def retry_failed_accounts(failed_accounts: List[Dict[str, str]], output_path: st
 
         logger.info(f"After retry {retry_num + 1}: {len(remaining_failed)} accounts still failing")
 
-    return final_failed_accounts
+    return credential_failures + final_failed_accounts
 
 
-def run_scraper(env_file: Path, output_path: str, timeout: int = 300) -> Tuple[
+def run_scraper(env_file: Path, output_path: str, timeout: int = 300, retry: bool = True) -> Tuple[
     Dict[str, Any], bool, List[Dict[str, str]]]:
     """
     Run the bank scraper with simplified error handling.
@@ -453,6 +624,7 @@ def run_scraper(env_file: Path, output_path: str, timeout: int = 300) -> Tuple[
         env_file: Path to credentials file or 'keychain'
         output_path: Path to save transaction data
         timeout: Timeout in seconds
+        retry: Whether to retry failed accounts, parallel runs retry once all sources are done
 
     Returns:
         Tuple of (transaction_data, was_skipped, failed_accounts)
@@ -493,40 +665,19 @@ def run_scraper(env_file: Path, output_path: str, timeout: int = 300) -> Tuple[
     logger.info(f"Executing command: {' '.join(node_command)}")
 
     try:
-        # Run with timeout
-        completed_process = subprocess.run(
-            node_command,
-            capture_output=True,
-            text=True,
-            timeout=timeout
-        )
+        # Run with timeout, output is logged while the scraper runs
+        completed_process = run_supervised_scraper(node_command, timeout)
 
         logger.debug(f"Scraper process completed with return code: {completed_process.returncode}")
 
-        # Process output and extract error information
+        # Extract error information from the structured output
         has_error = False
 
-        for line in completed_process.stdout.splitlines():
-            try:
-                # Try to parse as JSON
-                try:
-                    log_entry = json.loads(line)
-                    # Log based on level
-                    if 'level' in log_entry:
-                        level = log_entry['level'].lower()
-                        message = log_entry.get('message', '')
-                        getattr(logger, level, logger.info)(message)
-
-                        # Check for errors
-                        if level == 'error' or (log_entry.get('error') is not None):
-                            has_error = True
-                except json.JSONDecodeError:
-                    # Not JSON, just log as-is
-                    logger.info(line)
-            except Exception as parse_error:
-                logger.warning(f"Error parsing output line: {parse_error}. Line: {line}")
+        for line in completed_process.stdout_lines:
+            event = parse_scraper_line(line)
+            if event.level == 'ERROR' or (event.data and event.data.get('error') is not None):
+                has_error = True
 
-        # Log any stderr
         if completed_process.stderr and "punycode" not in completed_process.stderr:
             logger.error(f"stderr output: {completed_process.stderr}")
             has_error = True
@@ -546,7 +697,7 @@ def run_scraper(env_file: Path, output_path: str, timeout: int = 300) -> Tuple[
                         f"  - Company ID: {account['company_id']}, Error: {account.get('error', 'Unknown error')}")
 
             # Handle retries for failed accounts
-            if BANK_SCRAPER_RETRIES > 0:
+            if retry and BANK_SCRAPER_RETRIES > 0:
                 retried_failed_credentials = retry_failed_accounts(failed_credentials, output_path)
                 # Replace the original failed credentials with the ones that still failed after retries
                 failed_credentials = retried_failed_credentials
@@ -577,56 +728,183 @@ def run_scraper(env_file: Path, output_path: str, timeout: int = 300) -> Tuple[
         logger.error(f"Error running scraper: {e}", exc_info=True)
         return {}, False, [{'company_id': 'all', 'specific_id': 'all', 'error': str(e)}]
 
-def main():
-    try:
-        logger.info("Starting bank scraper main process")
+def stream_cached_transactions(transactions: List[Dict]):
+    """Append cached transactions to the NDJSON stream, like the node scraper does for scraped ones"""
+    stream_path = os.environ.get(BANK_SCRAPER_STREAM_PATH_ENV)
+    if not stream_path or not transactions:
+        return
+    with open(stream_path, 'a') as f:
+        f.write(''.join(json.dumps(transaction, ensure_ascii=False) + '\n' for transaction in transactions))
 
-        # Verify environment
-        check_node_installation()
-        verify_script_paths()
 
-        os.makedirs(BANK_SCRAPER_OUTPUT_DIR, exist_ok=True)
+def scrape_source(source: Union[Path, str, List[str]], shard_path: str, timeout: int,
+                  cache_key: Optional[str] = None) -> Tuple[List[Dict], bool, List[Dict[str, str]]]:
+    """
+    Scrape a single credential source into its own output shard.
+    Runs inside a worker process, so it must stay a module level function.
 
-        env_files = find_credential_files(BANK_SCRAPER_DIRECTORY)
+    Args:
+        source: Env file path, 'keychain', or a list of keychain accounts
+        shard_path: Path of the output shard for this source
+        timeout: Timeout in seconds for this source
+        cache_key: Scrape cache key of the source, None to always scrape
 
-        results, errors, skipped = {}, [], []
-        all_failed_accounts = []
+    Returns:
+        Tuple of (transaction_data, was_skipped, failed_accounts)
+    """
+    if cache_key and BANK_SCRAPER_CACHE_ENABLED:
+        cached_transactions = load_cached_transactions(cache_key)
+        if cached_transactions is not None:
+            write_transactions_file(cached_transactions, shard_path)
+            stream_cached_transactions(cached_transactions)
+            return cached_transactions, True, []
+
+    if os.path.exists(shard_path):
+        if not CREATE_EXPENSE_FILE_IF_ALREADY_MODIFIED_TODAY and is_file_modified_today(shard_path):
+            logger.info(f"Shard {shard_path} was already created today")
+            return load_transactions_file(shard_path), True, []
+        # Never merge a shard left over from a previous run
+        os.remove(shard_path)
+
+    if not isinstance(source, list):
+        transactions, was_skipped, failed_accounts = run_scraper(source, shard_path, timeout=timeout, retry=False)
+    else:
+        _, failed_accounts = run_scraper_for_specific_accounts(source, shard_path, timeout)
+        for account in failed_accounts:
+            if account.get('specific_id') in (None, 'all'):
+                account['specific_id'] = source[0]
+        transactions, was_skipped = load_transactions_file(shard_path), False
+
+    if cache_key and BANK_SCRAPER_CACHE_ENABLED:
+        if failed_accounts:
+            invalidate_cached_transactions(cache_key)
+        elif os.path.exists(shard_path):
+            save_cached_transactions(cache_key, load_transactions_file(shard_path))
+
+    return transactions, was_skipped, failed_accounts
 
-        for env_file in env_files:
-            source_name = 'keychain' if env_file == 'keychain' else env_file.name
-            try:
-                logger.debug(f"Processing credential source: {source_name}")
-                # Set a timeout for each run_scraper call
-                try:
-                    file_results, was_skipped, failed_accounts = run_scraper(env_file,
-                                                                             BANK_SCRAPER_OUTPUT_FILE_PATH,
-                                                                             timeout=300)
-                    all_failed_accounts.extend(failed_accounts)
-
-                    if was_skipped:
-                        skipped.append(source_name)
-                        logger.info(f"Skipped {source_name} - already processed today")
-                    else:
-                        results[source_name] = file_results
-                        logger.debug(f"Successfully processed {source_name}")
-                except TimeoutError:
-                    logger.error(f"Scraper process for {source_name} timed out after 300 seconds")
-                    errors.append((source_name, "Process timed out"))
-                    all_failed_accounts.append({
-                        'company_id': source_name,
-                        'error': "Process timed out after 300 seconds"
-                    })
-                    continue
 
-            except ScraperError as e:
+def run_sources_in_parallel(env_files: List[Union[Path, str]], max_workers: int = BANK_SCRAPER_MAX_WORKERS,
+                            timeout: int = BANK_SCRAPER_SOURCE_TIMEOUT) -> Tuple[
+    Dict[str, Any], List[Tuple[str, str]], List[str], List[Dict[str, str]]]:
+    """
+    Scrape independent credential sources concurrently in a process pool.
+    Every source writes its own shard, the shards are merged and deduplicated into the output file,
+    and failed accounts are retried concurrently afterwards.
+
+    Returns:
+        Tuple of (results, errors, skipped, failed_accounts)
+    """
+    results, errors, skipped = {}, [], []
+    all_failed_accounts = []
+
+    sources = build_scrape_sources(env_files)
+    if not sources:
+        return results, errors, skipped, all_failed_accounts
+
+    os.makedirs(BANK_SCRAPER_SHARDS_DIR, exist_ok=True)
+    shard_paths = [get_shard_path(source_name) for source_name, _ in sources]
+    workers = max(1, min(max_workers, len(sources)))
+    logger.info(f"Scraping {len(sources)} credential sources with {workers} parallel workers")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(scrape_source, source, shard_path, timeout, source_name): source_name
+            for (source_name, source), shard_path in zip(sources, shard_paths)
+        }
+        for future in as_completed(futures):
+            source_name = futures[future]
+            try:
+                file_results, was_skipped, failed_accounts = future.result()
+            except Exception as e:
                 logger.error(f"Failed to process {source_name}: {e}")
                 errors.append((source_name, str(e)))
+                all_failed_accounts.append({'company_id': source_name, 'error': str(e)})
+                continue
+
+            all_failed_accounts.extend(failed_accounts)
+            if was_skipped:
+                skipped.append(source_name)
+                logger.info(f"Skipped {source_name} - already scraped recently")
+            else:
+                results[source_name] = file_results
+                logger.debug(f"Successfully processed {source_name}")
+
+    logger.info(f"Scraped {len(results)} credential sources, {len(skipped)} were merged from the cache")
+    merge_transaction_shards(shard_paths, BANK_SCRAPER_OUTPUT_FILE_PATH)
+
+    if all_failed_accounts and BANK_SCRAPER_RETRIES > 0:
+        all_failed_accounts = retry_failed_accounts(all_failed_accounts, BANK_SCRAPER_OUTPUT_FILE_PATH)
+
+    return results, errors, skipped, all_failed_accounts
+
+
+def run_sources_sequentially(env_files: List[Union[Path, str]]) -> Tuple[
+    Dict[str, Any], List[Tuple[str, str]], List[str], List[Dict[str, str]]]:
+    """
+    Scrape credential sources one after the other into the output file.
+
+    Returns:
+        Tuple of (results, errors, skipped, failed_accounts)
+    """
+    results, errors, skipped = {}, [], []
+    all_failed_accounts = []
+
+    for env_file in env_files:
+        source_name = 'keychain' if env_file == 'keychain' else env_file.name
+        try:
+            logger.debug(f"Processing credential source: {source_name}")
+            # Set a timeout for each run_scraper call
+            try:
+                file_results, was_skipped, failed_accounts = run_scraper(env_file,
+                                                                         BANK_SCRAPER_OUTPUT_FILE_PATH,
+                                                                         timeout=BANK_SCRAPER_SOURCE_TIMEOUT)
+                all_failed_accounts.extend(failed_accounts)
+
+                if was_skipped:
+                    skipped.append(source_name)
+                    logger.info(f"Skipped {source_name} - already processed today")
+                else:
+                    results[source_name] = file_results
+                    logger.debug(f"Successfully processed {source_name}")
+            except TimeoutError:
+                logger.error(f"Scraper process for {source_name} timed out after {BANK_SCRAPER_SOURCE_TIMEOUT} seconds")
+                errors.append((source_name, "Process timed out"))
                 all_failed_accounts.append({
                     'company_id': source_name,
-                    'error': str(e)
+                    'error': f"Process timed out after {BANK_SCRAPER_SOURCE_TIMEOUT} seconds"
                 })
                 continue
 
+        except ScraperError as e:
+            logger.error(f"Failed to process {source_name}: {e}")
+            errors.append((source_name, str(e)))
+            all_failed_accounts.append({
+                'company_id': source_name,
+                'error': str(e)
+            })
+            continue
+
+    return results, errors, skipped, all_failed_accounts
+
+
+def main():
+    try:
+        logger.info("Starting bank scraper main process")
+
+        # Verify environment
+        check_node_installation()
+        verify_script_paths()
+
+        os.makedirs(BANK_SCRAPER_OUTPUT_DIR, exist_ok=True)
+
+        env_files = find_credential_files(BANK_SCRAPER_DIRECTORY)
+
+        if BANK_SCRAPER_PARALLEL:
+            results, errors, skipped, all_failed_accounts = run_sources_in_parallel(env_files)
+        else:
+            results, errors, skipped, all_failed_accounts = run_sources_sequentially(env_files)
+
         if errors:
             logger.info("\nErrors:")
             for filename, error in errors:
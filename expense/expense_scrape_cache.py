@@ -0,0 +1,82 @@
+"""
+Per account cache of scraped transactions.
+Every successfully scraped credential source is stored in its own file together with the scraped date range and
+timestamp, so a retry run only scrapes the accounts that failed or whose cache is stale.
+One file per account keeps concurrent scraper workers from writing to the same file.
+"""
+import json
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from expense.expense_constants import BANK_SCRAPER_CACHE_DIR, BANK_SCRAPER_CACHE_TTL_HOURS, \
+    BANK_SCRAPER_LOOKBACK_DAYS
+from logger import logger
+
+
+def get_scrape_range() -> Tuple[str, str]:
+    """The date range the node scraper covers when run today"""
+    today = date.today()
+    return (today - timedelta(days=BANK_SCRAPER_LOOKBACK_DAYS)).isoformat(), today.isoformat()
+
+
+def get_cache_path(account: str) -> str:
+    safe_name = re.sub(r'[^\w.-]', '_', str(account))
+    return os.path.join(BANK_SCRAPER_CACHE_DIR, f"{safe_name}.json")
+
+
+def load_cached_transactions(account: str, ttl_hours: int = BANK_SCRAPER_CACHE_TTL_HOURS) -> Optional[List[Dict]]:
+    """Cached transactions of an account, None when there is no cache entry that is fresh and covers today's range"""
+    cache_path = get_cache_path(account)
+    try:
+        with open(cache_path, 'r') as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Invalid scrape cache for {account}, ignoring it: {e}")
+        return None
+
+    start_date, end_date = get_scrape_range()
+    scraped_at = datetime.fromisoformat(entry['scraped_at'])
+    age = datetime.now() - scraped_at
+
+    if age > timedelta(hours=ttl_hours):
+        logger.debug(f"Scrape cache of {account} is stale ({age} old)")
+        return None
+    if entry['start_date'] > start_date or entry['end_date'] < end_date:
+        logger.debug(f"Scrape cache of {account} covers {entry['start_date']} - {entry['end_date']}, "
+                     f"not {start_date} - {end_date}")
+        return None
+
+    logger.info(f"Using {len(entry['transactions'])} cached transactions of {account} "
+                f"scraped at {scraped_at.strftime('%H:%M')}")
+    return entry['transactions']
+
+
+def save_cached_transactions(account: str, transactions: List[Dict]):
+    """Store the transactions of a successfully scraped account"""
+    start_date, end_date = get_scrape_range()
+    entry = {
+        'account': account,
+        'start_date': start_date,
+        'end_date': end_date,
+        'scraped_at': datetime.now().isoformat(),
+        'transactions': transactions
+    }
+
+    os.makedirs(BANK_SCRAPER_CACHE_DIR, exist_ok=True)
+    cache_path = get_cache_path(account)
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(entry, f, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
+    logger.debug(f"Cached {len(transactions)} transactions of {account}")
+
+
+def invalidate_cached_transactions(account: str):
+    try:
+        os.remove(get_cache_path(account))
+    except FileNotFoundError:
+        pass
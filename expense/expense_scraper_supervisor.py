@@ -0,0 +1,232 @@
+"""
+Asyncio based supervisor for the bank scraper processes.
+Reads stdout/stderr line by line while the process runs, parses the structured JSON log lines as they
+arrive, tracks per-account progress and kills the process on stall or credential errors.
+"""
+import asyncio
+import json
+import os
+import re
+import signal
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from expense.expense_constants import BANK_SCRAPER_STALL_TIMEOUT, BANK_SCRAPER_CREDENTIAL_ERROR_TYPES
+from logger import logger
+
+# Python log line format: '2025-01-01 10:00:00 - function - LEVEL - message'
+LOG_LINE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2} [\d:]+ - \S+ - (\w+) - (.*)$')
+
+PROGRESS_PATTERNS = {
+    'running': re.compile(r'(\d+)/(\d+) - Starting to scrape (\S+)'),
+    'success': re.compile(r'(\d+)/(\d+) - Successfully scraped (\S+)'),
+    'failed': re.compile(r'(\d+)/(\d+) - Failed scraping (\S+)'),
+}
+
+STREAM_LINE_LIMIT = 16 * 1024 * 1024  # The scraper logs whole scrape results on a single line
+WATCHDOG_INTERVAL = 1
+
+
+class KillReason:
+    """Reasons for killing a supervised scraper process"""
+    TIMEOUT = 'timeout'
+    STALL = 'stall'
+    CREDENTIAL_ERROR = 'credential_error'
+
+
+@dataclass
+class ScraperEvent:
+    """A single parsed output line of the scraper"""
+    stream: str
+    line: str
+    level: str
+    message: str
+    data: Optional[Dict] = None
+
+
+@dataclass
+class SupervisorResult:
+    """Outcome of a supervised scraper run, compatible with subprocess.CompletedProcess attributes"""
+    returncode: Optional[int] = None
+    stdout_lines: List[str] = field(default_factory=list)
+    stderr_lines: List[str] = field(default_factory=list)
+    account_status: Dict[str, str] = field(default_factory=dict)
+    credential_errors: List[Dict] = field(default_factory=list)
+    exit_code_from_output: Optional[int] = None
+    killed_reason: Optional[str] = None
+
+    @property
+    def stdout(self) -> str:
+        return '\n'.join(self.stdout_lines)
+
+    @property
+    def stderr(self) -> str:
+        return '\n'.join(self.stderr_lines)
+
+
+def _extract_json(text: str) -> Optional[Dict]:
+    """Extract a JSON object from a line, also when it is embedded after a log prefix"""
+    start = text.find('{')
+    if start == -1:
+        return None
+    try:
+        data = json.loads(text[start:])
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def parse_scraper_line(line: str, stream: str = 'stdout') -> ScraperEvent:
+    """Parse a scraper output line, either a node JSON log line or a python log line"""
+    text = line.strip()
+    level = 'ERROR' if stream == 'stderr' else 'INFO'
+    message = text
+
+    log_match = LOG_LINE_PATTERN.match(text)
+    if log_match:
+        level, message = log_match.group(1), log_match.group(2)
+
+    data = _extract_json(message)
+    if data is not None:
+        level = str(data.get('level', level))
+        message = data.get('message') or data.get('errorMessage') or message
+
+    return ScraperEvent(stream=stream, line=line, level=level.upper(), message=str(message), data=data)
+
+
+class ScraperSupervisor:
+    """Runs a scraper command and supervises its output while it runs"""
+
+    def __init__(self, command: List[str], timeout: Optional[int] = None,
+                 stall_timeout: Optional[int] = BANK_SCRAPER_STALL_TIMEOUT,
+                 fail_fast_on_credential_error: bool = False,
+                 on_event: Optional[Callable[[ScraperEvent], None]] = None,
+                 cwd: Optional[str] = None,
+                 env: Optional[Dict[str, str]] = None):
+        self.command = [str(part) for part in command]
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self.fail_fast_on_credential_error = fail_fast_on_credential_error
+        self.on_event = on_event
+        self.cwd = cwd
+        self.env = env
+        self._last_output_time = 0.0
+        self._kill_reason = None
+
+    def run(self) -> SupervisorResult:
+        """Run the supervised process to completion"""
+        return asyncio.run(self.run_async())
+
+    async def run_async(self) -> SupervisorResult:
+        result = SupervisorResult()
+        loop = asyncio.get_running_loop()
+
+        process = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=self.cwd,
+            env=self.env,
+            limit=STREAM_LINE_LIMIT,
+            start_new_session=True  # Own process group, so node children are killed with it
+        )
+
+        start_time = self._last_output_time = loop.time()
+        readers = [
+            asyncio.create_task(self._read_stream(process.stdout, 'stdout', result.stdout_lines, result)),
+            asyncio.create_task(self._read_stream(process.stderr, 'stderr', result.stderr_lines, result))
+        ]
+        waiter = asyncio.create_task(process.wait())
+
+        while not waiter.done():
+            await asyncio.wait({waiter}, timeout=WATCHDOG_INTERVAL)
+            if waiter.done():
+                break
+
+            now = loop.time()
+            if self._kill_reason is None:
+                if self.timeout and now - start_time > self.timeout:
+                    self._kill_reason = KillReason.TIMEOUT
+                elif self.stall_timeout and now - self._last_output_time > self.stall_timeout:
+                    self._kill_reason = KillReason.STALL
+
+            if self._kill_reason:
+                self._kill(process)
+                break
+
+        await waiter
+        await asyncio.gather(*readers, return_exceptions=True)
+
+        result.returncode = process.returncode
+        result.killed_reason = self._kill_reason
+        return result
+
+    async def _read_stream(self, stream: asyncio.StreamReader, stream_name: str, lines: List[str],
+                           result: SupervisorResult):
+        loop = asyncio.get_running_loop()
+        while True:
+            raw_line = await stream.readline()
+            if not raw_line:
+                break
+
+            self._last_output_time = loop.time()
+            line = raw_line.decode('utf-8', errors='replace').rstrip('\n')
+            if not line.strip():
+                continue
+
+            lines.append(line)
+            event = parse_scraper_line(line, stream_name)
+            self._handle_event(event, result)
+
+    def _handle_event(self, event: ScraperEvent, result: SupervisorResult):
+        data = event.data or {}
+
+        if event.level == 'EXIT' and 'code' in data:
+            result.exit_code_from_output = data['code']
+        elif "Exiting with code:" in event.message:
+            try:
+                result.exit_code_from_output = int(event.message.split("Exiting with code:")[1].strip())
+            except ValueError:
+                pass
+
+        for status, pattern in PROGRESS_PATTERNS.items():
+            match = pattern.search(event.message)
+            if match:
+                index, total, account = match.groups()
+                result.account_status[account] = status
+                logger.info(f"Scraper progress {index}/{total} - {account}: {status}")
+                break
+
+        self._check_credential_error(event, result)
+
+        if self.on_event:
+            self.on_event(event)
+
+    def _check_credential_error(self, event: ScraperEvent, result: SupervisorResult):
+        data = event.data or {}
+        error_type = data.get('errorType')
+        if data.get('success', True) or error_type not in BANK_SCRAPER_CREDENTIAL_ERROR_TYPES:
+            error_type = next((error for error in BANK_SCRAPER_CREDENTIAL_ERROR_TYPES if error in event.message), None)
+            if not error_type:
+                return
+
+        account_id = data.get('accountId') or data.get('companyId') or 'unknown'
+        if any(error['account'] == account_id for error in result.credential_errors):
+            return
+
+        result.credential_errors.append({
+            'account': account_id,
+            'error_type': error_type,
+            'message': data.get('errorMessage') or event.message
+        })
+        logger.error(f"Credential error for {account_id}: {error_type}")
+
+        if self.fail_fast_on_credential_error and self._kill_reason is None:
+            self._kill_reason = KillReason.CREDENTIAL_ERROR
+
+    def _kill(self, process: asyncio.subprocess.Process):
+        logger.error(f"Killing scraper process {process.pid} - reason: {self._kill_reason}")
+        try:
+            os.killpg(os.getpgid(process.pid), signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            process.kill()
@@ -0,0 +1,117 @@
+"""
+Persisted sync watermark for incremental expense syncing.
+Keeps the last synced processed date per account and the number of Notion expense pages per processed date,
+so duplicates are checked only against the date range the scraped transactions overlap with.
+"""
+import json
+import os
+from collections import Counter
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from expense.expense_constants import SYNC_WATERMARK_FILE_PATH, SYNC_WATERMARK_MARGIN_DAYS, \
+    EXPENSE_DEDUP_WINDOW_DAYS
+from expense.expense_models import Expense
+from logger import logger
+
+
+class SyncWatermark:
+    """Last synced processed date per account, persisted between runs"""
+
+    def __init__(self, file_path: str = SYNC_WATERMARK_FILE_PATH):
+        self.file_path = file_path
+        self.accounts: Dict[str, str] = {}
+        self.page_counts: Dict[str, int] = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.file_path):
+            logger.info(f"No sync watermark found at {self.file_path}, the first run will check the full window")
+            return
+
+        try:
+            with open(self.file_path, 'r') as f:
+                data = json.load(f)
+            self.accounts = data.get('accounts', {})
+            self.page_counts = data.get('page_counts', {})
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Error reading sync watermark {self.file_path}, ignoring it: {str(e)}")
+            self.accounts, self.page_counts = {}, {}
+
+    def save(self):
+        self._prune_page_counts()
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        tmp_path = f"{self.file_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'accounts': self.accounts, 'page_counts': self.page_counts}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.file_path)
+
+    def get_overlap_window(self, scraped_expenses: List[Expense]) -> Optional[Tuple[str, str]]:
+        """
+        Date range of processed dates in which scraped expenses may already exist in Notion.
+        Returns None when an account was never synced and the full dedup window must be checked,
+        and an empty range (start > end) when nothing overlaps.
+        """
+        processed_dates_by_account = _group_processed_dates(scraped_expenses)
+        if not processed_dates_by_account:
+            return None
+
+        missing_accounts = [account for account in processed_dates_by_account if account not in self.accounts]
+        if missing_accounts:
+            logger.info(f"No sync watermark for accounts {missing_accounts}, checking the full window")
+            return None
+
+        start = min(min(dates) for dates in processed_dates_by_account.values())
+        end = min(max(max(dates) for dates in processed_dates_by_account.values()),
+                  max(self.accounts[account] for account in processed_dates_by_account))
+        return _widen(start, end)
+
+    def get_window_since(self, first_processed_date: str) -> Optional[Tuple[str, str]]:
+        """Overlap window for transactions that are not known yet, processed on or after the given date"""
+        if not self.accounts:
+            return None
+        return _widen(first_processed_date, max(self.accounts.values()))
+
+    def record_existing_pages(self, expenses: List[Expense], window: Optional[Tuple[str, str]] = None):
+        """Replace the page counts of the fetched window with the counts of the fetched expenses"""
+        if window:
+            start, end = window
+            self.page_counts = {day: count for day, count in self.page_counts.items() if not start <= day <= end}
+        else:
+            self.page_counts = {}
+
+        for day, count in Counter(str(expense.processed_date) for expense in expenses).items():
+            self.page_counts[day] = self.page_counts.get(day, 0) + count
+
+    def record_synced_expenses(self, scraped_expenses: List[Expense], added_expenses: List[Expense]):
+        """Advance the watermark of each scraped account and count the pages that were just created"""
+        for account, dates in _group_processed_dates(scraped_expenses).items():
+            self.accounts[account] = max(max(dates), self.accounts.get(account, ''))
+
+        for day, count in Counter(str(expense.processed_date) for expense in added_expenses).items():
+            self.page_counts[day] = self.page_counts.get(day, 0) + count
+
+    def count_pages_outside(self, window: Tuple[str, str]) -> int:
+        """Number of known pages in the full dedup window that the given window does not fetch"""
+        start, end = window
+        window_start = (date.today() - timedelta(days=EXPENSE_DEDUP_WINDOW_DAYS)).isoformat()
+        return sum(count for day, count in self.page_counts.items()
+                   if day >= window_start and not start <= day <= end)
+
+    def _prune_page_counts(self):
+        oldest_day = (date.today() - timedelta(days=EXPENSE_DEDUP_WINDOW_DAYS)).isoformat()
+        self.page_counts = {day: count for day, count in self.page_counts.items() if day >= oldest_day}
+
+
+def _group_processed_dates(expenses: List[Expense]) -> Dict[str, List[str]]:
+    processed_dates_by_account = {}
+    for expense in expenses:
+        if expense.processed_date:
+            processed_dates_by_account.setdefault(str(expense.account_number), []).append(str(expense.processed_date))
+    return processed_dates_by_account
+
+
+def _widen(start: str, end: str) -> Tuple[str, str]:
+    margin = timedelta(days=SYNC_WATERMARK_MARGIN_DAYS)
+    return ((date.fromisoformat(start[:10]) - margin).isoformat(),
+            (date.fromisoformat(end[:10]) + margin).isoformat())
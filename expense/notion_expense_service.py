@@ -8,26 +8,37 @@ import subprocess
 import sys
 import time
 from collections import defaultdict
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Optional, Tuple
 
 from dateutil.relativedelta import relativedelta
 
-from common import parse_expense_date, adjust_month_end_dates, remove_emojis
+from common import remove_emojis, calculate_month_boundaries
 from expense.expense_constants import (
-    last_4_months_expense_filter,
-    last_4_months_months_expense_filter, EXPENSE_TYPES, CURRENCY_SYMBOLS, EXPENSES_TO_ADJUST_DATE, DEFAULT_CATEGORY,
-    current_months_expense_filter, BANK_SCRAPER_SCRIPT_EXEC_NAME, BANK_SCRAPER_RETRIES, BANK_SCRAPER_OUTPUT_FILE_PATH
+    last_4_months_months_expense_filter, DEFAULT_CATEGORY,
+    current_months_expense_filter, BANK_SCRAPER_SCRIPT_EXEC_NAME, BANK_SCRAPER_RETRIES, BANK_SCRAPER_OUTPUT_FILE_PATH,
+    BANK_SCRAPER_STALL_TIMEOUT, BANK_SCRAPER_FAIL_FAST_ON_CREDENTIAL_ERROR, BANK_SCRAPER_STREAM_NDJSON,
+    BANK_SCRAPER_NDJSON_FILE_PATH, BANK_SCRAPER_STREAM_PATH_ENV, BANK_SCRAPER_LOOKBACK_DAYS,
+    processed_date_range_filter, EXPENSE_LEDGER_ENABLED, EXPENSE_DEDUP_WINDOW_DAYS, expense_date_range_filter,
+    BACKFILL_MAX_WORKERS, last_edited_since_filter
 )
+from expense.expense_averages import MonthlyAverages
+from expense.expense_builder import ExpenseBuilder, build_expenses
+from expense.expense_installments import InstallmentEngine
+from expense.expense_ledger import ExpenseLedger
+from expense.expense_month_snapshot import MonthSnapshot, get_top_expenses
+from expense.expense_relation_sync import RelationSync
 from expense.expense_models import Expense, MonthlyExpense, ExpenseField
+from expense.expense_scraper_supervisor import ScraperSupervisor
+from expense.expense_sync_watermark import SyncWatermark
 from expense.expense_helpers import (
-    get_name, get_category_name, get_remaining_credit,
-    parse_payment_string, find_matching_category_page, find_matching_relation, create_category_mapping,
+    find_matching_category_page, find_matching_relation, create_category_mapping,
     generate_target_dates, get_category_definitions, calculate_category_sums,
     group_expenses_by_category_or_subcategory, determine_target_category, calculate_date_range, calculate_average,
     log_monthly_total, get_amount_from_page, get_date_info, get_property_overrides, log_creation_completion,
     load_data_from_json, group_expenses_by_category, get_target_date, find_expenses_page, extract_monthly_totals,
-    extract_targets_from_pages, parse_target_date
+    extract_targets_from_pages, parse_target_date, iter_ndjson_transactions
 )
 from notion_py.helpers.notion_common import (
     get_db_pages, generate_payload, update_page_with_relation, delete_page, create_page_with_db_dict, update_page,
@@ -36,7 +47,7 @@ from notion_py.helpers.notion_common import (
 from logger import logger
 from notion_py.notion_globals import monthly_category_expense_db, NotionPropertyType, IconType, IconColor
 from notion_py.summary.summary import check_monthly_summary_exists_for_date
-from variables import ACCOUNT_NUMBER_TO_PERSON_CARD, EXPENSE_IDS_TO_EXCLUDE_FROM_AVERAGE
+from variables import ACCOUNT_NUMBER_TO_PERSON_CARD
 
 
 class NotionUpdateError(Exception):
@@ -66,96 +77,99 @@ class NotionExpenseService:
         self.expense_json = []
         self.expenses_objects_to_create: List[Expense] = []
         self.existing_expenses_objects: List[Expense] = []
-        self.expense_ids_to_exclude_from_average = EXPENSE_IDS_TO_EXCLUDE_FROM_AVERAGE
-
-    def create_expense_objects_from_json(self) -> List[Expense]:
-        """Convert JSON data to Expense objects"""
-        expenses_list = []
-
-        if not self.expense_json:
-            return expenses_list
-
-        for expense_data in self.expense_json:
-            try:
-                # Extract basic information
-                original_name = expense_data['description']
-                if "מאסטרקרד" in original_name:
-                    original_name = str(expense_data.get('identifier', '')) + " - " + original_name
-
-                expense_name = get_name(original_name, abs(expense_data['chargedAmount']))
-                category = get_category_name(expense_name, expense_data.get('category', ''),
-                                             expense_data['chargedAmount'])
-
-                # Process credit/installment information
-                expense_type = EXPENSE_TYPES.get(expense_data['type'], expense_data['type'])
-                remaining_credit_dict = get_remaining_credit(
-                    expense_data.get('memo', ''),
-                    abs(expense_data['originalAmount']),
-                    expense_type
-                )
+        self._sync_watermark: Optional[SyncWatermark] = None
+        self._ledger: Optional[ExpenseLedger] = None
+        self._ledger_refreshed = False
+        self._installments: Optional[InstallmentEngine] = None
+        self.relation_sync = RelationSync()
+        self._expense_builder: Optional[ExpenseBuilder] = None
+
+    @property
+    def sync_watermark(self) -> SyncWatermark:
+        if self._sync_watermark is None:
+            self._sync_watermark = SyncWatermark()
+        return self._sync_watermark
+
+    @property
+    def ledger(self) -> Optional[ExpenseLedger]:
+        """Local expense ledger, None when disabled"""
+        if self._ledger is None and EXPENSE_LEDGER_ENABLED:
+            self._ledger = ExpenseLedger()
+        return self._ledger
+
+    def _ledger_covers(self, start_date: str) -> bool:
+        """Whether expenses processed from start_date can be read from the ledger instead of Notion"""
+        if not self.ledger or not self.ledger.is_synced_since(start_date):
+            return False
+        return self._refresh_ledger()
 
-                # Update memo with payment information
-                charged_currency = CURRENCY_SYMBOLS.get(expense_data.get('chargedCurrency', 'ILS'))
-                memo = parse_payment_string(
-                    remaining_credit_dict,
-                    expense_data.get('memo', ''),
-                    charged_currency
-                )
+    def _refresh_ledger(self) -> bool:
+        """Pull the expenses edited in Notion since the last refresh into the ledger, once per run"""
+        if self._ledger_refreshed:
+            return True
+        try:
+            # Notion rounds last_edited_time down to the minute
+            edited_since = datetime.fromisoformat(self.ledger.get_refreshed_at()).replace(second=0, microsecond=0)
+            pulled_at = datetime.now(timezone.utc)
+            edited_expenses = self.get_expenses_from_notion(
+                filter_by=last_edited_since_filter(edited_since.isoformat()))
+            self.ledger.upsert_expenses(edited_expenses)
+            self.ledger.mark_refreshed(pulled_at)
+            self._ledger_refreshed = True
+            logger.info(f"Refreshed {len(edited_expenses)} ledger expenses edited in Notion since {edited_since}")
+            return True
+        except Exception as e:
+            logger.error(f"Error refreshing the expense ledger, reading from Notion: {str(e)}")
+            return False
 
-                # Get remaining amount
-                remaining_amount = (remaining_credit_dict.get('remaining_amount', 0)
-                                    if remaining_credit_dict.get('remaining_amount', 0) > 0 else 0)
+    @property
+    def installments(self) -> InstallmentEngine:
+        """Installment schedules of credit purchases, persisted in the ledger when it is enabled"""
+        if self._installments is None:
+            self._installments = InstallmentEngine(self.ledger)
+        return self._installments
 
-                # Process dates with validation
-                try:
-                    date = parse_expense_date(expense_data['date'])
-                    processed_date = parse_expense_date(expense_data['processedDate'])
-
-                    if expense_name in EXPENSES_TO_ADJUST_DATE:
-                        date = adjust_month_end_dates(date)
-                        processed_date = adjust_month_end_dates(processed_date)
-                except Exception as date_error:
-                    logger.error(f"Error processing dates for expense {expense_name}: {str(date_error)}")
-                    continue
+    @property
+    def expense_builder(self) -> ExpenseBuilder:
+        if self._expense_builder is None:
+            self._expense_builder = ExpenseBuilder(self.installments.recorded_installments)
+        return self._expense_builder
 
-                # Create Expense object with all required fields
-                expense = Expense(
-                    expense_type=expense_type,
-                    date=date,
-                    processed_date=processed_date,
-                    original_amount=abs(expense_data['originalAmount']),
-                    original_currency=expense_data['originalCurrency'],
-                    charged_amount=abs(expense_data['chargedAmount']),
-                    charged_currency=charged_currency,
-                    description=expense_name,
-                    category=category,
-                    memo=memo,
-                    status=expense_data['status'],
-                    account_number=expense_data['accountNumber'],
-                    remaining_amount=remaining_amount,
-                    original_name=original_name,
-                    sub_category="",  # Default empty string for sub_category
-                    page_id=None  # Will be set when added to Notion
-                )
+    def create_expense_objects_from_json(self) -> List[Expense]:
+        """Convert JSON data to Expense objects"""
+        if not self.expense_json:
+            return []
 
-                expenses_list.append(expense)
-                logger.debug(f"Successfully created expense object for {expense_name}")
-
-            except KeyError as ke:
-                logger.error(f"Missing required field in expense data: {ke}")
-                continue
-            except Exception as e:
-                logger.error(f"Error creating Expense object {expense_data.get('description', 'Unknown')}: {str(e)}")
-                continue
+        report = build_expenses(self.expense_json, known_installments=self.installments.recorded_installments)
+        for expense, remaining_credit_dict in report.installments:
+            self.installments.record_credit(expense, remaining_credit_dict)
+        self._save_installments()
 
+        expenses_list = report.expenses
         expenses_list.sort(key=lambda x: x.date, reverse=True)
-        if len(self.expense_json) != len(expenses_list):
-            logger.warning(f"{len(self.expense_json) - len(expenses_list)} expenses were not created!!\n"
-                           f"Check debug logs for more information.")
+        if report.errors:
+            logger.warning(f"{len(report.errors)} expenses were not created!! {report.error_summary()}")
+            for build_error in report.errors:
+                logger.debug(f"Transaction {build_error.index} ({build_error.description}): {build_error.error}")
         else:
             logger.info(f"Successfully created all {len(expenses_list)} Expense objects from JSON.")
         return expenses_list
 
+    def _create_expense_object(self, expense_data: Dict) -> Optional[Expense]:
+        """Convert a single scraped transaction to an Expense object, None if it cannot be converted"""
+        try:
+            expense, remaining_credit_dict = self.expense_builder.build_one(expense_data)
+        except KeyError as ke:
+            logger.error(f"Missing required field in expense data: {ke}")
+            return None
+        except Exception as e:
+            logger.error(f"Error creating Expense object {expense_data.get('description', 'Unknown')}: {str(e)}")
+            return None
+
+        self.installments.record_credit(expense, remaining_credit_dict)
+        logger.debug(f"Successfully created expense object for {expense.name}")
+        return expense
+
     def get_expenses_from_notion(self, filter_by: Optional[Dict] = None) -> List[Expense]:
         """Get expenses from Notion database"""
         expenses_objects_from_notion = []
@@ -286,41 +300,59 @@ class NotionExpenseService:
 
     def update_averages(self, target_date: datetime, categories: Optional[List[str]] = None):
         """Single entry point for updating averages"""
+        self.update_averages_for_months([target_date], categories)
+
+    def update_averages_for_months(self, target_dates: List[datetime], categories: Optional[List[str]] = None):
+        """
+        Updates the N-month averages of several months from a single query of the monthly category database.
+        Only pages whose stored average differs from the computed one are written.
+        """
         try:
-            monthly_pages = self._get_or_create_monthly_pages(target_date)
-            month_str = target_date.strftime('%B %Y')
+            averages = MonthlyAverages.fetch(self.monthly_category_expense_db_id, target_dates, ledger=self.ledger)
 
-            # If categories not specified, get all categories from pages
-            if not categories:
-                categories = [
-                    page['properties']['Category']['title'][0]['plain_text']
-                    for page in monthly_pages
-                ]
+            missing_months = [target_date for target_date in target_dates if not averages.get_month_pages(target_date)]
+            if missing_months:
+                for target_date in missing_months:
+                    self._get_or_create_monthly_pages(target_date)
+                averages = MonthlyAverages.fetch(self.monthly_category_expense_db_id, target_dates, ledger=self.ledger)
 
-            for category in categories:
-                try:
-                    page = find_matching_category_page(category, monthly_pages)
-                    if not page:
-                        continue
+            for target_date in target_dates:
+                month_str = target_date.strftime('%B %Y')
+                changed_averages = averages.get_changed_averages(target_date, categories)
 
-                    average = self.get_month_average(category, target_date)
-                    if average is not None:
+                updated_averages = {}
+                for page, category, average in changed_averages:
+                    try:
                         update_payload = {
                             "properties": {
                                 "4 Months Average": {"number": average}
                             }
                         }
                         update_page(page['id'], update_payload)
+                        updated_averages[category] = average
                         logger.info(f"Updated {category} average to {average:.2f} for {month_str}")
 
-                except Exception as e:
-                    logger.error(f"Error updating average for {category}: {str(e)}")
-                    continue
+                    except Exception as e:
+                        logger.error(f"Error updating average for {category}: {str(e)}")
+                        continue
+
+                self._update_snapshot_averages(target_date, updated_averages)
+                logger.debug(f"{len(changed_averages)} averages changed for {month_str}")
 
         except Exception as e:
             logger.error(f"Error updating averages: {str(e)}")
             raise
 
+    def _update_snapshot_averages(self, target_date: datetime, averages: Dict[str, float]):
+        if not self.ledger or not averages:
+            return
+        snapshot = self.ledger.get_month_snapshot(target_date.strftime('%Y-%m'))
+        if snapshot is None:
+            return
+        changed = [snapshot.apply_average(category, average) for category, average in averages.items()]
+        if any(changed):
+            self.ledger.save_month_snapshot(snapshot)
+
     def get_existing_expense_by_property(self, property_name: str, property_value: str) -> List[Expense]:
         """Find expenses matching a property value"""
         return [expense for expense in self.existing_expenses_objects
@@ -328,14 +360,14 @@ class NotionExpenseService:
 
     def get_notion_that_can_be_added_not_present_in_notion(self) -> List[Expense]:
         """Get expenses that can be added to Notion"""
+        existing_expenses = set(self.existing_expenses_objects)
         return [expense for expense in self.expenses_objects_to_create
-                if not self.is_expense_obj_in_notion(expense)]
+                if expense not in existing_expenses]
 
     def is_expense_obj_in_notion(self, expense: Expense) -> bool:
         """Check if expense exists in Notion"""
         try:
-            return any(expense.equals(existing_expense)
-                       for existing_expense in self.existing_expenses_objects)
+            return expense in self.existing_expenses_objects
         except Exception as e:
             logger.error(f"Error checking if expense is in Notion: {str(e)}")
             return False
@@ -343,12 +375,26 @@ class NotionExpenseService:
     def add_all_expenses_to_notion(self, check_before_adding: bool = True):
         """Add all expenses to Notion database with optimized average calculations"""
         try:
-            expenses_to_add = self._prepare_expenses_for_addition(check_before_adding)
-            if not expenses_to_add:
+            if BANK_SCRAPER_STREAM_NDJSON:
+                added_count = self._stream_expenses_to_notion(check_before_adding)
+            else:
+                added_count = None
+
+            if added_count is None:
+                # Streaming disabled, or the scraper ran without streaming - use the transactions JSON file,
+                # the scraper is only run again when it did not run yet
+                expenses_to_add = self._prepare_expenses_for_addition(check_before_adding,
+                                                                      run_scraper=not BANK_SCRAPER_STREAM_NDJSON)
+                if not expenses_to_add:
+                    return
+
+                self.add_expenses_to_notion(expenses_to_add)
+                self._save_sync_watermark(self.expenses_objects_to_create,
+                                          [expense for expense in expenses_to_add if expense.page_id])
+            elif added_count == 0:
+                logger.info("No new expenses to add to Notion")
                 return
 
-            self.add_expenses_to_notion(expenses_to_add)
-
             # Update only current month expenses
             current_date = datetime.now()
             self.process_monthly_expenses(current_date)
@@ -364,18 +410,154 @@ class NotionExpenseService:
             logger.error(error_msg)
             raise NotionUpdateError(error_msg) from e
 
-    def _prepare_expenses_for_addition(self, check_before_adding: bool) -> List[Expense]:
-        """Prepares the list of expenses to be added to Notion with improved error handling"""
-        logger.info("Preparing expenses to add to Notion")
+    def _stream_expenses_to_notion(self, check_before_adding: bool) -> Optional[int]:
+        """
+        Run the bank scraper and add expenses to Notion while it is still scraping.
+        The scraper appends every scraped transaction to an NDJSON file which is followed line by line,
+        so Notion pages are created as soon as each account finishes instead of after the whole run.
+
+        Returns:
+            Optional[int]: Number of expenses added, None if the scraper succeeded but nothing was streamed and the
+            caller should read the transactions JSON file of this run instead
+        """
+        os.makedirs(os.path.dirname(BANK_SCRAPER_NDJSON_FILE_PATH), exist_ok=True)
+        open(BANK_SCRAPER_NDJSON_FILE_PATH, 'w').close()  # Truncate the previous run
+
+        # Streamed transactions are processed on or after the scraper start date
+        first_processed_date = (datetime.now() - timedelta(days=BANK_SCRAPER_LOOKBACK_DAYS)).date().isoformat()
+        window = self.sync_watermark.get_window_since(first_processed_date)
+        self.existing_expenses_objects = self._load_existing_expenses_in_window(window)
+        seen_expenses = set(self.existing_expenses_objects) if check_before_adding else set()
+
+        env = dict(os.environ, **{BANK_SCRAPER_STREAM_PATH_ENV: BANK_SCRAPER_NDJSON_FILE_PATH})
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            scraper_future = executor.submit(self._run_bank_scrapper, env=env)
+
+            streamed_count = 0
+            scraped_expenses = []
+            added_expenses = []
+            for expense_data in iter_ndjson_transactions(BANK_SCRAPER_NDJSON_FILE_PATH,
+                                                         lambda: not scraper_future.done()):
+                streamed_count += 1
+                expense = self._create_expense_object(expense_data)
+                if not expense:
+                    continue
+                scraped_expenses.append(expense)
+
+                if window and check_before_adding and not self._is_in_sync_window(expense, window):
+                    # Never synced account or a date before the window - check against the full window once
+                    logger.info(f"{expense} is outside the sync window, loading the full dedup window")
+                    window = None
+                    self.existing_expenses_objects = self._load_existing_expenses_in_window(window)
+                    seen_expenses.update(self.existing_expenses_objects)
+
+                if expense in seen_expenses:
+                    continue
+                seen_expenses.add(expense)
+
+                try:
+                    self._add_expense_to_notion(expense, len(added_expenses), streamed_count)
+                    added_expenses.append(expense)
+                except Exception as e:
+                    logger.error(f"Error adding expense {expense}: {str(e)}")
+
+            scraper_code = scraper_future.result()
+
+        if streamed_count == 0:
+            if scraper_code not in (0, 1):
+                # A failed or killed run has no output of its own, and must not be run again (e.g. bad credentials)
+                logger.error(f"Bank scraper failed with code {scraper_code} and no transactions were streamed")
+                return 0
+            logger.warning(f"No transactions were streamed (scraper code {scraper_code}), "
+                           f"reading {BANK_SCRAPER_OUTPUT_FILE_PATH}")
+            return None
+
+        logger.info(f"Streamed {streamed_count} transactions, added {len(added_expenses)} new expenses to Notion")
+        self.expenses_objects_to_create = added_expenses
+        self.existing_expenses_objects.extend(added_expenses)
+        self._save_sync_watermark(scraped_expenses, added_expenses)
+        return len(added_expenses)
+
+    def _is_in_sync_window(self, expense: Expense, window: Tuple[str, str]) -> bool:
+        """Whether duplicates of the expense are guaranteed to be in the loaded sync window"""
+        # Expenses processed after the window end are newer than every synced watermark
+        return (str(expense.account_number) in self.sync_watermark.accounts and
+                str(expense.processed_date) >= window[0])
 
+    def _load_existing_expenses_in_window(self, window: Optional[Tuple[str, str]]) -> List[Expense]:
+        """
+        Loads the Notion expenses that scraped expenses are deduplicated against.
+        With a sync window only expenses processed inside it are fetched, otherwise the full dedup window.
+        """
+        if window is None:
+            full_window_start = (datetime.now() - timedelta(days=EXPENSE_DEDUP_WINDOW_DAYS)).date().isoformat()
+            if self._ledger_covers(full_window_start):
+                existing_expenses = self.ledger.get_expenses_by_processed_date(full_window_start)
+                logger.info(f"Checking duplicates against {len(existing_expenses)} ledger expenses in the full window")
+                return existing_expenses
+
+            pulled_at = datetime.now(timezone.utc)
+            existing_expenses = self.get_expenses_from_notion()
+            self.sync_watermark.record_existing_pages(existing_expenses)
+            if self.ledger:
+                self.ledger.replace_processed_range(existing_expenses, full_window_start)
+                self.ledger.mark_synced_from(full_window_start, pulled_at)
+            logger.info(f"Checking duplicates against {len(existing_expenses)} expenses in the full window")
+            return existing_expenses
+
+        start, end = window
+        avoided_count = self.sync_watermark.count_pages_outside(window)
+        if start > end:
+            existing_expenses = []
+        elif self._ledger_covers(start):
+            existing_expenses = self.ledger.get_expenses_by_processed_date(start, end)
+            avoided_count += len(existing_expenses)
+        else:
+            existing_expenses = self.get_expenses_from_notion(filter_by=processed_date_range_filter(start, end))
+            self.sync_watermark.record_existing_pages(existing_expenses, window)
+            if self.ledger:
+                self.ledger.replace_processed_range(existing_expenses, start, end)
+
+        logger.info(f"Checking duplicates against {len(existing_expenses)} expenses processed between {start} and "
+                    f"{end}, avoided fetching {avoided_count} pages")
+        return existing_expenses
+
+    def _save_sync_watermark(self, scraped_expenses: List[Expense], added_expenses: List[Expense]):
         try:
-            # Run bank scraper with improved timeout handling
-            scraper_success = self._run_bank_scrapper()
-            if not scraper_success:
-                logger.warning("Bank scraper did not complete successfully, but attempting to use available data")
+            if self.ledger:
+                self.ledger.upsert_expenses(added_expenses)
+            self.sync_watermark.record_synced_expenses(scraped_expenses, added_expenses)
+            self.sync_watermark.save()
         except Exception as e:
-            logger.error(f"Error running bank scraper: {str(e)}")
-            logger.warning("Continuing with existing data if available")
+            logger.error(f"Error saving sync state: {str(e)}")
+        self._save_installments()
+
+    def _save_installments(self):
+        try:
+            self.installments.save()
+        except Exception as e:
+            logger.error(f"Error saving installment schedules: {str(e)}")
+
+    def get_committed_spend(self, months_ahead: int = 12) -> Dict[str, float]:
+        """Installment payments already committed for each of the coming months, from the current month"""
+        return self.installments.get_committed_spend_by_month(datetime.now(), months_ahead)
+
+    def _prepare_expenses_for_addition(self, check_before_adding: bool, run_scraper: bool = True) -> List[Expense]:
+        """
+        Prepares the list of expenses to be added to Notion with improved error handling.
+        run_scraper - False when the scraper already ran and only its transactions JSON file should be read
+        """
+        logger.info("Preparing expenses to add to Notion")
+
+        if run_scraper:
+            try:
+                # Run bank scraper with improved timeout handling
+                scraper_success = self._run_bank_scrapper()
+                if not scraper_success:
+                    logger.warning("Bank scraper did not complete successfully, but attempting to use available data")
+            except Exception as e:
+                logger.error(f"Error running bank scraper: {str(e)}")
+                logger.warning("Continuing with existing data if available")
 
         # Continue with whatever data might be available
         if not self._load_and_process_json():
@@ -396,7 +578,7 @@ class NotionExpenseService:
 
         return expenses_to_add
 
-    def _run_bank_scrapper(self, print_output=True):
+    def _run_bank_scrapper(self, print_output=True, env: Optional[Dict[str, str]] = None):
         """
         Run the bank scraper script and return a status code indicating the outcome.
 
@@ -407,6 +589,7 @@ class NotionExpenseService:
 
         Args:
             print_output (bool): Whether to print output to logs
+            env (dict): Optional environment for the scraper process
 
         Returns:
             int: The status code of the scraper execution
@@ -415,49 +598,32 @@ class NotionExpenseService:
             script_path = os.path.join(os.path.dirname(__file__), BANK_SCRAPER_SCRIPT_EXEC_NAME)
             logger.info(f"Starting scraper script {script_path}...")
 
-            # Run the script and capture output
-            process = subprocess.Popen(
+            # Supervise the script while it runs: output is parsed line by line as it arrives
+            supervisor = ScraperSupervisor(
                 [sys.executable, script_path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
+                stall_timeout=BANK_SCRAPER_STALL_TIMEOUT,
+                fail_fast_on_credential_error=BANK_SCRAPER_FAIL_FAST_ON_CREDENTIAL_ERROR,
+                on_event=(lambda event: logger.info(event.line.strip())) if print_output else None,
+                env=env
             )
+            process = supervisor.run()
+            output_text = process.stdout + process.stderr
 
-            # Process and capture all output
-            stdout, stderr = process.communicate()
-            output_text = stdout + stderr
+            if process.killed_reason:
+                logger.error(f"Scraper script was killed - reason: {process.killed_reason}")
+                for error in process.credential_errors:
+                    logger.error(f"Credential error for {error['account']}: {error['message']}")
+                return 2
 
-            # Try to find explicit exit code in output
-            exit_code_from_output = None
-            for line in stdout.splitlines() + stderr.splitlines():
-                if '"level":"EXIT"' in line:
-                    try:
-                        # Parse the JSON object containing exit code
-                        exit_data = json.loads(line)
-                        if 'code' in exit_data:
-                            exit_code_from_output = exit_data['code']
-                            logger.debug(f"Found explicit exit code in output: {exit_code_from_output}")
-                    except:
-                        pass
-                elif "Exiting with code:" in line:
-                    try:
-                        exit_code_from_output = int(line.split("Exiting with code:")[1].strip())
-                        logger.debug(f"Parsed exit code from log message: {exit_code_from_output}")
-                    except:
-                        pass
+            # Explicit exit code parsed from the output while it was streamed
+            exit_code_from_output = process.exit_code_from_output
+            if exit_code_from_output is not None:
+                logger.debug(f"Found explicit exit code in output: {exit_code_from_output}")
 
             # Check for partial success indicators
             is_partial_success = "Only" in output_text and "accounts were successfully scraped" in output_text
-            has_failures = "Failed accounts:" in output_text
-
-            # Print output if requested
-            if print_output:
-                for line in stdout.splitlines():
-                    logger.info(line.strip())
-
-                for line in stderr.splitlines():
-                    if line.strip():  # Only log non-empty lines
-                        logger.info(line.strip())
+            has_failures = "Failed accounts:" in output_text or any(
+                status == 'failed' for status in process.account_status.values())
 
             # Determine the correct return code
             process_code = process.returncode
@@ -509,7 +675,8 @@ class NotionExpenseService:
 
     def _determine_expenses_to_add(self, check_before_adding: bool) -> List[Expense]:
         """Determines which expenses should be added to Notion"""
-        self.existing_expenses_objects = self.get_expenses_from_notion()
+        window = self.sync_watermark.get_overlap_window(self.expenses_objects_to_create)
+        self.existing_expenses_objects = self._load_existing_expenses_in_window(window)
 
         if check_before_adding:
             return self.get_notion_that_can_be_added_not_present_in_notion()
@@ -550,7 +717,7 @@ class NotionExpenseService:
     def remove_duplicates(self):
         """Remove duplicate expenses from Notion"""
         try:
-            unique_expenses = []
+            unique_expenses = set()
             expenses_to_remove = []
 
             # Get all existing expenses
@@ -558,10 +725,9 @@ class NotionExpenseService:
 
             # Find duplicates
             for expense in all_notion_expenses:
-                for unique_expense in unique_expenses:
-                    if expense.equals(unique_expense):
-                        expenses_to_remove.append(expense)
-                unique_expenses.append(expense)
+                if expense in unique_expenses:
+                    expenses_to_remove.append(expense)
+                unique_expenses.add(expense)
 
             # Get unique page IDs to remove
             expense_with_unique_page_ids = set([expense.page_id for expense in expenses_to_remove])
@@ -576,6 +742,8 @@ class NotionExpenseService:
             for i, page_id in enumerate(expense_with_unique_page_ids):
                 try:
                     delete_page(page_id)
+                    if self.ledger:
+                        self.ledger.delete_expenses([page_id])
                     logger.info(
                         f"{i + 1}/{len(expense_with_unique_page_ids)} - Successfully removed duplicate expense")
                 except Exception as e:
@@ -627,7 +795,7 @@ class NotionExpenseService:
 
     def get_expenses_without_ids_to_remove_from_average(self, expenses: List[Expense]) -> List[Expense]:
         """Filter out expenses with IDs to remove from average"""
-        return [expense for expense in expenses if str(expense.page_id).replace('-', '') not in self.expense_ids_to_exclude_from_average]
+        return [expense for expense in expenses if not expense.excluded_from_average]
 
     def _update_monthly_pages(self, monthly_pages: List[Dict], month_expenses: List[Expense],
                               month_str) -> Dict[str, float]:
@@ -635,6 +803,7 @@ class NotionExpenseService:
         try:
             expenses_by_category = group_expenses_by_category(month_expenses)
             category_totals = {}
+            relation_updates = []
 
             for category, expenses in expenses_by_category.items():
                 try:
@@ -643,44 +812,37 @@ class NotionExpenseService:
                         # Filter out expenses to exclude from average
                         filtered_expenses = self.get_expenses_without_ids_to_remove_from_average(expenses)
 
-                        if month_str == "March 2025" and "income" in category.lower():
-                            print(f"Filtered expenses for {category} and month {month_str} are {filtered_expenses}")
-
                         expense_ids = [exp.page_id for exp in filtered_expenses if exp.page_id]
-                        self._update_category_page_expenses(category, expense_ids,
-                                                            category_page['id'])
+                        relation_updates.append((category_page, expense_ids, category))
 
                         # Calculate total using only non-excluded expenses
-                        total = sum(exp.charged_amount for exp in filtered_expenses)
-                        category_totals[category] = total
-
-                        logger.debug(
-                            f"{month_str} - Updated category {category} with {len(expense_ids)} expenses, total: {total}")
+                        category_totals[category] = sum(exp.charged_amount for exp in filtered_expenses)
 
                 except Exception as e:
                     logger.error(f"Error updating category {category}: {str(e)}")
                     continue
 
+            # Categories are written concurrently, only the relations that changed
+            synced_relations = self.relation_sync.sync_pages(relation_updates)
+            for category, relation_diff in synced_relations.items():
+                logger.debug(f"{month_str} - Updated category {category} with {len(relation_diff.desired_ids)} "
+                             f"expenses, total: {category_totals[category]}")
+
             return category_totals
 
         except Exception as e:
-            logger.error(f"Failed to update monthly pages: {str(e)}")
-            return {}
+            # Totals of a month with a missing category are never written as if they were complete
+            logger.error(f"Failed to update monthly pages of {month_str}: {str(e)}")
+            raise
 
     def _update_category_page_expenses(self, category: str, expense_ids: List[str], page_id: str):
         """Updates only expense relations for a category page"""
         try:
-            payload = {
-                "properties": {
-                    "Expenses": {
-                        "relation": [{"id": expense_id} for expense_id in expense_ids]
-                    }
-                }
-            }
-
-            update_page(page_id, payload)
+            relation_diff = self.relation_sync.sync(page_id, expense_ids, label=category)
             expense_count = len(expense_ids)
-            if expense_count > 0:
+            if not relation_diff.changed:
+                logger.debug(f"Expenses for category {category} are up to date")
+            elif expense_count > 0:
                 logger.debug(f"Updated {expense_count} expenses for category {category}")
             else:
                 logger.debug(f"Cleared expenses for category {category}")
@@ -692,30 +854,7 @@ class NotionExpenseService:
     def recalculate_averages(self, target_date: datetime):
         """Recalculates averages for all categories for a specific month"""
         try:
-            monthly_pages = self._get_or_create_monthly_pages(target_date)
-            month_str = target_date.strftime('%B %Y')
-
-            for page in monthly_pages:
-                try:
-                    category = page['properties']['Category']['title'][0]['plain_text']
-
-                    # Recalculate average
-                    logger.debug(f"Recalculating average for {category} ({month_str})")
-                    average = self.get_month_average(category, target_date)
-
-                    if average is not None:
-                        update_payload = {
-                            "properties": {
-                                "4 Months Average": {"number": average}
-                            }
-                        }
-                        update_page(page['id'], update_payload)
-                        logger.info(f"Updated {category} average to {average:.2f} for {month_str}")
-
-                except Exception as e:
-                    logger.error(f"Error updating average for category {category}: {str(e)}")
-                    continue
-
+            self.update_averages(target_date)
         except Exception as e:
             logger.error(f"Error recalculating averages: {str(e)}")
 
@@ -751,18 +890,11 @@ class NotionExpenseService:
             target_date: Optional date for calculating averages
         """
         try:
-            # Create base payload for updating relations
-            payload = {
-                "properties": {
-                    "Expenses": {
-                        "relation": [{"id": expense_id} for expense_id in expense_ids]
-                    }
-                }
-            }
-
-            update_page(page_id, payload)
+            relation_diff = self.relation_sync.sync(page_id, expense_ids, label=category)
             expense_count = len(expense_ids)
-            if expense_count > 0:
+            if not relation_diff.changed:
+                logger.info(f"Expenses for category {category} are up to date")
+            elif expense_count > 0:
                 logger.info(f"Updated {expense_count} expenses for category {category.capitalize()}")
             else:
                 logger.info(f"Cleared expenses for category {category}")
@@ -783,34 +915,64 @@ class NotionExpenseService:
                 logger.info(f"No expenses found for {month_str}")
                 return {}
 
-            # Update category pages and get category totals
-            category_totals = self._update_monthly_pages(monthly_pages, month_expenses, month_str)
-
-            # Calculate and update total expenses without averages
-            self._update_total_expenses(monthly_pages, category_totals, month_str)
-
-            return category_totals
+            return self._write_month_expenses(target_date, monthly_pages, month_expenses)
 
         except Exception as e:
             error_msg = f"Error processing monthly expenses for {target_date.strftime('%B %Y')}: {str(e)}"
             logger.error(error_msg)
             raise NotionUpdateError(error_msg) from e
 
-    def _update_total_expenses(self, monthly_pages: List[Dict], category_totals: Dict[str, float], month_str: str):
-        """Updates total expenses without recalculating averages"""
+    def _write_month_expenses(self, target_date: datetime, monthly_pages: List[Dict],
+                              month_expenses: List[Expense]) -> Dict[str, float]:
+        """
+        Writes the category relations and the total of a month, returns the category totals.
+        Raises when any category relation failed, before the total, ledger totals or snapshot are written.
+        """
+        month_str = target_date.strftime('%B %Y')
+
+        # Update category pages and get category totals
+        category_totals = self._update_monthly_pages(monthly_pages, month_expenses, month_str)
+
+        # Calculate and update total expenses without averages
+        total_amount = self._update_total_expenses(monthly_pages, category_totals, month_str)
+
+        if self.ledger:
+            month_totals = dict(category_totals, Expenses=total_amount)
+            self.ledger.save_monthly_totals(target_date.replace(day=1), month_totals)
+            self._update_month_snapshot(target_date, monthly_pages, month_expenses, month_totals)
+
+        return category_totals
+
+    def _update_month_snapshot(self, target_date: datetime, monthly_pages: List[Dict], month_expenses: List[Expense],
+                               month_totals: Dict[str, float]):
+        """Creates the month snapshot on its first write and applies the new totals of late transactions"""
         try:
-            # Calculate total excluding certain categories
-            excluded_categories = ['income', 'credit card', 'saving']
-            total_amount = sum(
-                amount for category, amount in category_totals.items()
-                if category.lower() not in excluded_categories
-            )
+            month = target_date.strftime('%Y-%m')
+            snapshot = self.ledger.get_month_snapshot(month) or MonthSnapshot.from_pages(month, monthly_pages)
+            snapshot.apply_totals(month_totals)
+            counted_expenses = self.get_expenses_without_ids_to_remove_from_average(month_expenses)
+            snapshot.top_expenses = get_top_expenses(counted_expenses)
+            snapshot.closed = calculate_month_boundaries(target_date)[1] < datetime.now().date()
+            self.ledger.save_month_snapshot(snapshot)
+        except Exception as e:
+            logger.error(f"Error updating the snapshot of {target_date.strftime('%B %Y')}: {str(e)}")
+
+    def _update_total_expenses(self, monthly_pages: List[Dict], category_totals: Dict[str, float],
+                               month_str: str) -> float:
+        """Updates total expenses without recalculating averages, returns the total"""
+        # Calculate total excluding certain categories
+        excluded_categories = ['income', 'credit card', 'saving']
+        total_amount = sum(
+            amount for category, amount in category_totals.items()
+            if category.lower() not in excluded_categories
+        )
 
+        try:
             # Find and update the Expenses page
             expenses_page = find_expenses_page(monthly_pages)
             if not expenses_page:
                 logger.warning(f"Expenses page not found in monthly pages for {month_str}")
-                return
+                return total_amount
 
             # Update only the total amount
             update_payload = {
@@ -827,6 +989,8 @@ class NotionExpenseService:
         except Exception as e:
             logger.error(f"Error updating total expenses: {str(e)} for {month_str}")
 
+        return total_amount
+
     def _get_or_create_monthly_pages(self, month_date: datetime) -> List[Dict]:
         """Gets or creates monthly pages for the given date"""
         month_key = month_date.strftime("%m/%y")
@@ -855,7 +1019,7 @@ class NotionExpenseService:
             List[Expense]:
         """Gets and filters expenses for the specified month"""
         month_start = target_date.replace(day=1).date()
-        expenses = existing_expenses or self.get_expenses_from_notion(filter_by=current_months_expense_filter)
+        expenses = existing_expenses or self._get_month_expenses(target_date)
 
         logger.debug(f"Target date: {target_date}, Month start: {month_start}")
         logger.debug(f"Total expenses before filtering: {len(expenses)}")
@@ -874,6 +1038,13 @@ class NotionExpenseService:
 
         return filtered_expenses
 
+    def _get_month_expenses(self, target_date: datetime) -> List[Expense]:
+        """Gets the expenses of the target month from the ledger, or from Notion when the ledger does not cover it"""
+        month_start, month_end = calculate_month_boundaries(target_date)
+        if self._ledger_covers(month_start.isoformat()):
+            return self.ledger.get_expenses_by_date(month_start.isoformat(), month_end.isoformat())
+        return self.get_expenses_from_notion(filter_by=current_months_expense_filter)
+
     def calculate_and_update_total_expenses(self, monthly_pages: List[Dict], expenses: List[Expense],
                                             month_str) -> None:
         """Updates total expenses for the month"""
@@ -1098,9 +1269,12 @@ class NotionExpenseService:
         if existing_page:
             return existing_page
 
+        averages = MonthlyAverages.fetch(self.monthly_category_expense_db_id, [date_info['target_date']],
+                                         ledger=self.ledger)
+
         for category_dict in categories:
             try:
-                page = self._create_single_category_page(category_dict, date_info, previous_targets)
+                page = self._create_single_category_page(category_dict, date_info, previous_targets, averages)
                 if page:
                     created_pages.append(page)
             except Exception as e:
@@ -1111,14 +1285,17 @@ class NotionExpenseService:
         log_creation_completion(date_info, created_pages)
         return created_pages[0] if created_pages else None
 
-    def _create_single_category_page(self, category_dict: Dict, date_info: Dict, previous_targets: Dict[str, float]) -> \
-            Optional[Dict]:
+    def _create_single_category_page(self, category_dict: Dict, date_info: Dict, previous_targets: Dict[str, float],
+                                     averages: Optional[MonthlyAverages] = None) -> Optional[Dict]:
         """Creates a single category page with its average and target"""
         category, icon_url = list(category_dict.items())[0]
 
         # Calculate average for the category
         logger.debug(f"Calculating average for {category}")
-        average = self.get_month_average(category, date_info['target_date'])
+        if averages is not None:
+            average = averages.get_average(category, date_info['target_date'])
+        else:
+            average = self.get_month_average(category, date_info['target_date'])
         if average is not None:
             logger.info(f"Calculated {category} average: {average:.2f}")
         else:
@@ -1193,32 +1370,70 @@ class NotionExpenseService:
         """Backfills monthly expense data for past months with optimized average calculations"""
         try:
             target_dates = generate_target_dates(months_back)
-            existing_expenses = self.get_expenses_from_notion(
-                filter_by=last_4_months_expense_filter()
-            )
+            first_month_start = calculate_month_boundaries(min(target_dates))[0].isoformat()
+            last_month_end = calculate_month_boundaries(max(target_dates))[1].isoformat()
+
+            # Fetch the expenses of every month once
+            if self._ledger_covers(first_month_start):
+                existing_expenses = self.ledger.get_expenses_by_date(first_month_start, last_month_end)
+            else:
+                existing_expenses = self.get_expenses_from_notion(
+                    filter_by=expense_date_range_filter(first_month_start, last_month_end)
+                )
+                if self.ledger:
+                    self.ledger.upsert_expenses(existing_expenses)
 
             if not existing_expenses:
                 return {}
 
-            monthly_summaries = {}
-            for target_date in target_dates:
-                monthly_pages = self._get_or_create_monthly_pages(target_date)
+            return self._process_months_pipeline(target_dates, existing_expenses)
 
-                # Process expenses without averages
-                category_sums = self.process_monthly_expenses(target_date, existing_expenses)
-                if category_sums:
-                    monthly_summaries[target_date.strftime("%m/%y")] = category_sums
+        except Exception as e:
+            self._handle_backfill_error(e)
+
+    def _process_months_pipeline(self, target_dates: List[datetime],
+                                 expenses: List[Expense]) -> Dict[str, Dict[str, float]]:
+        """
+        Processes several months from expenses fetched once.
+        Expenses are grouped by month in memory, the monthly pages of all months are fetched with one query, and
+        independent months are written concurrently. Averages are updated afterwards in a single ordered pass.
+        """
+        expenses_by_month = defaultdict(list)
+        for expense in expenses:
+            expenses_by_month[str(expense.date)[:7]].append(expense)
 
-                    self._update_total_expenses(monthly_pages, category_sums, target_date.strftime('%B %Y'))
+        monthly_pages_snapshot = MonthlyAverages.fetch(self.monthly_category_expense_db_id, target_dates,
+                                                       ledger=self.ledger)
 
-            # Update averages once for all months
-            for target_date in target_dates:
-                self.update_averages(target_date)
+        def process_month(target_date: datetime) -> Dict[str, float]:
+            month_str = target_date.strftime('%B %Y')
+            monthly_pages = (monthly_pages_snapshot.get_month_pages(target_date) or
+                             self._get_or_create_monthly_pages(target_date))
+            month_expenses = expenses_by_month.get(target_date.strftime('%Y-%m'), [])
+            if not month_expenses:
+                logger.info(f"No expenses found for {month_str}")
+                return {}
+            return self._write_month_expenses(target_date, monthly_pages, month_expenses)
+
+        monthly_summaries = {}
+        with ThreadPoolExecutor(max_workers=BACKFILL_MAX_WORKERS) as executor:
+            futures = {executor.submit(process_month, target_date): target_date for target_date in target_dates}
+            for future in as_completed(futures):
+                target_date = futures[future]
+                try:
+                    category_sums = future.result()
+                except Exception as e:
+                    logger.error(f"Error processing month {target_date.strftime('%B %Y')}: {str(e)}")
+                    continue
+                if category_sums:
+                    monthly_summaries[target_date.strftime("%m/%y")] = category_sums
 
-            return monthly_summaries
+        # Update averages once for all months, in chronological order
+        self.update_averages_for_months(sorted(target_dates))
 
-        except Exception as e:
-            self._handle_backfill_error(e)
+        return {month_key: monthly_summaries[month_key]
+                for month_key in (target_date.strftime("%m/%y") for target_date in target_dates)
+                if month_key in monthly_summaries}
 
     def _handle_backfill_error(self, error: Exception):
         """Handles errors during backfill process"""
@@ -1228,64 +1443,7 @@ class NotionExpenseService:
 
     def _process_historical_months(self, expenses: List[Expense], months_back: int) -> Dict[str, Dict[str, float]]:
         """Processes expenses for each historical month"""
-        monthly_summaries = {}
-        target_dates = generate_target_dates(months_back)
-
-        for target_date in target_dates:
-            month_key = target_date.strftime("%m/%y")
-            category_sums = self._process_historical_month(target_date, expenses)
-
-            if category_sums:
-                monthly_summaries[month_key] = category_sums
-
-        return monthly_summaries
-
-    def _process_historical_month(self, target_date: datetime, expenses: List[Expense]) -> Dict[str, float]:
-        """Processes expenses for a single historical month"""
-        try:
-            # Get monthly pages for this month, creating if needed
-            monthly_pages = self._get_or_create_monthly_pages(target_date)
-            if not monthly_pages:
-                return {}
-
-            # Get filtered expenses for this month
-            month_expenses = self._get_filtered_month_expenses(target_date, expenses)
-
-            # Even if no expenses, we should still update averages
-            if not month_expenses:
-                logger.info(f"No expenses found for {target_date.strftime('%B %Y')}, updating averages only")
-                self._update_monthly_averages(monthly_pages, target_date)
-                return {}
-
-            # Process expenses and update pages
-            return self.update_monthly_pages(monthly_pages, month_expenses, target_date.strftime('%B %Y'))
-
-        except Exception as e:
-            logger.error(f"Error processing month {target_date.strftime('%B %Y')}: {str(e)}")
-            return {}
-
-    def _update_monthly_averages(self, monthly_pages: List[Dict], target_date: datetime) -> None:
-        """Updates averages for all category pages even when no expenses exist"""
-        for page in monthly_pages:
-            try:
-                category = page['properties']['Category']['title'][0]['plain_text']
-
-                # Recalculate and update average
-                logger.debug(f"Recalculating average for {category} ({target_date.strftime('%B %Y')})")
-                average = self.get_month_average(category, target_date)
-
-                if average is not None:
-                    update_payload = {
-                        "properties": {
-                            "4 Months Average": {"number": average}
-                        }
-                    }
-                    update_page(page['id'], update_payload)
-                    logger.info(f"Updated {category} average to {average:.2f} for {target_date.strftime('%B %Y')}")
-
-            except Exception as e:
-                logger.error(f"Error updating average for category {category}: {str(e)}")
-                continue
+        return self._process_months_pipeline(generate_target_dates(months_back), expenses)
 
     def update_monthly_category_expenses(self, month_year: str):
         """Update monthly category expenses for a specific month/year"""
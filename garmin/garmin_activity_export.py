@@ -0,0 +1,223 @@
+"""
+Bulk export of Garmin activity files.
+Lists the activities of a date range and downloads their original (FIT, zipped), GPX and TCX files with a bounded
+number of concurrent downloads, streaming each file to disk. A manifest in the archive directory records every file
+with its size and SHA-256, so files already in the archive are skipped and the export can be run again to resume.
+
+    python -m garmin.garmin_activity_export --start 2020-01-01 --formats original gpx
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from garmin.garmin_api import GarminSession, GARMIN_MAX_CONCURRENT_REQUESTS
+from logger import logger
+
+GARMIN_ACTIVITY_ARCHIVE_DIR = os.path.expanduser(os.getenv("GARMIN_ACTIVITY_ARCHIVE_DIR") or "~/garmin_activities")
+MANIFEST_FILE_NAME = "manifest.json"
+MANIFEST_SAVE_INTERVAL = 50  # Downloads between manifest saves, it is always saved when the export ends
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Format name to the Garmin client attribute of its download url and the file extension
+ACTIVITY_FILE_FORMATS: Dict[str, Tuple[str, str]] = {
+    "original": ("garmin_connect_fit_download", "zip"),
+    "gpx": ("garmin_connect_gpx_download", "gpx"),
+    "tcx": ("garmin_connect_tcx_download", "tcx")
+}
+DEFAULT_FORMATS = ("original",)
+
+
+def file_checksum(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+@dataclass
+class ExportReport:
+    """Result of an export run"""
+    activities: int = 0
+    downloaded: List[str] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)
+    failed: Dict[str, str] = field(default_factory=dict)  # File name to error
+    downloaded_bytes: int = 0
+
+
+class ActivityManifest:
+    """Index of the archived activity files, keyed by activity id and format"""
+
+    def __init__(self, archive_dir: str):
+        self.archive_dir = archive_dir
+        self.path = os.path.join(archive_dir, MANIFEST_FILE_NAME)
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.activities: Dict[str, Dict] = json.load(f)
+        except FileNotFoundError:
+            self.activities = {}
+
+    def get_file(self, activity_id: str, file_format: str) -> Optional[Dict]:
+        with self._lock:
+            return self.activities.get(activity_id, {}).get('files', {}).get(file_format)
+
+    def add_file(self, activity: Dict, file_format: str, relative_path: str, size: int, checksum: str):
+        activity_id = str(activity['activityId'])
+        with self._lock:
+            entry = self.activities.setdefault(activity_id, {'files': {}})
+            entry.update({
+                'name': activity.get('activityName'),
+                'type': (activity.get('activityType') or {}).get('typeKey'),
+                'start_time': activity.get('startTimeLocal')
+            })
+            entry['files'][file_format] = {
+                'path': relative_path,
+                'size': size,
+                'sha256': checksum,
+                'downloaded_at': datetime.now().isoformat()
+            }
+            self._unsaved += 1
+            if self._unsaved >= MANIFEST_SAVE_INTERVAL:
+                self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.activities, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
+
+
+class ActivityExporter:
+    """Downloads the activity files of a date range into an archive directory"""
+
+    def __init__(self, session: Optional[GarminSession] = None, archive_dir: str = GARMIN_ACTIVITY_ARCHIVE_DIR,
+                 max_workers: int = GARMIN_MAX_CONCURRENT_REQUESTS, verify_checksums: bool = True):
+        self.session = session or GarminSession()
+        self.archive_dir = archive_dir
+        self.max_workers = max_workers
+        self.verify_checksums = verify_checksums
+        self.manifest = ActivityManifest(archive_dir)
+        self._report_lock = threading.Lock()
+
+    def export(self, start_date: date, end_date: date, formats=DEFAULT_FORMATS) -> ExportReport:
+        unknown_formats = set(formats) - set(ACTIVITY_FILE_FORMATS)
+        if unknown_formats:
+            raise ValueError(f"Unknown activity file formats {', '.join(sorted(unknown_formats))}")
+
+        activities = self.session.run(lambda api: api.get_activities_by_date(start_date.isoformat(),
+                                                                             end_date.isoformat()))
+        report = ExportReport(activities=len(activities))
+        logger.info(f"Exporting {len(activities)} Garmin activities from {start_date} to {end_date}")
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for activity in activities:
+                    for file_format in formats:
+                        executor.submit(self._export_file, activity, file_format, report)
+        finally:
+            self.manifest.save()
+
+        logger.info(f"Garmin activity export done - {len(report.downloaded)} downloaded "
+                    f"({report.downloaded_bytes / 1024 / 1024:.1f}MB), {len(report.skipped)} already archived, "
+                    f"{len(report.failed)} failed")
+        return report
+
+    def get_relative_path(self, activity: Dict, file_format: str) -> str:
+        start_date = (activity.get('startTimeLocal') or '')[:10] or 'unknown'
+        _, extension = ACTIVITY_FILE_FORMATS[file_format]
+        return os.path.join(start_date[:4], f"{start_date}_{activity['activityId']}.{extension}")
+
+    def is_archived(self, activity_id: str, file_format: str, relative_path: str) -> bool:
+        """Whether the file is in the archive, matching its manifest checksum"""
+        path = os.path.join(self.archive_dir, relative_path)
+        entry = self.manifest.get_file(activity_id, file_format)
+        if not entry or not os.path.exists(path) or os.path.getsize(path) != entry['size']:
+            return False
+        return not self.verify_checksums or file_checksum(path) == entry['sha256']
+
+    def _export_file(self, activity: Dict, file_format: str, report: ExportReport):
+        activity_id = str(activity['activityId'])
+        relative_path = self.get_relative_path(activity, file_format)
+        try:
+            if self.is_archived(activity_id, file_format, relative_path):
+                with self._report_lock:
+                    report.skipped.append(relative_path)
+                return
+
+            path = os.path.join(self.archive_dir, relative_path)
+            if not self.manifest.get_file(activity_id, file_format) and os.path.exists(path):
+                # Downloaded by a run that ended before saving the manifest, files are only renamed into place whole
+                size, checksum = os.path.getsize(path), file_checksum(path)
+                self.manifest.add_file(activity, file_format, relative_path, size, checksum)
+                with self._report_lock:
+                    report.skipped.append(relative_path)
+                return
+
+            size, checksum = self.session.run(self._download, activity_id, file_format, path)
+            self.manifest.add_file(activity, file_format, relative_path, size, checksum)
+            with self._report_lock:
+                report.downloaded.append(relative_path)
+                report.downloaded_bytes += size
+            logger.debug(f"Downloaded {relative_path} ({size / 1024:.0f}KB)")
+        except Exception as e:
+            logger.error(f"Error downloading {file_format} of activity {activity_id}: {str(e)}")
+            with self._report_lock:
+                report.failed[relative_path] = str(e)
+
+    @staticmethod
+    def _download(api, activity_id: str, file_format: str, path: str) -> Tuple[int, str]:
+        """Stream the file to a temporary path and move it into place, returns its size and SHA-256"""
+        url_attribute, _ = ACTIVITY_FILE_FORMATS[file_format]
+        url = f"{getattr(api, url_attribute)}/{activity_id}"
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.part"
+        sha256 = hashlib.sha256()
+        size = 0
+        response = api.garth.get("connectapi", url, api=True, stream=True)
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    sha256.update(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, path)
+        finally:
+            response.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return size, sha256.hexdigest()
+
+
+def main(argv: Optional[List[str]] = None) -> ExportReport:
+    parser = argparse.ArgumentParser(description="Download the Garmin activity files of a date range")
+    parser.add_argument('--start', type=date.fromisoformat, default=date.today() - timedelta(days=30),
+                        help="First date (YYYY-MM-DD), 30 days ago by default")
+    parser.add_argument('--end', type=date.fromisoformat, default=date.today(), help="Last date (YYYY-MM-DD)")
+    parser.add_argument('--formats', nargs='+', choices=sorted(ACTIVITY_FILE_FORMATS), default=list(DEFAULT_FORMATS))
+    parser.add_argument('--dir', default=GARMIN_ACTIVITY_ARCHIVE_DIR, help="Archive directory")
+    parser.add_argument('--workers', type=int, default=GARMIN_MAX_CONCURRENT_REQUESTS, help="Concurrent downloads")
+    parser.add_argument('--no-verify', action='store_true', help="Skip archived files by size without a checksum")
+    args = parser.parse_args(argv)
+
+    with GarminSession(max_concurrent_requests=args.workers) as session:
+        exporter = ActivityExporter(session, args.dir, args.workers, verify_checksums=not args.no_verify)
+        return exporter.export(args.start, args.end, args.formats)
+
+
+if __name__ == "__main__":
+    main()
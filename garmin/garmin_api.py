@@ -6,11 +6,16 @@ export EMAIL=<your garmin email>
 export PASSWORD=<your garmin password>
 
 """
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, date
 import json
 import os
 import sys
+import threading
+import time
 from getpass import getpass
+from typing import Callable, Dict, List, Optional, Tuple
 
 import requests
 from garth.exc import GarthHTTPError
@@ -23,6 +28,9 @@ from garminconnect import (
 )
 
 from common import add_hours_to_time, seconds_to_hours_minutes, day_before_yesterday
+from garmin.garmin_cache import response_cache
+from garmin.garmin_timeseries import IntradayStore, intraday_store, METRIC_DTYPES, heart_rate_records, \
+    stress_records, steps_records, sleep_stage_records
 from logger import logger
 
 import garth.http
@@ -36,6 +44,19 @@ tokenstore = os.getenv("GARMINTOKENS") or "~/.garminconnect"
 tokenstore_base64 = os.getenv("GARMINTOKENS_BASE64") or "~/.garminconnect_base64"
 api = None
 
+# Concurrency - Garmin Connect throttles bursts with 429 responses
+GARMIN_MAX_CONCURRENT_REQUESTS = 4
+GARMIN_REQUESTS_PER_SECOND = 3
+GARMIN_MAX_DATE_WORKERS = 3  # Dates fetched concurrently during a backfill
+
+# Raw response cache keys
+SLEEP_ENDPOINT = "sleep"
+USER_SUMMARY_ENDPOINT = "user_summary"
+ACTIVITIES_ENDPOINT = "activities"
+HEART_RATE_ENDPOINT = "heart_rate"
+STRESS_ENDPOINT = "stress"
+STEPS_ENDPOINT = "steps"
+
 # Example selections and settings
 today = date.today()
 yesterday = today - timedelta(days=1)
@@ -233,6 +254,125 @@ def init_api(email=email, password=password):
     return garmin
 
 
+class GarminSessionError(Exception):
+    """Raised when Garmin Connect cannot be logged in to"""
+    pass
+
+
+class RateLimiter:
+    """Token bucket allowing bursts of `burst` calls and `rate` calls per second on average, shared between threads"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+class GarminSession:
+    """
+    Authenticated Garmin client shared by all the API calls of a run.
+    Logs in once, reuses the client and its HTTP connections, refreshes the OAuth2 token before it expires and
+    logs in again when Garmin rejects the token.
+    Calls may come from several threads; they are limited to GARMIN_MAX_CONCURRENT_REQUESTS in flight and
+    GARMIN_REQUESTS_PER_SECOND.
+    """
+    TOKEN_REFRESH_MARGIN = 60  # Seconds before expiry at which the OAuth2 token is refreshed
+
+    def __init__(self, login: Callable[[], Optional[Garmin]] = init_api,
+                 max_concurrent_requests: int = GARMIN_MAX_CONCURRENT_REQUESTS,
+                 requests_per_second: float = GARMIN_REQUESTS_PER_SECOND):
+        self._login = login
+        self._api: Optional[Garmin] = None
+        self._lock = threading.Lock()
+        self._request_slots = threading.BoundedSemaphore(max_concurrent_requests)
+        self._rate_limiter = RateLimiter(requests_per_second, burst=max_concurrent_requests)
+        self.login_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def api(self) -> Garmin:
+        """The logged in client, with a valid OAuth2 token"""
+        with self._lock:
+            if self._api is None:
+                self._api = self._login()
+                self.login_count += 1
+                if self._api is None:
+                    raise GarminSessionError("Could not login to Garmin Connect")
+            else:
+                self._refresh_expiring_token()
+            return self._api
+
+    def run(self, api_function: Callable, *args, **kwargs):
+        """Call api_function(api, *args, **kwargs), logging in again once if the session was rejected"""
+        api = self.api
+        try:
+            return self._call(api_function, api, *args, **kwargs)
+        except (GarminConnectAuthenticationError, GarthHTTPError) as e:
+            if not _is_auth_error(e):
+                raise
+            logger.info(f"Garmin session was rejected, logging in again: {e}")
+            self.invalidate(api)
+            return self._call(api_function, self.api, *args, **kwargs)
+
+    def _call(self, api_function: Callable, api: Garmin, *args, **kwargs):
+        with self._request_slots:
+            self._rate_limiter.wait()
+            return api_function(api, *args, **kwargs)
+
+    def invalidate(self, api: Optional[Garmin] = None):
+        """Drop the client so the next call logs in again, unless another thread already replaced it"""
+        with self._lock:
+            if api is None or self._api is api:
+                self._api = None
+
+    def close(self):
+        with self._lock:
+            if self._api is not None:
+                self._api.garth.sess.close()
+                self._api = None
+
+    def _refresh_expiring_token(self):
+        garth_client = self._api.garth
+        oauth2_token = garth_client.oauth2_token
+        if not oauth2_token or oauth2_token.expires_at - self.TOKEN_REFRESH_MARGIN > time.time():
+            return
+
+        try:
+            garth_client.refresh_oauth2()
+            garth_client.dump(tokenstore)  # Let the next run start from the refreshed token
+            logger.debug("Refreshed the Garmin OAuth2 token")
+        except (GarthHTTPError, requests.exceptions.RequestException) as e:
+            logger.info(f"Could not refresh the Garmin token, logging in again: {e}")
+            self._api = self._login()
+            self.login_count += 1
+            if self._api is None:
+                raise GarminSessionError("Could not login to Garmin Connect") from e
+
+
+def _is_auth_error(error: Exception) -> bool:
+    if isinstance(error, GarminConnectAuthenticationError):
+        return True
+    response = getattr(getattr(error, 'error', None), 'response', None)
+    return response is not None and response.status_code == 401
+
+
 def print_menu():
     """Print examples menu."""
     for key in menu_options.keys():
@@ -880,25 +1020,137 @@ def switch(api, i):
         print("Could not login to Garmin Connect, try again later.")
 
 
-def get_garmin_info(days_ago: int = 1) -> dict:
+def get_garmin_info(days_ago: int = 1, session: Optional[GarminSession] = None) -> dict:
     """
     Get Garmin info for a specific day.
     Args:
         days_ago: Number of days ago to get data for
+        session: Logged in session to reuse, a new one is logged in when not given
     Returns:
         dict: Garmin data including sleep, activity and steps info
     """
     target_date = datetime.now().date() - timedelta(days=days_ago)
 
-    api = init_api()
-    sleep_info = _get_sleep_info(api, target_date)
-    if not sleep_info:
+    session = session or GarminSession()
+
+    # The endpoints are independent, so the day takes as long as the slowest one
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        sleep_future = executor.submit(session.run, _get_sleep_info, target_date)
+        activity_future = executor.submit(session.run, _get_activity_info, target_date)
+        user_future = executor.submit(session.run, _get_user_info, target_date)
+
+        sleep_info = sleep_future.result()
+        if not sleep_info:
+            return {}
+
+        activity_info = activity_future.result()
+        user_info = user_future.result()
+
+    return _build_garmin_info(target_date, sleep_info, activity_info, user_info)
+
+
+def get_garmin_info_range(dates: List[date],
+                          session: Optional[GarminSession] = None) -> Tuple[Dict[date, dict], Dict[date, Exception]]:
+    """
+    Get Garmin info for several days at once.
+    Activities of the whole range are fetched with one range query, or per day when the range query fails. The
+    day-level sleep and user summary endpoints are fetched concurrently for all days.
+    Returns:
+        Tuple[Dict[date, dict], Dict[date, Exception]]: Garmin data per day (empty for days without sleep data),
+        and the error of every day that could not be fetched
+    """
+    if not dates:
+        return {}, {}
+
+    session = session or GarminSession()
+    garmin_info, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=GARMIN_MAX_CONCURRENT_REQUESTS) as executor:
+        activities_future = executor.submit(session.run, _get_activities_in_range, min(dates), max(dates))
+        sleep_futures = {target_date: executor.submit(session.run, _get_sleep_info, target_date)
+                         for target_date in dates}
+        user_futures = {target_date: executor.submit(session.run, _get_user_info, target_date)
+                        for target_date in dates}
+
+        try:
+            activities_by_date = activities_future.result()
+        except Exception as e:
+            logger.error(f"Error fetching activities from {min(dates)} to {max(dates)}, fetching each day: {str(e)}")
+            activities_by_date = None
+
+        for target_date in dates:
+            try:
+                sleep_info = sleep_futures[target_date].result()
+                if not sleep_info:
+                    garmin_info[target_date] = {}
+                    continue
+
+                if activities_by_date is None:
+                    activity_info = session.run(_get_activity_info, target_date)
+                else:
+                    activity_info = _summarize_activities(activities_by_date.get(target_date.isoformat(), []))
+                garmin_info[target_date] = _build_garmin_info(target_date, sleep_info, activity_info,
+                                                              user_futures[target_date].result())
+            except Exception as e:
+                errors[target_date] = e
+
+    return garmin_info, errors
+
+
+def ingest_intraday(dates: List[date], session: Optional[GarminSession] = None,
+                    store: Optional[IntradayStore] = None) -> Dict[date, Exception]:
+    """
+    Store the intraday series of finished days in the time series store, days that are already stored are skipped.
+    Returns the error of every day that could not be fetched.
+    """
+    store = store or intraday_store
+    dates = [target_date for target_date in dates if target_date < date.today()
+             and not all(store.has_day(metric, target_date) for metric in METRIC_DTYPES)]
+    if not dates:
         return {}
 
-    activity_info = _get_activity_info(api, target_date)
-    user_info = _get_user_info(api, target_date)
+    session = session or GarminSession()
+    errors = {}
+    with ThreadPoolExecutor(max_workers=GARMIN_MAX_DATE_WORKERS) as executor:
+        futures = {target_date: executor.submit(_get_intraday_records, session, target_date) for target_date in dates}
+        for target_date, future in futures.items():
+            try:
+                for metric, records in future.result().items():
+                    store.append_day(metric, target_date, records)
+            except Exception as e:
+                logger.error(f"Error storing intraday data for {target_date}: {str(e)}")
+                errors[target_date] = e
+
+    logger.info(f"Stored intraday data for {len(dates) - len(errors)}/{len(dates)} days")
+    return errors
+
+
+def _get_intraday_records(session: GarminSession, target_date: date) -> dict:
+    """Time series records of a day per metric, the raw responses go through the response cache"""
+    day = target_date.isoformat()
+    heart_rate_data = session.run(lambda api: response_cache.get_or_fetch(
+        HEART_RATE_ENDPOINT, target_date, lambda: api.get_heart_rates(day)))
+    stress_data = session.run(lambda api: response_cache.get_or_fetch(
+        STRESS_ENDPOINT, target_date, lambda: api.get_stress_data(day)))
+    steps_data = session.run(lambda api: response_cache.get_or_fetch(
+        STEPS_ENDPOINT, target_date, lambda: api.get_steps_data(day)))
+    sleep_data = session.run(lambda api: response_cache.get_or_fetch(
+        SLEEP_ENDPOINT, target_date, lambda: api.get_sleep_data(day),
+        is_complete=lambda data: bool(data and data.get('sleepMovement'))))
+
+    return {
+        **heart_rate_records(target_date, heart_rate_data),
+        **stress_records(stress_data),
+        **steps_records(steps_data),
+        **sleep_stage_records(sleep_data)
+    }
+
 
+def _build_garmin_info(target_date, sleep_info: dict, activity_info: dict, user_info: dict) -> dict:
+    """Validates and merges the endpoint data of a day"""
     if user_info.get('total_calories', 3000) < 1850:
+        # Most likely not fully synced yet, so neither are the other endpoints of the day
+        for endpoint in (USER_SUMMARY_ENDPOINT, ACTIVITIES_ENDPOINT, SLEEP_ENDPOINT):
+            response_cache.invalidate(endpoint, target_date)
         err_message = f"Error with the data - calories: {user_info.get('total_calories', 3000)} is not a correct value"
         logger.error(err_message)
         raise Exception(err_message)
@@ -912,7 +1164,8 @@ def get_garmin_info(days_ago: int = 1) -> dict:
 
 def _get_sleep_info(api, date) -> dict:
     """Extract sleep-related data from Garmin API"""
-    sleep_data = api.get_sleep_data(date.isoformat())
+    sleep_data = response_cache.get_or_fetch(SLEEP_ENDPOINT, date, lambda: api.get_sleep_data(date.isoformat()),
+                                             is_complete=lambda data: bool(data and data.get('sleepMovement')))
     if not sleep_data.get('sleepMovement'):
         return {}
 
@@ -927,7 +1180,7 @@ def _get_sleep_info(api, date) -> dict:
 
 def _get_user_info(api, date) -> dict:
     """Extract user summary data from Garmin API"""
-    user_data = api.get_user_summary(date.isoformat())
+    user_data = response_cache.get_or_fetch(USER_SUMMARY_ENDPOINT, date, lambda: api.get_user_summary(date.isoformat()))
     return {
         "steps": user_data['totalSteps'],
         "daily_steps_goal": user_data['dailyStepGoal'],
@@ -937,8 +1190,41 @@ def _get_user_info(api, date) -> dict:
 
 def _get_activity_info(api, date) -> dict:
     """Extract activity data from Garmin API"""
-    activities = api.get_activities_by_date(date.isoformat(), date.isoformat())
+    activities = response_cache.get_or_fetch(
+        ACTIVITIES_ENDPOINT, date, lambda: api.get_activities_by_date(date.isoformat(), date.isoformat()),
+        is_complete=_activities_complete)
+    return _summarize_activities(activities)
+
+
+def _activities_complete(activities) -> bool:
+    return bool(activities)  # A day without activities may not be synced yet, it is final once the sync settled
+
+
+def _get_activities_in_range(api, start_date, end_date) -> Dict[str, list]:
+    """Activities between the dates, grouped by their local start date, only the days not cached are fetched"""
+    dates = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    activities_by_date = defaultdict(list)
+    missing_dates = []
+    for target_date in dates:
+        entry = response_cache.get(ACTIVITIES_ENDPOINT, target_date)
+        if entry is None:
+            missing_dates.append(target_date)
+        else:
+            activities_by_date[target_date.isoformat()] = entry['response']
+
+    if missing_dates:
+        fetched = defaultdict(list)
+        for activity in api.get_activities_by_date(min(missing_dates).isoformat(), max(missing_dates).isoformat()):
+            fetched[activity['startTimeLocal'][:10]].append(activity)
+        for target_date in missing_dates:
+            activities = fetched.get(target_date.isoformat(), [])
+            response_cache.put(ACTIVITIES_ENDPOINT, target_date, activities, _activities_complete(activities))
+            activities_by_date[target_date.isoformat()] = activities
+
+    return activities_by_date
+
 
+def _summarize_activities(activities: list) -> dict:
     total_duration = 0
     total_calories = 0
     activity_names = []
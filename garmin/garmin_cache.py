@@ -0,0 +1,155 @@
+"""
+On-disk cache of raw Garmin Connect responses, one gzip compressed JSON file per endpoint and date.
+A day is final once it was fetched after it ended with a complete response, or GARMIN_SYNC_SETTLE_DAYS after it
+with any response, e.g. a rest day without activities - final entries are never fetched again, so reprocessing and
+analytics of past days need no network. Recent days with an incomplete response are refreshed on every read.
+"""
+import gzip
+import json
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Iterable, List, Optional, Set
+
+from logger import logger
+
+GARMIN_CACHE_ENABLED = True
+GARMIN_CACHE_DIR = os.path.expanduser(os.getenv("GARMIN_CACHE_DIR") or "~/.garminconnect_cache")
+GARMIN_SYNC_SETTLE_DAYS = 2  # Days after which a response that still looks incomplete is what Garmin has
+
+
+class GarminResponseCache:
+    """Read-through cache of raw endpoint responses keyed by (endpoint, date)"""
+
+    def __init__(self, cache_dir: str = GARMIN_CACHE_DIR, enabled: bool = GARMIN_CACHE_ENABLED):
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_path(self, endpoint: str, target_date: date) -> str:
+        return os.path.join(self.cache_dir, endpoint, f"{target_date.isoformat()}.json.gz")
+
+    def get(self, endpoint: str, target_date: date, final_only: bool = True) -> Optional[dict]:
+        """The cache entry ({'fetched_at', 'final', 'response'}), None when missing or not final"""
+        if not self.enabled:
+            return None
+        try:
+            with gzip.open(self.get_path(endpoint, target_date), 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, json.JSONDecodeError) as e:
+            logger.error(f"Invalid Garmin cache entry {endpoint} {target_date}, ignoring it: {e}")
+            return None
+
+        if final_only and not entry.get('final'):
+            return None
+        return entry
+
+    def put(self, endpoint: str, target_date: date, response: Any, complete: bool = True):
+        if not self.enabled:
+            return
+        fetched_at = datetime.now()
+        entry = {
+            'fetched_at': fetched_at.isoformat(),
+            'final': (fetched_at.date() > target_date if complete
+                      else fetched_at.date() >= target_date + timedelta(days=GARMIN_SYNC_SETTLE_DAYS)),
+            'response': response
+        }
+
+        path = self.get_path(endpoint, target_date)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    def get_or_fetch(self, endpoint: str, target_date: date, fetch: Callable[[], Any],
+                     is_complete: Callable[[Any], bool] = bool) -> Any:
+        """
+        The final cached response of the day, otherwise the fetched response, which is then cached.
+        is_complete tells whether a response holds the full data of the day, e.g. the watch already synced.
+        """
+        entry = self.get(endpoint, target_date)
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+            return entry['response']
+
+        with self._lock:
+            self.misses += 1
+        response = fetch()
+        try:
+            self.put(endpoint, target_date, response, is_complete(response))
+        except OSError as e:
+            logger.error(f"Could not cache Garmin {endpoint} for {target_date}: {e}")
+        return response
+
+    def invalidate(self, endpoint: str, target_date: date):
+        """Drop an entry whose data turned out to be incomplete, so it is fetched again"""
+        try:
+            os.remove(self.get_path(endpoint, target_date))
+        except FileNotFoundError:
+            pass
+
+
+class CompleteDates:
+    """
+    Persisted set of the dates that already have a Garmin page in a Notion database.
+    Dates are added once their page exists, so checking a window that is already filled needs no Notion query.
+    Deleting the file makes the next check query Notion again.
+    """
+
+    def __init__(self, path: str, enabled: bool = GARMIN_CACHE_ENABLED):
+        self.path = path
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._dates: Optional[Set[str]] = None
+
+    @classmethod
+    def for_database(cls, db_id: str, cache_dir: str = GARMIN_CACHE_DIR) -> 'CompleteDates':
+        return cls(os.path.join(cache_dir, f"complete_dates_{db_id.replace('-', '')}.json"))
+
+    def _load(self) -> Set[str]:
+        if self._dates is None:
+            self._dates = set()
+            if self.enabled:
+                try:
+                    with open(self.path, encoding='utf-8') as f:
+                        self._dates = set(json.load(f))
+                except FileNotFoundError:
+                    pass
+                except (OSError, ValueError, TypeError) as e:
+                    logger.error(f"Invalid Garmin complete dates file {self.path}, ignoring it: {e}")
+        return self._dates
+
+    def get_missing(self, dates: Iterable[date]) -> List[date]:
+        """The dates that are not known to be complete, in the given order"""
+        with self._lock:
+            complete = self._load()
+            return [target_date for target_date in dates if target_date.isoformat() not in complete]
+
+    def add(self, dates: Iterable[date]):
+        with self._lock:
+            complete = self._load()
+            new_dates = {target_date.isoformat() for target_date in dates} - complete
+            if not new_dates:
+                return
+            complete.update(new_dates)
+            if self.enabled:
+                self._save(complete)
+
+    def _save(self, complete: Set[str]):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(sorted(complete), f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Could not save Garmin complete dates to {self.path}: {e}")
+
+
+response_cache = GarminResponseCache()
@@ -1,48 +1,30 @@
-from datetime import timedelta, datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date
 from time import strptime
+from typing import List
 
-from common import DateOffset, today, yesterday, day_before_yesterday, get_date_offset
-from garmin.garmin_api import get_garmin_info
+from common import DateOffset, RunDate, get_run_date, get_date_offset
+from garmin.garmin_api import get_garmin_info, get_garmin_info_range, GarminSession, GARMIN_MAX_DATE_WORKERS, \
+    ingest_intraday
+from garmin.garmin_cache import CompleteDates
+from garmin.garmin_rollups import HealthRollups, HealthDay
 from logger import logger
 from notion_py.helpers.notion_common import generate_icon_url, get_db_pages, \
     get_pages_by_date_offset, \
     update_page_with_relation, create_page_with_db_dict, get_day_summary_by_date_str
+from notion_py.helpers.notion_payload import generate_payload
 from notion_py.notion_globals import DaySummaryCheckbox, IconType, IconColor
 
 WAKE_UP_HOUR_GOAL = '06:00'
-
-
-class DateManager:
-    def __init__(self):
-        self.original_today = today
-        self.original_yesterday = yesterday
-        self.original_day_before = day_before_yesterday
-
-    def __enter__(self):
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.restore_dates()
-
-    def set_dates_for_target(self, target_date):
-        """Sets global dates based on target date"""
-        global today, yesterday, day_before_yesterday
-        today = target_date + timedelta(days=1)
-        yesterday = target_date
-        day_before_yesterday = target_date - timedelta(days=1)
-
-    def restore_dates(self):
-        """Restores original global dates"""
-        global today, yesterday, day_before_yesterday
-        today = self.original_today
-        yesterday = self.original_yesterday
-        day_before_yesterday = self.original_day_before
+NOTION_WRITE_WORKERS = 3  # Garmin pages created concurrently by the bulk backfill
 
 
 class GarminManager:
     def __init__(self, garmin_db_id, day_summary_db_id):
         self.garmin_db_id = garmin_db_id
         self.day_summary_db_id = day_summary_db_id
+        self.complete_dates = CompleteDates.for_database(garmin_db_id)
+        self.health_rollups = HealthRollups()
 
     def _create_garmin_data_dict(self, date, garmin_dict):
         """Creates formatted Garmin data dictionary for Notion"""
@@ -63,23 +45,49 @@ class GarminManager:
             "Icon": generate_icon_url(IconType.WATCH, IconColor.BLUE)
         }
 
-    def _get_missing_dates(self, days_back=30):
-        """Gets list of dates without Garmin data in the last n days"""
-        existing_garmin_pages = get_db_pages(self.garmin_db_id)
-        existing_dates = {page["properties"]["Date"]["date"]["start"]
-                          for page in existing_garmin_pages}
-
-        date_range = [(today - timedelta(days=i)) for i in range(1, days_back + 1)]
-        return [date for date in date_range if date.isoformat() not in existing_dates]
-
-    def _update_daily_tasks(self, garmin_page_id, garmin_dict, target_date):
+    def _get_missing_dates(self, days_back=30, run_date=None):
+        """
+        Gets list of dates without Garmin data in the last n days.
+        Only dates that are not already known to be complete are looked up, with a single date range query.
+        """
+        run_date = run_date or get_run_date()
+        date_range = [run_date.date_for_offset(i) for i in range(1, days_back + 1)]
+        unknown_dates = self.complete_dates.get_missing(date_range)
+        if not unknown_dates:
+            return []
+
+        date_filter = {
+            "and": [
+                {"property": "Date", "date": {"on_or_after": min(unknown_dates).isoformat()}},
+                {"property": "Date", "date": {"on_or_before": max(unknown_dates).isoformat()}}
+            ]
+        }
+        existing_garmin_pages = get_db_pages(self.garmin_db_id, generate_payload(date_filter),
+                                             filter_properties=["Date"])
+        existing_dates = {page["properties"]["Date"]["date"]["start"][:10]
+                          for page in existing_garmin_pages if page["properties"]["Date"]["date"]}
+        self.complete_dates.add(date for date in unknown_dates if date.isoformat() in existing_dates)
+
+        return [date for date in unknown_dates if date.isoformat() not in existing_dates]
+
+    def rebuild_health_rollups(self, start_date=None):
+        """Stores the days of the existing Garmin pages from start_date (all pages when not given) in the rollups"""
+        date_filter = {"property": "Date", "date": {"on_or_after": self._to_date(start_date).isoformat()}} \
+            if start_date else None
+        pages = get_db_pages(self.garmin_db_id, generate_payload(date_filter))
+        changed = self.health_rollups.add_pages(pages)
+        logger.info(f"Health rollups updated for {changed} of {len(pages)} Garmin days")
+
+    def _update_daily_tasks(self, garmin_page_id, garmin_dict, target_date, run_date=None):
         """Updates daily tasks with Garmin data"""
         # Format the date properly as a string
         date_str = target_date.isoformat()
+        run_date = run_date or RunDate.for_target(target_date)
 
         # Get the daily tasks for the same date as the Garmin data
         daily_tasks = get_pages_by_date_offset(self.day_summary_db_id,
-                                               get_date_offset(date_str))
+                                               get_date_offset(date_str, run_date),
+                                               run_date=run_date)
 
         if not daily_tasks:
             logger.info(f"No daily task found for {date_str}")
@@ -101,71 +109,153 @@ class GarminManager:
         )
         logger.info(f"Updated daily task with Garmin info for {target_date.strftime('%d-%m-%Y')}")
 
-    def process_single_date(self, target_date, update_daily_tasks=True):
-        """Process Garmin data for a single date"""
-        # Ensure target_date is a proper date object
-        if isinstance(target_date, str):
-            target_date = datetime.strptime(target_date, '%Y-%m-%d').date()
-
-        formatted_date = target_date.strftime('%A %d/%m')
-        logger.info(f"Processing Garmin data for {formatted_date}")
-
-        with DateManager() as dm:
-            dm.set_dates_for_target(target_date)
+    def process_single_date(self, target_date, update_daily_tasks=True, session=None, run_date=None):
+        """
+        Process Garmin data for a single date.
+        Nothing global is changed, so several dates can be processed concurrently.
 
-            # Calculate days_ago based on target_date
-            days_ago = (datetime.now().date() - target_date).days
-            garmin_dict = get_garmin_info(days_ago=days_ago)
+        Args:
+            target_date: Date to process
+            update_daily_tasks (bool): Whether to update daily task relations
+            session (GarminSession): Logged in Garmin session shared between dates, a new one is used when not given
+            run_date (RunDate): Run date the date is processed for, the day after target_date by default
+        """
+        target_date = self._to_date(target_date)
+        garmin_dict = self._fetch_garmin_info(target_date, session)
+        return self._write_garmin_info(target_date, garmin_dict, update_daily_tasks, run_date)
 
-            if not garmin_dict:
-                logger.info(f"No Garmin data found for {formatted_date}")
-                return False
+    @staticmethod
+    def _to_date(target_date):
+        # Ensure target_date is a proper date object
+        if isinstance(target_date, str):
+            return datetime.strptime(target_date, '%Y-%m-%d').date()
+        return target_date
+
+    def _fetch_garmin_info(self, target_date, session=None):
+        """Fetches the Garmin data of a date"""
+        logger.info(f"Processing Garmin data for {target_date.strftime('%A %d/%m')}")
+
+        # Calculate days_ago based on target_date
+        days_ago = (datetime.now().date() - target_date).days
+        return get_garmin_info(days_ago=days_ago, session=session)
+
+    def _write_garmin_info(self, target_date, garmin_dict, update_daily_tasks=True, run_date=None):
+        """Creates the Garmin page of a date and links it to the daily task, returns whether there was data"""
+        if not garmin_dict:
+            logger.info(f"No Garmin data found for {target_date.strftime('%A %d/%m')}")
+            return False
+
+        self._create_garmin_page(target_date, garmin_dict, update_daily_tasks, run_date)
+        return True
+
+    def _create_garmin_page(self, target_date, garmin_dict, update_daily_tasks=True, run_date=None):
+        formatted_data = self._create_garmin_data_dict(target_date, garmin_dict)
+        response = create_page_with_db_dict(self.garmin_db_id, formatted_data)
+        self.complete_dates.add([target_date])
+        logger.info(f"Created Garmin info for {target_date.strftime('%A %d/%m')}")
+
+        try:
+            self.health_rollups.add_day(HealthDay.from_garmin_info(target_date, garmin_dict))
+        except Exception as e:
+            logger.error(f"Error updating health rollups for {target_date}: {str(e)}")
+
+        if update_daily_tasks:
+            try:
+                self._update_daily_tasks(response['id'], garmin_dict, target_date, run_date)
+            except Exception as e:
+                logger.error(f"Error updating daily tasks: {str(e)}")
 
-            formatted_data = self._create_garmin_data_dict(target_date, garmin_dict)
-            response = create_page_with_db_dict(self.garmin_db_id, formatted_data)
-            logger.info(f"Created Garmin info for {formatted_date}")
+    def _bulk_update(self, dates_to_update, update_daily_tasks, session) -> List[date]:
+        """
+        Fetches all dates with range requests and writes their pages in concurrent batches.
+        Returns the dates written.
+        """
+        garmin_info, errors = get_garmin_info_range(dates_to_update, session)
+        for target_date, error in errors.items():
+            logger.error(f"Error processing {target_date}: {str(error)}")
 
-            if update_daily_tasks and garmin_dict:
+        dates_with_data = [target_date for target_date in dates_to_update if garmin_info.get(target_date)]
+        for target_date in dates_to_update:
+            if target_date in garmin_info and not garmin_info[target_date]:
+                logger.info(f"No Garmin data found for {target_date.strftime('%A %d/%m')}")
+
+        written_dates = []
+        with ThreadPoolExecutor(max_workers=NOTION_WRITE_WORKERS) as executor:
+            futures = {executor.submit(self._create_garmin_page, target_date, garmin_info[target_date],
+                                       update_daily_tasks): target_date
+                       for target_date in dates_with_data}
+            for future, target_date in futures.items():
                 try:
-                    self._update_daily_tasks(response['id'], garmin_dict, target_date)
+                    future.result()
+                    written_dates.append(target_date)
                 except Exception as e:
-                    logger.error(f"Error updating daily tasks: {str(e)}")
-
-            return True
+                    logger.error(f"Error creating Garmin page for {target_date}: {str(e)}")
+        return written_dates
 
-    def update_garmin_info(self, update_daily_tasks=True, fill_history=False):
+    def update_garmin_info(self, update_daily_tasks=True, fill_history=False, bulk=True, run_date=None,
+                           store_intraday=True):
         """
         Updates Garmin information in Notion database.
 
         Args:
             update_daily_tasks (bool): Whether to update daily task relations
             fill_history (bool): Whether to check and fill historical gaps
+            bulk (bool): Whether to backfill several dates with range requests and batched page creation
+            run_date (RunDate): Date the run is for, the run date of the current context by default
+            store_intraday (bool): Whether to also store the intraday series of the dates written in the time series
+                store, dates that failed validation are left for the run that writes them
         """
+        run_date = run_date or get_run_date()
         if fill_history:
-            dates_to_update = self._get_missing_dates()
+            dates_to_update = self._get_missing_dates(run_date=run_date)
             if not dates_to_update:
                 logger.info("No missing dates found in Garmin data")
                 return
             logger.info(f"Found {len(dates_to_update)} dates to update")
         else:
             # Check if yesterday exists
+            if not self.complete_dates.get_missing([run_date.yesterday]):
+                logger.info(f"Garmin page for yesterday already exists")
+                return
             yesterday_pages = get_pages_by_date_offset(self.garmin_db_id,
-                                                       DateOffset.YESTERDAY)
+                                                       DateOffset.YESTERDAY, run_date=run_date)
             if yesterday_pages:
+                self.complete_dates.add([run_date.yesterday])
                 logger.info(f"Garmin page for yesterday already exists")
                 return
-            dates_to_update = [yesterday]
+            dates_to_update = [run_date.yesterday]
 
-        success_count = 0
-        for target_date in dates_to_update:
-            try:
-                if self.process_single_date(target_date, update_daily_tasks):
-                    success_count += 1
-            except Exception as e:
-                logger.error(f"Error processing {target_date}: {str(e)}")
-                continue
+        dates_to_update = [self._to_date(target_date) for target_date in dates_to_update]
+        with GarminSession() as session:
+            if bulk and len(dates_to_update) > 1:
+                written_dates = self._bulk_update(dates_to_update, update_daily_tasks, session)
+            else:
+                written_dates = self._update_dates(dates_to_update, update_daily_tasks, session)
+
+            # Only days whose data passed validation, their raw responses are complete
+            if store_intraday and written_dates:
+                ingest_intraday(written_dates, session)
+
+            logger.info(f"Successfully processed {len(written_dates)}/{len(dates_to_update)} dates "
+                        f"with {session.login_count} Garmin login(s)")
 
-        logger.info(f"Successfully processed {success_count}/{len(dates_to_update)} dates")
+    def _update_dates(self, dates_to_update, update_daily_tasks, session) -> List[date]:
+        """
+        Fetches dates concurrently and writes them to Notion in order as their data arrives.
+        Returns the dates written.
+        """
+        written_dates = []
+        with ThreadPoolExecutor(max_workers=GARMIN_MAX_DATE_WORKERS) as executor:
+            futures = [executor.submit(self._fetch_garmin_info, target_date, session)
+                       for target_date in dates_to_update]
+            for target_date, future in zip(dates_to_update, futures):
+                try:
+                    if self._write_garmin_info(target_date, future.result(), update_daily_tasks):
+                        written_dates.append(target_date)
+                except Exception as e:
+                    logger.error(f"Error processing {target_date}: {str(e)}")
+                    continue
+        return written_dates
 
     def check_wake_up_early_according_to_sleep_end(self, sleep_end_dict):
         """
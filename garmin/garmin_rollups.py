@@ -0,0 +1,259 @@
+"""
+Incremental health rollups of the Garmin days.
+Every day is stored once with its steps, sleep, calories, workouts and weight, and its values are added to the
+weekly, monthly and yearly buckets it belongs to. Storing a day again applies only the difference to its buckets, so
+the rollups stay exact without rescanning, and trend queries read one row per bucket instead of querying Notion.
+"""
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from common import parse_duration_to_seconds
+from garmin.garmin_timeseries import GARMIN_TIMESERIES_DIR
+from logger import logger
+
+GARMIN_ROLLUPS_DB_PATH = os.path.join(GARMIN_TIMESERIES_DIR, "health_rollups.db")
+
+# Rollup periods
+DAY = "day"
+WEEK = "week"
+MONTH = "month"
+YEAR = "year"
+ROLLUP_PERIODS = (WEEK, MONTH, YEAR)
+
+# Averaged fields, each day contributes to the average of a field only when it has a value
+AVERAGED_FIELDS = ("steps", "sleep_seconds", "calories", "weight")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS health_days (
+    date TEXT PRIMARY KEY,
+    steps INTEGER,
+    sleep_seconds INTEGER,
+    calories INTEGER,
+    workouts INTEGER NOT NULL DEFAULT 0,
+    weight REAL
+);
+
+CREATE TABLE IF NOT EXISTS health_rollups (
+    period TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    days INTEGER NOT NULL DEFAULT 0,
+    workouts INTEGER NOT NULL DEFAULT 0,
+    steps_sum REAL NOT NULL DEFAULT 0,
+    steps_count INTEGER NOT NULL DEFAULT 0,
+    sleep_seconds_sum REAL NOT NULL DEFAULT 0,
+    sleep_seconds_count INTEGER NOT NULL DEFAULT 0,
+    calories_sum REAL NOT NULL DEFAULT 0,
+    calories_count INTEGER NOT NULL DEFAULT 0,
+    weight_sum REAL NOT NULL DEFAULT 0,
+    weight_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (period, bucket)
+);
+"""
+
+ROLLUP_COLUMNS = ['days', 'workouts'] + [f"{field}_{part}" for field in AVERAGED_FIELDS for part in ('sum', 'count')]
+
+
+def get_bucket(period: str, day: date) -> str:
+    """The bucket of a day - YYYY-MM-DD, YYYY-Www (ISO week), YYYY-MM or YYYY"""
+    if period == DAY:
+        return day.isoformat()
+    if period == WEEK:
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    if period == MONTH:
+        return day.strftime('%Y-%m')
+    if period == YEAR:
+        return str(day.year)
+    raise ValueError(f"Unknown rollup period {period}")
+
+
+def add_months(month: str, months: int) -> str:
+    """Add months to a 'YYYY-MM' month"""
+    year, month_number = divmod(int(month[:4]) * 12 + int(month[5:7]) - 1 + months, 12)
+    return f"{year:04d}-{month_number + 1:02d}"
+
+
+@dataclass(frozen=True)
+class HealthDay:
+    """Health values of a single day, None when the day has no value"""
+    date: date
+    steps: Optional[int] = None
+    sleep_seconds: Optional[int] = None
+    calories: Optional[int] = None
+    workouts: int = 0
+    weight: Optional[float] = None
+
+    @classmethod
+    def from_garmin_info(cls, target_date: date, garmin_dict: Dict) -> 'HealthDay':
+        """The day of a get_garmin_info result"""
+        sleep_duration = garmin_dict.get('sleep_duration')
+        return cls(
+            date=target_date,
+            steps=garmin_dict.get('steps') or None,
+            sleep_seconds=(parse_duration_to_seconds(sleep_duration) or None) if sleep_duration else None,
+            calories=garmin_dict.get('total_calories') or None,
+            workouts=len(garmin_dict.get('activity_names') or [])
+        )
+
+    @classmethod
+    def from_page(cls, page: Dict) -> Optional['HealthDay']:
+        """The day of a Garmin Notion page, None for a page without a date"""
+        props = page['properties']
+        page_date = (props.get('Date', {}).get('date') or {}).get('start')
+        if not page_date:
+            return None
+
+        def get_text(name: str) -> Optional[str]:
+            rich_text = props.get(name, {}).get('rich_text')
+            return rich_text[0]['plain_text'] if rich_text else None
+
+        sleep_duration = get_text('Sleep Duration')
+        return cls(
+            date=date.fromisoformat(page_date[:10]),
+            steps=props.get('Steps', {}).get('number') or None,
+            sleep_seconds=(parse_duration_to_seconds(sleep_duration) or None) if sleep_duration else None,
+            calories=props.get('Calories', {}).get('number') or None,
+            workouts=len(props.get('Activities', {}).get('multi_select') or []),
+            weight=props.get('Weight', {}).get('number') or None
+        )
+
+    def contribution(self) -> Dict[str, float]:
+        """The values the day adds to every bucket it belongs to"""
+        values = {'days': 1, 'workouts': self.workouts}
+        for field in AVERAGED_FIELDS:
+            value = getattr(self, field)
+            values[f"{field}_sum"] = value or 0
+            values[f"{field}_count"] = int(value is not None)
+        return values
+
+
+@dataclass(frozen=True)
+class HealthBucket:
+    """Rolled up values of a week, month or year"""
+    period: str
+    bucket: str
+    days: int = 0
+    workouts: int = 0
+    steps_sum: float = 0
+    steps_count: int = 0
+    sleep_seconds_sum: float = 0
+    sleep_seconds_count: int = 0
+    calories_sum: float = 0
+    calories_count: int = 0
+    weight_sum: float = 0
+    weight_count: int = 0
+
+    def get_average(self, field: str) -> Optional[float]:
+        count = getattr(self, f"{field}_count")
+        return getattr(self, f"{field}_sum") / count if count else None
+
+
+def combine_average(buckets: Iterable[HealthBucket], field: str) -> Optional[float]:
+    """Average of a field over all the days of the buckets"""
+    total, count = 0.0, 0
+    for bucket in buckets:
+        total += getattr(bucket, f"{field}_sum")
+        count += getattr(bucket, f"{field}_count")
+    return total / count if count else None
+
+
+class HealthRollups:
+    """SQLite store of the health days and their weekly, monthly and yearly rollups"""
+
+    def __init__(self, db_path: str = GARMIN_ROLLUPS_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        if db_path != ':memory:':
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    # Writes
+    def add_days(self, days: Iterable[HealthDay]) -> int:
+        """Store days, replacing their previous values. Returns the number of days that changed."""
+        changed = 0
+        with self._lock, self.connection:
+            for day in days:
+                changed += self._add_day(day)
+        return changed
+
+    def add_day(self, day: HealthDay) -> bool:
+        return self.add_days([day]) == 1
+
+    def add_pages(self, pages: Iterable[Dict]) -> int:
+        """Store the days of Garmin Notion pages"""
+        days = [day for day in (HealthDay.from_page(page) for page in pages) if day]
+        changed = self.add_days(days)
+        if changed:
+            logger.debug(f"Updated the health rollups of {changed} days")
+        return changed
+
+    def _add_day(self, day: HealthDay) -> bool:
+        row = self.connection.execute("SELECT * FROM health_days WHERE date = ?", (day.date.isoformat(),)).fetchone()
+        previous = _row_to_day(row) if row else None
+        if previous == day:
+            return False
+
+        new_values = day.contribution()
+        old_values = previous.contribution() if previous else {column: 0 for column in ROLLUP_COLUMNS}
+        delta = [new_values[column] - old_values[column] for column in ROLLUP_COLUMNS]
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO health_days (date, steps, sleep_seconds, calories, workouts, weight) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (day.date.isoformat(), day.steps, day.sleep_seconds, day.calories, day.workouts, day.weight))
+        updates = ', '.join(f"{column} = {column} + excluded.{column}" for column in ROLLUP_COLUMNS)
+        self.connection.executemany(
+            f"INSERT INTO health_rollups (period, bucket, {', '.join(ROLLUP_COLUMNS)}) "
+            f"VALUES (?, ?, {', '.join('?' for _ in ROLLUP_COLUMNS)}) "
+            f"ON CONFLICT (period, bucket) DO UPDATE SET {updates}",
+            [(period, get_bucket(period, day.date), *delta) for period in ROLLUP_PERIODS])
+        return True
+
+    # Reads
+    def get_day(self, day: date) -> Optional[HealthDay]:
+        row = self.connection.execute("SELECT * FROM health_days WHERE date = ?", (day.isoformat(),)).fetchone()
+        return _row_to_day(row) if row else None
+
+    def get_days(self, start_date: date, end_date: date) -> List[HealthDay]:
+        rows = self.connection.execute("SELECT * FROM health_days WHERE date BETWEEN ? AND ? ORDER BY date",
+                                       (start_date.isoformat(), end_date.isoformat()))
+        return [_row_to_day(row) for row in rows]
+
+    def get_bucket(self, period: str, bucket: str) -> HealthBucket:
+        """The rollup of a bucket, empty when no day of it was stored"""
+        row = self.connection.execute("SELECT * FROM health_rollups WHERE period = ? AND bucket = ?",
+                                      (period, bucket)).fetchone()
+        return HealthBucket(**dict(row)) if row else HealthBucket(period, bucket)
+
+    def get_buckets(self, period: str, buckets: Iterable[str]) -> List[HealthBucket]:
+        return [self.get_bucket(period, bucket) for bucket in buckets]
+
+    def get_months(self, end_month: str, months: int) -> List[HealthBucket]:
+        """The rollups of the months up to end_month (YYYY-MM), oldest first"""
+        return self.get_buckets(MONTH, [add_months(end_month, -i) for i in reversed(range(months))])
+
+    def rolling_average(self, field: str, end_month: str, months: int = 12) -> Optional[float]:
+        """Average of a field over the days of the months up to end_month, e.g. the 12-month sleep average"""
+        return combine_average(self.get_months(end_month, months), field)
+
+    def year_over_year(self, field: str, bucket: str) -> Tuple[Optional[float], Optional[float]]:
+        """Average of a field in a month (YYYY-MM) or year (YYYY) and in the same bucket a year before"""
+        period = YEAR if len(bucket) == 4 else MONTH
+        previous_bucket = f"{int(bucket[:4]) - 1:04d}{bucket[4:]}"
+        return (self.get_bucket(period, bucket).get_average(field),
+                self.get_bucket(period, previous_bucket).get_average(field))
+
+
+def _row_to_day(row: sqlite3.Row) -> HealthDay:
+    values = dict(row)
+    values['date'] = date.fromisoformat(values['date'])
+    return HealthDay(**values)
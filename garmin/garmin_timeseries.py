@@ -0,0 +1,255 @@
+"""
+Intraday Garmin time series - heart rate, stress, body battery, steps and sleep stages.
+Each metric is an append-only file of fixed size records read as a memory-mapped NumPy array, with a JSON index of
+the rows of every day. Queries select the rows of a date range through the index and aggregate them with vectorized
+NumPy operations, so summaries read local files only.
+"""
+import json
+import os
+import threading
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from logger import logger
+
+GARMIN_TIMESERIES_DIR = os.path.expanduser(os.getenv("GARMIN_TIMESERIES_DIR") or "~/.garminconnect_timeseries")
+
+# Metrics
+HEART_RATE = "heart_rate"
+RESTING_HEART_RATE = "resting_heart_rate"
+STRESS = "stress"
+BODY_BATTERY = "body_battery"
+STEPS = "steps"
+SLEEP_STAGES = "sleep_stages"
+
+# Record layouts - timestamps are epoch milliseconds (GMT), durations are seconds
+SAMPLE_DTYPE = np.dtype([('timestamp', '<i8'), ('value', '<f4')])
+INTERVAL_DTYPE = np.dtype([('timestamp', '<i8'), ('value', '<f4'), ('duration', '<f4')])
+
+METRIC_DTYPES = {
+    HEART_RATE: SAMPLE_DTYPE,
+    RESTING_HEART_RATE: SAMPLE_DTYPE,  # One record per day
+    STRESS: SAMPLE_DTYPE,
+    BODY_BATTERY: SAMPLE_DTYPE,
+    STEPS: INTERVAL_DTYPE,
+    SLEEP_STAGES: INTERVAL_DTYPE
+}
+
+# Garmin sleep levels, the value of a sleep stage record
+SLEEP_STAGE_NAMES = ("deep", "light", "rem", "awake")
+
+# Heart rate zones as fractions of the max heart rate, like the Garmin default zones 1-5. Zone 0 is below zone 1.
+MAX_HEART_RATE = 185
+HEART_RATE_ZONE_FRACTIONS = (0.5, 0.6, 0.7, 0.8, 0.9)
+HEART_RATE_SAMPLE_SECONDS = 120  # All-day heart rate is sampled every 2 minutes, longer gaps are time off the wrist
+
+
+def _day_timestamp(day: date) -> int:
+    return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def _gmt_to_timestamp(gmt: str) -> int:
+    return int(datetime.strptime(gmt[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def heart_rate_records(day: date, heart_rate_data: Optional[dict]) -> Dict[str, np.ndarray]:
+    """Heart rate and resting heart rate records of a get_heart_rates response"""
+    heart_rate_data = heart_rate_data or {}
+    samples = [(timestamp, value) for timestamp, value in heart_rate_data.get('heartRateValues') or []
+               if value is not None]
+    resting_heart_rate = heart_rate_data.get('restingHeartRate')
+    resting = [(_day_timestamp(day), resting_heart_rate)] if resting_heart_rate else []
+    return {
+        HEART_RATE: np.array(samples, dtype=SAMPLE_DTYPE),
+        RESTING_HEART_RATE: np.array(resting, dtype=SAMPLE_DTYPE)
+    }
+
+
+def stress_records(stress_data: Optional[dict]) -> Dict[str, np.ndarray]:
+    """Stress and body battery records of a get_stress_data response, unmeasured values (negative) are dropped"""
+    stress_data = stress_data or {}
+    stress = [(timestamp, value) for timestamp, value in stress_data.get('stressValuesArray') or []
+              if value is not None and value >= 0]
+
+    level_index = next((descriptor['bodyBatteryValueDescriptorIndex']
+                        for descriptor in stress_data.get('bodyBatteryValueDescriptorDTOList') or []
+                        if descriptor.get('bodyBatteryValueDescriptorKey') == 'bodyBatteryLevel'), 2)
+    body_battery = [(values[0], values[level_index]) for values in stress_data.get('bodyBatteryValuesArray') or []
+                    if len(values) > level_index and values[level_index] is not None]
+    return {
+        STRESS: np.array(stress, dtype=SAMPLE_DTYPE),
+        BODY_BATTERY: np.array(body_battery, dtype=SAMPLE_DTYPE)
+    }
+
+
+def _interval_records(intervals: List[dict], value_key: str) -> np.ndarray:
+    records = []
+    for interval in intervals:
+        if interval.get(value_key) is None:
+            continue
+        start = _gmt_to_timestamp(interval['startGMT'])
+        records.append((start, interval[value_key], (_gmt_to_timestamp(interval['endGMT']) - start) / 1000))
+    return np.array(records, dtype=INTERVAL_DTYPE)
+
+
+def steps_records(steps_data: Optional[list]) -> Dict[str, np.ndarray]:
+    """Step count records of the 15 minute intervals of a get_steps_data response"""
+    return {STEPS: _interval_records(steps_data or [], 'steps')}
+
+
+def sleep_stage_records(sleep_data: Optional[dict]) -> Dict[str, np.ndarray]:
+    """Sleep stage records of a get_sleep_data response, the value is the index in SLEEP_STAGE_NAMES"""
+    return {SLEEP_STAGES: _interval_records((sleep_data or {}).get('sleepLevels') or [], 'activityLevel')}
+
+
+class IntradayStore:
+    """Per metric record files with a day index, appended by the ingestion and read through memory maps"""
+
+    def __init__(self, root_dir: str = GARMIN_TIMESERIES_DIR):
+        self.root_dir = root_dir
+        self._lock = threading.RLock()
+        self._indexes: Dict[str, Dict[str, List[int]]] = {}
+        self._arrays: Dict[str, np.ndarray] = {}
+
+    def _data_path(self, metric: str) -> str:
+        return os.path.join(self.root_dir, f"{metric}.bin")
+
+    def _index_path(self, metric: str) -> str:
+        return os.path.join(self.root_dir, f"{metric}.index.json")
+
+    def get_index(self, metric: str) -> Dict[str, List[int]]:
+        """Day (YYYY-MM-DD) to [first row, row count] of a metric"""
+        with self._lock:
+            if metric not in self._indexes:
+                try:
+                    with open(self._index_path(metric), encoding='utf-8') as f:
+                        self._indexes[metric] = json.load(f)
+                except FileNotFoundError:
+                    self._indexes[metric] = {}
+            return self._indexes[metric]
+
+    def has_day(self, metric: str, day: date) -> bool:
+        return day.isoformat() in self.get_index(metric)
+
+    def get_days(self, metric: str) -> List[date]:
+        return sorted(date.fromisoformat(day) for day in self.get_index(metric))
+
+    def append_day(self, metric: str, day: date, records: np.ndarray):
+        """
+        Store the records of a day. A day that is stored again points to its new rows,
+        the old rows stay in the file unreferenced.
+        """
+        records = np.asarray(records, dtype=METRIC_DTYPES[metric])
+        with self._lock:
+            os.makedirs(self.root_dir, exist_ok=True)
+            data_path = self._data_path(metric)
+            # A partially written record of an interrupted append is cut off
+            offset = os.path.getsize(data_path) // records.dtype.itemsize if os.path.exists(data_path) else 0
+            with open(data_path, 'ab') as f:
+                f.seek(offset * records.dtype.itemsize)
+                f.truncate()
+                f.write(records.tobytes())
+
+            index = self.get_index(metric)
+            index[day.isoformat()] = [offset, len(records)]
+            tmp_path = f"{self._index_path(metric)}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self._index_path(metric))
+            self._arrays.pop(metric, None)
+
+    def get_array(self, metric: str) -> np.ndarray:
+        """All the records of a metric, memory-mapped read only"""
+        with self._lock:
+            if metric not in self._arrays:
+                dtype = METRIC_DTYPES[metric]
+                data_path = self._data_path(metric)
+                if os.path.exists(data_path) and os.path.getsize(data_path) >= dtype.itemsize:
+                    self._arrays[metric] = np.memmap(data_path, dtype=dtype, mode='r',
+                                                     shape=(os.path.getsize(data_path) // dtype.itemsize,))
+                else:
+                    self._arrays[metric] = np.empty(0, dtype=dtype)
+            return self._arrays[metric]
+
+    def get_range(self, metric: str, start_date: date, end_date: date) -> Tuple[np.ndarray, np.ndarray]:
+        """Records of the days between the dates (inclusive) in day order, and the day (datetime64[D]) of each"""
+        start, end = start_date.isoformat(), end_date.isoformat()
+        with self._lock:
+            days = sorted((day, rows) for day, rows in self.get_index(metric).items() if start <= day <= end)
+            array = self.get_array(metric)
+
+        if not days:
+            return np.empty(0, dtype=METRIC_DTYPES[metric]), np.empty(0, dtype='datetime64[D]')
+
+        counts = np.array([count for _, (_, count) in days])
+        row_indices = np.concatenate([np.arange(offset, offset + count) for _, (offset, count) in days])
+        record_days = np.repeat(np.array([day for day, _ in days], dtype='datetime64[D]'), counts)
+        return np.asarray(array[row_indices]), record_days
+
+
+intraday_store = IntradayStore()
+
+
+def daily_averages(metric: str, start_date: date, end_date: date,
+                   store: Optional[IntradayStore] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Days with data and the average value of each"""
+    records, days = (store or intraday_store).get_range(metric, start_date, end_date)
+    unique_days, day_index = np.unique(days, return_inverse=True)
+    sums = np.bincount(day_index, weights=records['value'], minlength=len(unique_days))
+    counts = np.bincount(day_index, minlength=len(unique_days))
+    return unique_days, sums / np.maximum(counts, 1)
+
+
+def resting_heart_rate_trend(start_date: date, end_date: date, window: int = 7,
+                             store: Optional[IntradayStore] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Days with a resting heart rate, the resting heart rate and its trailing average over window days with data"""
+    records, days = (store or intraday_store).get_range(RESTING_HEART_RATE, start_date, end_date)
+    values = records['value'].astype(np.float64)
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    end_index = np.arange(1, len(values) + 1)
+    start_index = np.maximum(end_index - window, 0)
+    rolling_average = (cumulative[end_index] - cumulative[start_index]) / (end_index - start_index)
+    return days, values, rolling_average
+
+
+def average_resting_heart_rate(start_date: date, end_date: date,
+                               store: Optional[IntradayStore] = None) -> Optional[float]:
+    _, values, _ = resting_heart_rate_trend(start_date, end_date, store=store)
+    return round(float(values.mean()), 1) if len(values) else None
+
+
+def time_in_zones_by_month(start_date: date, end_date: date, max_heart_rate: int = MAX_HEART_RATE,
+                           store: Optional[IntradayStore] = None) -> Dict[str, np.ndarray]:
+    """
+    Seconds spent in each heart rate zone (0-5) per month (YYYY-MM).
+    Every sample lasts until the next sample of its day, at most HEART_RATE_SAMPLE_SECONDS.
+    """
+    records, days = (store or intraday_store).get_range(HEART_RATE, start_date, end_date)
+    if not len(records):
+        return {}
+
+    durations = np.full(len(records), HEART_RATE_SAMPLE_SECONDS, dtype=np.float64)
+    durations[:-1] = np.diff(records['timestamp']) / 1000
+    durations[:-1][days[1:] != days[:-1]] = HEART_RATE_SAMPLE_SECONDS  # Last sample of a day
+    durations = np.clip(durations, 0, HEART_RATE_SAMPLE_SECONDS)
+
+    zone_count = len(HEART_RATE_ZONE_FRACTIONS) + 1
+    zones = np.digitize(records['value'], np.array(HEART_RATE_ZONE_FRACTIONS) * max_heart_rate)
+    months, month_index = np.unique(days.astype('datetime64[M]'), return_inverse=True)
+    seconds = np.bincount(month_index * zone_count + zones, weights=durations,
+                          minlength=len(months) * zone_count).reshape(len(months), zone_count)
+    return {str(month): seconds[i] for i, month in enumerate(months)}
+
+
+def sleep_stage_distribution(start_date: date, end_date: date,
+                             store: Optional[IntradayStore] = None) -> Dict[str, float]:
+    """Total seconds in each sleep stage"""
+    records, _ = (store or intraday_store).get_range(SLEEP_STAGES, start_date, end_date)
+    stages = np.rint(records['value']).astype(np.int64)
+    known = (stages >= 0) & (stages < len(SLEEP_STAGE_NAMES))
+    if not known.all():
+        logger.debug(f"Ignoring {int((~known).sum())} sleep stage records with an unknown stage")
+    seconds = np.bincount(stages[known], weights=records['duration'][known], minlength=len(SLEEP_STAGE_NAMES))
+    return {name: float(seconds[i]) for i, name in enumerate(SLEEP_STAGE_NAMES)}
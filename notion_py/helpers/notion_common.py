@@ -1,12 +1,14 @@
 import functools
 import json
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 import requests
 
 from common import DateOffset, yesterday, create_date_range, create_day_summary_name, get_date_offset, find_state_items, \
-    today
+    today, RunDate, get_run_date
 from logger import logger, collect_handler
 from notion_py.helpers.notion_children_blocks import generate_simple_page_content, \
     generate_page_content_page_notion_link
@@ -24,6 +26,13 @@ headers = {
     "Notion-Version": "2022-06-28"
 }
 
+# Notion allows about 3 requests per second per integration, every thread of the process shares these slots
+NOTION_MAX_CONCURRENT_REQUESTS = 3
+NOTION_MAX_RETRIES = 5
+NOTION_RETRY_STATUS_CODES = (429, 502, 503, 504)
+NOTION_RETRY_BASE_DELAY = 1  # Seconds, doubled on every retry unless Notion sends Retry-After
+_notion_request_slots = threading.BoundedSemaphore(NOTION_MAX_CONCURRENT_REQUESTS)
+
 
 def create_notion_id_mapping():
     """Create mapping of Notion IDs to their descriptive names from Keys class"""
@@ -75,14 +84,46 @@ def get_page(page_id, get_children=False, print_response=False):
     return _invoke_notion_api(get_url, method=Method.GET, print_response=print_response)
 
 
+def get_page_property_items(page_id, property_id):
+    """Get all items of a paginated page property (relation, rollup, ...), which page objects truncate"""
+    page_id = page_id.strip().replace("-", "")
+    property_url = f"https://api.notion.com/v1/pages/{page_id}/properties/{property_id}"
+    items = []
+    start_cursor = None
+
+    while True:
+        url = f"{property_url}?start_cursor={start_cursor}" if start_cursor else property_url
+        response_data = _query_notion_api(url, method=Method.GET)
+        if 'results' not in response_data:  # Non paginated property
+            return [response_data]
+
+        items.extend(response_data['results'])
+        start_cursor = response_data.get('next_cursor')
+        if not response_data.get('has_more') or not start_cursor:
+            return items
+
+
 def get_db_info(db_id, print_response=False, print_response_type=''):
     get_db_url = f"https://api.notion.com/v1/databases/{db_id}"
     return _invoke_notion_api(get_db_url, method=Method.GET, print_response=print_response,
                               print_response_type=print_response_type)
 
 
-def get_db_pages(db_id, get_db_payload=None, print_response=False, print_response_type=''):
+@functools.lru_cache(maxsize=None)
+def get_db_property_ids(db_id) -> Dict[str, str]:
+    """Property name to property id of a database"""
+    return {name: db_property['id'] for name, db_property in get_db_info(db_id)['properties'].items()}
+
+
+def get_db_pages(db_id, get_db_payload=None, print_response=False, print_response_type='', filter_properties=None):
+    """
+    Query the pages of a database.
+    filter_properties - names of the only properties to return in each page, all properties when not given
+    """
     get_db_url = f"https://api.notion.com/v1/databases/{db_id}/query"
+    if filter_properties:
+        property_ids = get_db_property_ids(db_id)
+        get_db_url += "?" + "&".join(f"filter_properties={property_ids[name]}" for name in filter_properties)
     if get_db_payload is None:
         get_db_payload = {}
     return _invoke_notion_api(get_db_url, get_db_payload, method=Method.POST, print_response=print_response,
@@ -230,7 +271,8 @@ def _get_page_title(properties: dict) -> str:
     return 'Untitled'
 
 
-def get_pages_by_date_offset(database_id, offset: int, date_name="Date", filter_to_add={}):
+def get_pages_by_date_offset(database_id, offset: int, date_name="Date", filter_to_add={},
+                             run_date: Optional[RunDate] = None):
     """
     Queries the specified Notion database to find pages where the State is not empty
     and the Date is equal to the date corresponding to the provided offset.
@@ -238,12 +280,13 @@ def get_pages_by_date_offset(database_id, offset: int, date_name="Date", filter_
     Parameters:
     - database_id: The ID of the database to query.
     - offset: The DateOffset enum value indicating how many days ago to look.
+    - run_date: The date the offset is counted from, the run date of the current context by default.
 
     Returns:
     - List of page IDs that match the criteria.
     """
     # Calculate the target date based on the offset
-    target_date = datetime.now().date() - timedelta(days=offset)
+    target_date = (run_date or get_run_date()).date_for_offset(offset)
 
     # Get the target date in YYYY-MM-DD format
     target_date_str = target_date.isoformat()
@@ -533,7 +576,7 @@ def _invoke_notion_api(query_url, query_payload={}, method=Method.GET, print_res
     start_cursor = None
 
     resource_name = _get_notion_resource_name_from_id(query_url, query_payload)
-    logger.debug(f"Invoking {method.capitalize() if query_url.split('/')[-1] != 'query' else Method.GET.capitalize()} "
+    logger.debug(f"Invoking {method.capitalize() if query_url.split('?')[0].split('/')[-1] != 'query' else Method.GET.capitalize()} "
                  f"API {f'for {resource_name}' if resource_name else ''}")
 
     while True:
@@ -564,28 +607,38 @@ def _invoke_notion_api(query_url, query_payload={}, method=Method.GET, print_res
     return results
 
 
+def _send_notion_request(url, payload, method):
+    if method == Method.GET:
+        return requests.get(url, headers=headers)
+    if method == Method.DELETE:
+        return requests.delete(url, headers=headers)
+    if method == Method.POST:
+        return requests.post(url, headers=headers, json=payload) if payload else requests.post(url, headers=headers)
+    if method == Method.PATCH:
+        return requests.patch(url, headers=headers, json=payload) if payload else requests.patch(url, headers=headers)
+
+
+def _get_retry_delay(response, attempt):
+    retry_after = response.headers.get('Retry-After')
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return NOTION_RETRY_BASE_DELAY * 2 ** attempt
+
+
 def _query_notion_api(url, payload={}, method=None, start_cursor=None, print_response=False):
     if start_cursor:
         payload['start_cursor'] = start_cursor
     try:
-        if payload:
-            if method == Method.GET:
-                response = requests.get(url, headers=headers)
-            if method == Method.DELETE:
-                response = requests.delete(url, headers=headers)
-            elif method == Method.POST:
-                response = requests.post(url, headers=headers, json=payload)
-            elif method == Method.PATCH:
-                response = requests.patch(url, headers=headers, json=payload)
-        else:
-            if method == Method.GET:
-                response = requests.get(url, headers=headers)
-            if method == Method.DELETE:
-                response = requests.delete(url, headers=headers)
-            elif method == Method.POST:
-                response = requests.post(url, headers=headers)
-            elif method == Method.PATCH:
-                response = requests.patch(url, headers=headers)
+        for attempt in range(NOTION_MAX_RETRIES + 1):
+            with _notion_request_slots:
+                response = _send_notion_request(url, payload, method)
+            if response.status_code not in NOTION_RETRY_STATUS_CODES or attempt == NOTION_MAX_RETRIES:
+                break
+            delay = _get_retry_delay(response, attempt)
+            logger.info(f"Notion responded {response.status_code}, retrying in {delay:.0f}s "
+                        f"({attempt + 1}/{NOTION_MAX_RETRIES})")
+            time.sleep(delay)
 
         response.raise_for_status()  # Raise HTTPError for bad response status codes
         if print_response:
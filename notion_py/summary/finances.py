@@ -3,7 +3,11 @@ from collections import defaultdict
 from datetime import date, timedelta
 from typing import List, Dict, Optional
 
-from expense.expense_constants import ENGLISH_CATEGORY
+from common import calculate_month_boundaries
+from expense.expense_constants import ENGLISH_CATEGORY, EXPENSE_LEDGER_ENABLED
+from expense.expense_ledger import ExpenseLedger
+from expense.expense_month_snapshot import MonthSnapshot, get_top_expenses
+from logger import logger
 from notion_py.helpers.notion_children_blocks import (
     create_toggle_heading_block,
     create_section_text_with_bullet, create_block_with_db_view, create_heading_3_block, create_paragraph_block,
@@ -33,6 +37,17 @@ class FinancesComponent(BaseComponent):
         self.monthly_category_expense_db_id = monthly_category_expense_db
         self.monthly_expenses_summary_previous_month_view_link = monthly_expenses_summary_previous_month_view_link
         self.monthly_expense_chart_link = monthly_expense_chart_link
+        self._ledger: Optional[ExpenseLedger] = None
+
+    @property
+    def ledger(self) -> Optional[ExpenseLedger]:
+        """Local expense ledger holding the month snapshots, None when disabled or unavailable"""
+        if self._ledger is None and EXPENSE_LEDGER_ENABLED:
+            try:
+                self._ledger = ExpenseLedger()
+            except Exception as e:
+                logger.error(f"Error opening the expense ledger: {str(e)}")
+        return self._ledger
 
     def _initialize_metrics(self):
         """Initialize financial metrics for current and previous months"""
@@ -42,7 +57,12 @@ class FinancesComponent(BaseComponent):
         self._previous_metrics = self._get_month_metrics(previous_month)
 
     def _get_month_metrics(self, target_date: date) -> Dict:
-        """Get metrics from monthly category database for the given month"""
+        """Get metrics from the month snapshot, or from monthly category database when there is none"""
+        snapshot = self.ledger.get_month_snapshot(target_date.strftime('%Y-%m')) if self.ledger else None
+        if snapshot:
+            logger.debug(f"Using the finance snapshot of {target_date.strftime('%B %Y')}")
+            return self._get_snapshot_metrics(snapshot)
+
         month_pages = self._get_pages_for_month(
             self.monthly_category_expense_db_id,
             target_date,
@@ -52,11 +72,37 @@ class FinancesComponent(BaseComponent):
         if not month_pages:
             return self._get_empty_metrics()
 
+        self._materialize_snapshot(target_date, month_pages)
         return {
             **self._calculate_category_metrics(month_pages),
             FinanceFields.TOP_CATEGORIES: self._get_category_summary(month_pages)
         }
 
+    def _get_snapshot_metrics(self, snapshot: MonthSnapshot) -> Dict:
+        return {
+            FinanceFields.TOTAL_EXPENSES: snapshot.total_expenses,
+            FinanceFields.INCOME: snapshot.income,
+            FinanceFields.SAVING: snapshot.saving,
+            FinanceFields.TOP_CATEGORIES: snapshot.categories,
+            FinanceFields.LARGEST_EXPENSES: snapshot.top_expenses
+        }
+
+    def _materialize_snapshot(self, target_date: date, month_pages: List[Dict]):
+        """Store the snapshot of a closed month, later summaries of the month read it instead of Notion"""
+        first_day, last_day = calculate_month_boundaries(target_date)
+        if not self.ledger or last_day >= date.today():
+            return
+
+        try:
+            month_expenses = [expense for expense in
+                              self.ledger.get_expenses_by_date(first_day.isoformat(), last_day.isoformat())
+                              if not expense.excluded_from_average]
+            snapshot = MonthSnapshot.from_pages(target_date.strftime('%Y-%m'), month_pages,
+                                                top_expenses=get_top_expenses(month_expenses), closed=True)
+            self.ledger.save_month_snapshot(snapshot)
+        except Exception as e:
+            logger.error(f"Error saving the finance snapshot of {target_date.strftime('%B %Y')}: {str(e)}")
+
     def _get_empty_metrics(self) -> Dict:
         """Return empty metrics structure"""
         return {
@@ -1,9 +1,14 @@
 import calendar
-from collections import defaultdict
-from datetime import date, datetime, timedelta
-from typing import List, Dict, Optional
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Callable, List, Dict, Optional, Tuple
 
-from common import calculate_average_time, seconds_to_hours_minutes, parse_duration_to_seconds
+import numpy as np
+
+from common import seconds_to_hours_minutes, parse_duration_to_seconds, calculate_month_boundaries
+from garmin.garmin_rollups import HealthRollups
+from garmin.garmin_timeseries import IntradayStore, intraday_store, average_resting_heart_rate, \
+    time_in_zones_by_month, sleep_stage_distribution
 from logger import logger
 from notion_py.helpers.notion_children_blocks import create_stats_list, create_table_block, create_heading_3_block, \
     create_toggle_heading_block
@@ -24,15 +29,130 @@ class HealthFields:
     MISSING_DAYS = "missing_days"
     AVG_CALORIES = "avg_calories"
     AVG_WEIGHT = "avg_weight"
+    AVG_RESTING_HEART_RATE = "avg_resting_heart_rate"
+    HEART_RATE_ZONES = "heart_rate_zones"
+    SLEEP_STAGES = "sleep_stages"
+    SLEEP_12_MONTH_AVERAGE = "sleep_12_month_average"
+    STEPS_YEAR_OVER_YEAR = "steps_year_over_year"
+
+
+DAY_START_HOUR = 4  # Bed times before this hour belong to the night before
+
+
+def _parse_column(values: List[str], parse: Callable[[str], int]) -> np.ndarray:
+    """Parse a column of strings, each distinct string once"""
+    if not values:
+        return np.empty(0, dtype=np.int64)
+    unique_values, inverse = np.unique(np.array(values), return_inverse=True)
+    return np.array([parse(value) for value in unique_values], dtype=np.int64)[inverse.reshape(-1)]
+
+
+def _clock_minutes(clock: str) -> int:
+    parsed = datetime.strptime(clock, '%H:%M')
+    return parsed.hour * 60 + parsed.minute
+
+
+def _sequential_sum(values: np.ndarray):
+    """Sum in row order, like sum() - floats come out the same to the last bit"""
+    return values.cumsum()[-1].item() if len(values) else 0
+
+
+def _average_time_of_day(clock_minutes: np.ndarray) -> Optional[time]:
+    """
+    Average of times of day given in minutes past midnight, the same as calculate_average_time.
+    The circle of the day is cut at DAY_START_HOUR, so times after midnight count as late times of the day before.
+    """
+    if not len(clock_minutes):
+        return None
+    minutes = np.where(clock_minutes < DAY_START_HOUR * 60, clock_minutes + 24 * 60, clock_minutes)
+    avg_minutes = int(minutes.sum()) / len(minutes)
+    return time(int(avg_minutes // 60) % 24, int(avg_minutes % 60))
+
+
+@dataclass
+class _HealthColumns:
+    """Garmin page properties as columns, only the pages where a property is set have a row in its column"""
+    steps: np.ndarray
+    calories: np.ndarray
+    weights: np.ndarray
+    sleep_minutes: np.ndarray  # Sleep start, minutes past midnight
+    wake_minutes: np.ndarray
+    sleep_seconds: np.ndarray
+    sleep_has_activities: np.ndarray  # Whether the page of each sleep duration has an Activities property
+    activity_names: np.ndarray  # One row per activity of a page
+    activity_seconds: np.ndarray  # Activity duration of the page of each activity row
+
+    @classmethod
+    def from_pages(cls, pages: List[Dict]) -> '_HealthColumns':
+        steps, calories, weights = [], [], []
+        sleep_starts, sleep_ends, sleep_durations, sleep_has_activities = [], [], [], []
+        activity_names, activity_page_durations = [], []
+
+        for page in pages:
+            props = page['properties']
+
+            if props.get('Calories', {}).get('number'):
+                calories.append(props['Calories']['number'])
+            if props.get('Steps', {}).get('number'):
+                steps.append(props['Steps']['number'])
+            if props.get('Weight', {}).get('number'):
+                weights.append(props['Weight']['number'])
+
+            if props.get('Sleep Start', {}).get('rich_text'):
+                sleep_starts.append(props['Sleep Start']['rich_text'][0]['plain_text'])
+            if props.get('Sleep End', {}).get('rich_text'):
+                sleep_ends.append(props['Sleep End']['rich_text'][0]['plain_text'])
+            if props.get('Sleep Duration', {}).get('rich_text'):
+                sleep_durations.append(props['Sleep Duration']['rich_text'][0]['plain_text'])
+                sleep_has_activities.append(bool(props.get('Activities')))
+
+            page_activities = props.get('Activities', {}).get('multi_select')
+            if page_activities:
+                duration = props['Activity Duration']['rich_text'][0]['plain_text'] \
+                    if props.get('Activity Duration', {}).get('rich_text') else ""
+                for activity in page_activities:
+                    activity_names.append(activity['name'])
+                    activity_page_durations.append(duration)
+
+        return cls(
+            steps=np.array(steps),
+            calories=np.array(calories),
+            weights=np.array(weights, dtype=np.float64),
+            sleep_minutes=_parse_column(sleep_starts, _clock_minutes),
+            wake_minutes=_parse_column(sleep_ends, _clock_minutes),
+            sleep_seconds=_parse_column(sleep_durations, parse_duration_to_seconds),
+            sleep_has_activities=np.array(sleep_has_activities, dtype=bool),
+            activity_names=np.array(activity_names),
+            activity_seconds=_parse_column(activity_page_durations, parse_duration_to_seconds)
+        )
+
+    def group_activities(self) -> List[Tuple[str, int, int]]:
+        """(name, sessions, total duration seconds) of every activity, in order of first appearance"""
+        if not len(self.activity_names):
+            return []
+        names, first_index, inverse = np.unique(self.activity_names, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        sessions = np.bincount(inverse)
+        durations = np.bincount(inverse, weights=self.activity_seconds)
+        return [(str(names[i]), int(sessions[i]), int(durations[i])) for i in np.argsort(first_index)]
 
 
 class HealthComponent(BaseComponent):
     def __init__(self, garmin_db_id, garmin_view_link, monthly_health_metrics_db_id,
-                 target_date: Optional[date] = None):
+                 target_date: Optional[date] = None, intraday: Optional[IntradayStore] = None,
+                 rollups: Optional[HealthRollups] = None):
         super().__init__(target_date, HealthFields)
         self.garmin_db_id = garmin_db_id
         self.garmin_view_link = garmin_view_link
         self.monthly_health_metrics_db_id = monthly_health_metrics_db_id
+        self.intraday = intraday or intraday_store
+        self._rollups = rollups
+
+    @property
+    def rollups(self) -> HealthRollups:
+        if self._rollups is None:
+            self._rollups = HealthRollups()
+        return self._rollups
 
     def _initialize_metrics(self):
         """Initializes health metrics for the target date"""
@@ -44,6 +164,47 @@ class HealthComponent(BaseComponent):
         self._current_metrics = self._calculate_health_metrics(current_month_pages, update_monthly_metrics=True)
         self._previous_metrics = self._calculate_health_metrics(previous_month_pages)
 
+        self._current_metrics.update(self._calculate_intraday_metrics(self.target_date))
+        self._previous_metrics.update(self._calculate_intraday_metrics(previous_month))
+
+        self._current_metrics.update(self._calculate_trend_metrics(current_month_pages + previous_month_pages,
+                                                                   self.target_date))
+
+    def _calculate_trend_metrics(self, pages: List[Dict], month_date: date) -> Dict:
+        """12-month sleep average and year-over-year steps from the health rollups, which the pages are added to"""
+        month = month_date.strftime('%Y-%m')
+        try:
+            self.rollups.add_pages(pages)
+            sleep_average = self.rollups.rolling_average("sleep_seconds", month, months=12)
+            steps, steps_year_before = self.rollups.year_over_year("steps", month)
+        except Exception as e:
+            logger.error(f"Error reading health rollups for {month_date.strftime('%B %Y')}: {str(e)}")
+            return {}
+
+        return {
+            HealthFields.SLEEP_12_MONTH_AVERAGE: seconds_to_hours_minutes(sleep_average) if sleep_average else "N/A",
+            HealthFields.STEPS_YEAR_OVER_YEAR: {'current': round(steps) if steps else 0,
+                                                'year_before': round(steps_year_before) if steps_year_before else 0}
+        }
+
+    def _calculate_intraday_metrics(self, month_date: date) -> Dict:
+        """Resting heart rate, time in heart rate zones and sleep stages of a month from the local time series"""
+        first_day, last_day = calculate_month_boundaries(month_date)
+        try:
+            zone_seconds = time_in_zones_by_month(first_day, last_day, store=self.intraday)
+            month_zone_seconds = zone_seconds.get(first_day.strftime('%Y-%m'))
+            return {
+                HealthFields.AVG_RESTING_HEART_RATE:
+                    average_resting_heart_rate(first_day, last_day, store=self.intraday) or 0,
+                HealthFields.HEART_RATE_ZONES: [float(seconds) for seconds in month_zone_seconds[1:]]
+                if month_zone_seconds is not None else [],
+                HealthFields.SLEEP_STAGES: sleep_stage_distribution(first_day, last_day, store=self.intraday)
+            }
+        except Exception as e:
+            logger.error(f"Error reading intraday health data for {month_date.strftime('%B %Y')}: {str(e)}")
+            return {HealthFields.AVG_RESTING_HEART_RATE: 0, HealthFields.HEART_RATE_ZONES: [],
+                    HealthFields.SLEEP_STAGES: {}}
+
     def _is_monthly_metrics_exist(self):
         filter_payload = {
             "property": "Name",
@@ -97,87 +258,40 @@ class HealthComponent(BaseComponent):
 
     def _calculate_health_metrics(self, pages: List[Dict], update_monthly_metrics=False) -> Dict:
         """Calculates health metrics from Garmin pages"""
-        avg_weight = 0
-        total_steps = 0
-        total_sleep_seconds = 0
-        days_count = 0
-        activities = defaultdict(lambda: {'sessions': 0, 'duration': 0})
-        sleep_times = []
-        wake_times = []
-        calories = []
+        columns = _HealthColumns.from_pages(pages)
 
         # Get total days in month
         if pages:
             first_date = datetime.strptime(pages[0]['properties']['Date']['date']['start'], '%Y-%m-%d')
             total_days = calendar.monthrange(first_date.year, first_date.month)[1]
-            tracked_days = len(pages)
-            missing_days = total_days - tracked_days
+            missing_days = total_days - len(pages)
         else:
             missing_days = 0
 
-        for page in pages:
-            props = page['properties']
-
-            if props.get('Calories', {}).get('number'):
-                calories.append(props['Calories']['number'])
-
-            # Track sleep/wake times
-            if props.get('Sleep Start', {}).get('rich_text'):
-                sleep_time = props['Sleep Start']['rich_text'][0]['plain_text']
-                sleep_times.append(datetime.strptime(sleep_time, '%H:%M').time())
+        # Days with steps, and days with sleep that have no Activities property
+        days_count = len(columns.steps) + int(np.count_nonzero((columns.sleep_seconds > 0) &
+                                                               ~columns.sleep_has_activities))
+        total_steps = _sequential_sum(columns.steps)
+        total_sleep_seconds = _sequential_sum(columns.sleep_seconds)
+        avg_weight = round(_sequential_sum(columns.weights) / len(columns.weights), 1) if len(columns.weights) else 0
 
-            if props.get('Sleep End', {}).get('rich_text'):
-                wake_time = props['Sleep End']['rich_text'][0]['plain_text']
-                wake_times.append(datetime.strptime(wake_time, '%H:%M').time())
-
-            # Count activities
-            if props.get('Activities', {}).get('multi_select'):
-                for activity in props['Activities']['multi_select']:
-                    activities[activity['name']]['sessions'] += 1
-                    if props.get('Activity Duration', {}).get('rich_text'):
-                        duration_str = props['Activity Duration']['rich_text'][0]['plain_text']
-                        duration_seconds = parse_duration_to_seconds(duration_str)
-                        activities[activity['name']]['duration'] += duration_seconds
-
-            # Track steps
-            if props.get('Steps', {}).get('number'):
-                total_steps += props['Steps']['number']
-                days_count += 1
-
-            # Track sleep
-            if props.get('Sleep Duration', {}).get('rich_text'):
-                sleep_str = props['Sleep Duration']['rich_text'][0]['plain_text']
-                sleep_seconds = parse_duration_to_seconds(sleep_str)
-                if sleep_seconds:
-                    total_sleep_seconds += sleep_seconds
-                    if not props.get('Activities'):  # Only count days without activities
-                        days_count += 1
-
-            weights = []
-            for page in pages:
-                weight = page['properties'].get('Weight', {}).get('number')
-                if weight:
-                    weights.append(weight)
-
-            avg_weight = round(sum(weights) / len(weights), 1) if weights else 0
-
-        # Format activities for output
         formatted_activities = [
             {
                 'name': name,
-                'sessions': stats['sessions'],
-                'duration': seconds_to_hours_minutes(stats['duration'])
+                'sessions': sessions,
+                'duration': seconds_to_hours_minutes(duration)
             }
-            for name, stats in activities.items()
+            for name, sessions, duration in columns.group_activities()
         ]
 
-        avg_sleep_time = calculate_average_time(sleep_times) if sleep_times else None
-        avg_wake_time = calculate_average_time(wake_times) if wake_times else None
+        avg_sleep_time = _average_time_of_day(columns.sleep_minutes)
+        avg_wake_time = _average_time_of_day(columns.wake_minutes)
 
         health_metrics = {
             HealthFields.TOTAL_WORKOUTS: sum(activity['sessions'] for activity in formatted_activities),
             HealthFields.AVG_STEPS: round(total_steps / days_count) if days_count > 0 else 0,
-            HealthFields.AVG_CALORIES: round(sum(calories) / len(calories)) if calories else 0,
+            HealthFields.AVG_CALORIES: round(_sequential_sum(columns.calories) / len(columns.calories))
+            if len(columns.calories) else 0,
             HealthFields.AVG_SLEEP_DURATION: seconds_to_hours_minutes(
                 total_sleep_seconds / days_count) if days_count > 0 else "0h",
             HealthFields.ACTIVITIES: sorted(formatted_activities, key=lambda x: x['sessions'], reverse=True),
@@ -214,6 +328,10 @@ class HealthComponent(BaseComponent):
             ["📅 Missing Days", metrics[HealthFields.MISSING_DAYS]['current'],
              f"📅 Previous: {metrics[HealthFields.MISSING_DAYS]['previous']}"]
         ]
+        if metrics[HealthFields.AVG_RESTING_HEART_RATE]['current']:
+            main_metrics.append(["❤️ Resting Heart Rate", f"{metrics[HealthFields.AVG_RESTING_HEART_RATE]['current']}bpm",
+                                 self.format_change_value(HealthFields.AVG_RESTING_HEART_RATE,
+                                                          invert_comparison=True)])
 
         activities_stats = [
             f"{activity['name']}: {activity['sessions']} sessions ({activity['duration']})"
@@ -225,6 +343,32 @@ class HealthComponent(BaseComponent):
                      create_heading_3_block("Activities Breakdown"),
                  ] + create_stats_list(activities_stats)
 
+        trends_stats = []
+        if self.current_metrics.get(HealthFields.SLEEP_12_MONTH_AVERAGE, "N/A") != "N/A":
+            trends_stats.append(f"12-Month Average Sleep: {self.current_metrics[HealthFields.SLEEP_12_MONTH_AVERAGE]}")
+        steps_year_over_year = self.current_metrics.get(HealthFields.STEPS_YEAR_OVER_YEAR)
+        if steps_year_over_year and steps_year_over_year['current'] and steps_year_over_year['year_before']:
+            change = (steps_year_over_year['current'] / steps_year_over_year['year_before'] - 1) * 100
+            trends_stats.append(f"Average Steps vs {self.target_date.strftime('%B')} last year: "
+                                f"{steps_year_over_year['current']:,} vs {steps_year_over_year['year_before']:,} "
+                                f"({change:+.1f}%)")
+        if trends_stats:
+            blocks += [create_heading_3_block("Trends")] + create_stats_list(trends_stats)
+
+        zone_seconds = self.current_metrics.get(HealthFields.HEART_RATE_ZONES)
+        if zone_seconds and sum(zone_seconds):
+            blocks += [create_heading_3_block("Heart Rate Zones")] + create_stats_list([
+                f"Zone {zone}: {seconds_to_hours_minutes(seconds)}" for zone, seconds in enumerate(zone_seconds, 1)
+            ])
+
+        sleep_stages = self.current_metrics.get(HealthFields.SLEEP_STAGES)
+        total_sleep_stage_seconds = sum(sleep_stages.values()) if sleep_stages else 0
+        if total_sleep_stage_seconds:
+            blocks += [create_heading_3_block("Sleep Stages")] + create_stats_list([
+                f"{stage.title()}: {seconds_to_hours_minutes(seconds)} ({seconds / total_sleep_stage_seconds:.0%})"
+                for stage, seconds in sleep_stages.items()
+            ])
+
         return create_toggle_heading_block("🏃‍♂️ Health & Activity - 🔗", blocks, heading_number=2,
                                            link_url={
                                                "url": self.garmin_view_link,